@@ -1,9 +1,40 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import bcrypt
 
-def hash_password(password: str) -> str:
-    salt = bcrypt.gensalt()
+# هزینه‌ی bcrypt (لگاریتم تعداد دورها)؛ مقدار پیش‌فرض خود کتابخانه ۱۲ است
+BCRYPT_ROUNDS = int(os.environ.get("SCHOOLBOT_BCRYPT_ROUNDS", 12))
+
+# تعداد thread های هش رمز؛ bcrypt هنگام محاسبه GIL را آزاد می‌کند، پس thread ها واقعاً موازی‌اند
+PASSWORD_WORKERS = int(os.environ.get("SCHOOLBOT_PASSWORD_WORKERS", os.cpu_count() or 2))
+
+_password_executor = ThreadPoolExecutor(max_workers=PASSWORD_WORKERS, thread_name_prefix="bcrypt")
+
+
+def hash_password(password: str, rounds: int = None) -> str:
+    salt = bcrypt.gensalt(rounds or BCRYPT_ROUNDS)
     hashed_password = bcrypt.hashpw(password.encode('utf-8'), salt)
     return hashed_password.decode('utf-8')
 
+
+def is_bcrypt_hash(hashed_password: str) -> bool:
+    return bool(hashed_password) and hashed_password.startswith(("$2a$", "$2b$", "$2y$"))
+
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
\ No newline at end of file
+    return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+
+# ---------- نسخه‌های async (برای هندلرهای ربات) ----------
+# bcrypt عمداً ۱۰۰ تا ۳۰۰ میلی‌ثانیه CPU مصرف می‌کند؛ اجرای آن روی event loop کل ربات را متوقف می‌کند.
+# این توابع کار را به استخر محدود _password_executor می‌سپارند و loop آزاد می‌ماند.
+async def hash_password_async(password: str, rounds: int = None) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_password_executor, hash_password, password, rounds)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_password_executor, verify_password, plain_password, hashed_password)
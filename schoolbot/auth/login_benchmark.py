@@ -0,0 +1,75 @@
+# schoolbot/auth/login_benchmark.py
+"""
+سنجش تأخیر event loop هنگام هجوم ورود هم‌زمان.
+
+    python -m schoolbot.auth.login_benchmark [--logins 100] [--rounds 12]
+
+دو حالت مقایسه می‌شود: بررسی رمز به صورت هم‌گام روی خود loop (رفتار قبلی)
+و verify_password_async (استخر جداگانه). در تمام مدت یک «ضربان» هر ۱۰ میلی‌ثانیه
+بیدار می‌شود و میزان تأخیرش ثبت می‌شود؛ این همان تأخیری است که سایر کاربران ربات حس می‌کنند.
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from schoolbot.auth.auth import BCRYPT_ROUNDS, PASSWORD_WORKERS, hash_password, verify_password, \
+    verify_password_async
+
+TICK_SECONDS = 0.01
+
+
+async def _heartbeat(lags: list, stop: asyncio.Event):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK_SECONDS)
+        lags.append(time.perf_counter() - started - TICK_SECONDS)
+
+
+async def _blocking_login(password: str, hashed: str) -> bool:
+    return verify_password(password, hashed)
+
+
+async def _run_burst(login, logins: int, password: str, hashed: str) -> dict:
+    lags, stop = [], asyncio.Event()
+    heartbeat = asyncio.create_task(_heartbeat(lags, stop))
+    await asyncio.sleep(TICK_SECONDS * 2)  # چند ضربان پیش از شروع
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(login(password, hashed) for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await heartbeat
+    lags_ms = sorted(lag * 1000 for lag in lags) or [0.0]
+    return {
+        "ok": all(results),
+        "total": elapsed,
+        "p50": statistics.median(lags_ms),
+        "p99": lags_ms[min(len(lags_ms) - 1, int(len(lags_ms) * 0.99))],
+        "max": lags_ms[-1],
+    }
+
+
+def run_benchmark(logins: int = 100, rounds: int = BCRYPT_ROUNDS) -> dict:
+    password = "1234"
+    hashed = hash_password(password, rounds)
+    results = {
+        "blocking": asyncio.run(_run_burst(_blocking_login, logins, password, hashed)),
+        "async": asyncio.run(_run_burst(verify_password_async, logins, password, hashed)),
+    }
+
+    print(f"📊 {logins} ورود هم‌زمان، bcrypt rounds={rounds}، استخر {PASSWORD_WORKERS} thread")
+    for mode, r in results.items():
+        print(f"  {mode:9} کل: {r['total']:.2f} ثانیه | تأخیر loop (ms) "
+              f"p50={r['p50']:.1f} p99={r['p99']:.1f} max={r['max']:.1f}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="سنجش تأخیر event loop هنگام ورود هم‌زمان")
+    parser.add_argument("--logins", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=BCRYPT_ROUNDS)
+    args = parser.parse_args()
+    run_benchmark(args.logins, args.rounds)
@@ -1,12 +1,17 @@
 import logging
 from balethon.client import Client
 
-from schoolbot.handlers.teacher_handler import handle_teacher_message
+from schoolbot.handlers.teacher_handler import flush_teacher_scores, handle_teacher_message
 from schoolbot.handlers.manager_handler import handle_manager_message
 from schoolbot.handlers.student_handler import handle_student_message
 
+from schoolbot.chart.render_service import render_service
+from schoolbot.database.migrations import run_migrations
 from schoolbot.utils.keyboards import normalize_digits
-from schoolbot.services.auth_service import check_login, change_password
+from schoolbot.services.auth_service import check_login_async, change_password_async
+from schoolbot.services.chat_dispatcher import ChatDispatcher
+from schoolbot.services.outbox import Outbox
+from schoolbot.services.session_store import flush_sessions, session_store
 from schoolbot.utils.log_change_password import user_bale_info, log_attributes_user_student_change_pass
 
 # 📌 فقط خطاها (ERROR و بالاتر) لاگ شوند
@@ -21,6 +26,8 @@ logging.getLogger("balethon").setLevel(logging.WARNING)
 
 TOKEN = "YOUR_TOKEN_HERE"
 client = Client(TOKEN)
+# همه‌ی پیام‌های خروجی (ربات و هندلرها) از صف ارسال با محدودیت نرخ عبور می‌کنند
+outbox = Outbox(client)
 
 ROLES = {
     "manager": {"key": "manager", "title": "👨‍💼 مدیر"},
@@ -28,7 +35,7 @@ ROLES = {
     "student": {"key": "student", "title": "🎓 دانش‌آموز"},
 }
 
-user_sessions = {}  # ذخیره اطلاعات کاربران
+user_sessions = session_store("bot")  # ذخیره اطلاعات کاربران (با راه‌اندازی دوباره از دیتابیس بازیابی می‌شود)
 
 
 async def show_main_menu(chat_id, user_bale):
@@ -37,19 +44,20 @@ async def show_main_menu(chat_id, user_bale):
         role = session.get("role")
 
         if role == ROLES["manager"]["key"]:
-            await client.send_message(
+            await outbox.send_message(
                 chat_id,
                 "📋 منوی مدیر:\n"
                 "1️⃣ ایجاد دوره کارنامه\n"
                 "2️⃣ مشاهده وضعیت دانش‌آموزان\n"
                 "3️⃣ تأیید دوره کارنامه\n"
-                "4️⃣ بررسی وضعیت ثبت نمرات\n\n"
+                "4️⃣ بررسی وضعیت ثبت نمرات\n"
+                "5️⃣ ارسال دوباره‌ی یادآوری‌های ناموفق\n\n"
                 "🔑 برای تغییر رمز عبور، فقط `+` بفرستید."
             )
             session["step"] = "manager_menu"
 
         elif role == ROLES["teacher"]["key"]:
-            await client.send_message(
+            await outbox.send_message(
                 chat_id,
                 "📋 منوی معلم:\n"
                 "1️⃣ مشاهده دوره‌ها و دروس\n"
@@ -58,11 +66,11 @@ async def show_main_menu(chat_id, user_bale):
             session["step"] = "teacher_menu"
 
         elif role == ROLES["student"]["key"]:
-            await  client.send_message(
+            await outbox.send_message(
                 chat_id,
                 f"{user_bale_info(user_bale)}"
             )
-            await client.send_message(
+            await outbox.send_message(
                 chat_id,
                 "📋 منوی دانش‌آموز:\n"
                 "1️⃣ مشاهده کارنامه‌ها\n"
@@ -73,13 +81,24 @@ async def show_main_menu(chat_id, user_bale):
         user_sessions[chat_id] = session
     except Exception as e:
         logging.error(f"❌ خطا در show_main_menu: {e}")
-        await client.send_message(chat_id, "⚠️ مشکلی در نمایش منو پیش آمد. لطفاً دوباره تلاش کنید.")
+        await outbox.send_message(chat_id, "⚠️ مشکلی در نمایش منو پیش آمد. لطفاً دوباره تلاش کنید.")
+
+
+async def flush_teacher_session(session):
+    """نمرات بافرشده‌ی ثبت کلاسی معلم پیش از ترک منوی معلم (/start یا تغییر رمز) ذخیره می‌شوند"""
+    if session.get("role") != ROLES["teacher"]["key"] or not session.get("user_id"):
+        return
+    try:
+        await flush_teacher_scores(session["user_id"])
+    except Exception as e:
+        logging.error(f"❌ خطا در ذخیره نمرات باقی‌مانده‌ی معلم: {e}")
 
 
 async def reset_bot(chat_id):
     try:
+        await flush_teacher_session(user_sessions.get(chat_id) or {})
         user_sessions[chat_id] = {"step": "choose_role"}
-        await client.send_message(
+        await outbox.send_message(
             chat_id,
             "🔄 *باله* آماده می باشد.\nنقش خود را انتخاب کنید:\n1️⃣ مدیر\n2️⃣ معلم\n3️⃣ دانش‌آموز"
         )
@@ -87,11 +106,11 @@ async def reset_bot(chat_id):
         logging.error(f"❌ خطا در reset_bot: {e}")
 
 
-@client.on_message()
 async def handle_message(message):
     try:
         text = normalize_digits(message.text.strip())  # ← نرمال‌سازی اعداد
         chat_id = message.chat.id
+        await user_sessions.prefetch(chat_id)
         # ریست با /start یا /خروج
         if text.lower() in ["/start", "/خروج"]:
             await reset_bot(chat_id)
@@ -110,30 +129,30 @@ async def handle_message(message):
             roles = {"1": ROLES["manager"]["key"], "2": ROLES["teacher"]["key"], "3": ROLES["student"]["key"]}
             role = roles.get(text)
             if not role:
-                await client.send_message(chat_id, "لطفاً عدد ۱ تا ۳ را وارد کنید.")
+                await outbox.send_message(chat_id, "لطفاً عدد ۱ تا ۳ را وارد کنید.")
                 return
             session["role"] = role
             session["step"] = "ask_username"
-            await client.send_message(chat_id, "نام کاربری خود را وارد کنید:")
+            await outbox.send_message(chat_id, "نام کاربری خود را وارد کنید:")
             return
 
         if session.get("step") == "ask_username":
             session["username"] = text
             session["step"] = "ask_password"
-            await client.send_message(chat_id, "رمز عبور خود را وارد کنید:")
+            await outbox.send_message(chat_id, "رمز عبور خود را وارد کنید:")
             return
 
         if session.get("step") == "ask_password":
             try:
-                ok, db_user_id, name = check_login(session["username"], text, session["role"])
+                ok, db_user_id, name = await check_login_async(session["username"], text, session["role"])
             except Exception as e:
                 logging.error(f"❌ خطا در check_login: {e}")
-                await client.send_message(chat_id, "⚠️ خطا در ورود. لطفاً بعداً تلاش کنید.")
+                await outbox.send_message(chat_id, "⚠️ خطا در ورود. لطفاً بعداً تلاش کنید.")
                 return
 
             if not ok:
-                await client.send_message(chat_id, "❌ نام کاربری یا رمز عبور اشتباه است. دوباره تلاش کنید. \n می توانید با /start به منوی قبل باز گردید.")
-                await client.send_message(chat_id, "نام کاربری خود را وارد کنید:")
+                await outbox.send_message(chat_id, "❌ نام کاربری یا رمز عبور اشتباه است. دوباره تلاش کنید. \n می توانید با /start به منوی قبل باز گردید.")
+                await outbox.send_message(chat_id, "نام کاربری خود را وارد کنید:")
                 session["step"] = "ask_username"
                 return
 
@@ -141,7 +160,7 @@ async def handle_message(message):
             session["name"] = name
             role_title = ROLES[session["role"]]["title"]
 
-            await client.send_message(
+            await outbox.send_message(
                 chat_id,
                 f"✅ ورود موفق!\n\n"
                 f"🔹 نقش شما: {role_title}\n"
@@ -159,18 +178,19 @@ async def handle_message(message):
 
             new_password = text
             try:
-                change_password(session["user_id"], new_password, session["role"], message.author['id'])
-                await client.send_message(chat_id, "✅ رمز عبور با موفقیت تغییر یافت.")
+                await change_password_async(session["user_id"], new_password, session["role"], message.author['id'])
+                await outbox.send_message(chat_id, "✅ رمز عبور با موفقیت تغییر یافت.")
             except Exception as e:
                 logging.error(f"❌ خطا در change_password: {e}")
-                await client.send_message(chat_id, "⚠️ خطا در تغییر رمز عبور. لطفاً دوباره تلاش کنید.")
+                await outbox.send_message(chat_id, "⚠️ خطا در تغییر رمز عبور. لطفاً دوباره تلاش کنید.")
             await show_main_menu(chat_id, message.author)
             return
 
         # تغییر رمز با "+"
         if text == "+":
+            await flush_teacher_session(session)
             session["step"] = "ask_new_password"
-            await client.send_message(chat_id, "🔑 لطفاً رمز عبور جدید خود را وارد کنید:")
+            await outbox.send_message(chat_id, "🔑 لطفاً رمز عبور جدید خود را وارد کنید:")
             return
 
         # فراخوانی هندلر بر اساس نقش
@@ -181,11 +201,11 @@ async def handle_message(message):
         try:
             result = None  # تعریف متغیر برای دریافت نتیجه
             if role == ROLES["manager"]["key"]:
-                result = await handle_manager_message(client, chat_id, user_id, text, name)
+                result = await handle_manager_message(outbox, chat_id, user_id, text, name)
             elif role == ROLES["teacher"]["key"]:
-                result = await handle_teacher_message(client, chat_id, user_id, text, name)
+                result = await handle_teacher_message(outbox, chat_id, user_id, text, name)
             elif role == ROLES["student"]["key"]:
-                result = await handle_student_message(client, chat_id, user_id, text, name)
+                result = await handle_student_message(outbox, chat_id, user_id, text, name)
 
             # بررسی سیگنال بازگشتی از هندلر
             if result == "RESET_SESSION":
@@ -196,17 +216,39 @@ async def handle_message(message):
 
         except Exception as e:
             logging.error(f"❌ خطا در هندلر {role}: {e}")
-            await client.send_message(chat_id, "⚠️ خطا در پردازش پیام. لطفاً دوباره تلاش کنید.")
+            await outbox.send_message(chat_id, "⚠️ خطا در پردازش پیام. لطفاً دوباره تلاش کنید.")
 
     except Exception as e:
         logging.error(f"❌ خطا در handle_message: {e}")
 
 
+async def notify_queue_full(chat_id):
+    await outbox.send_message(chat_id, "⏳ پیام‌های قبلی شما هنوز در حال پردازش است؛ لطفاً کمی صبر کنید و دوباره بفرستید.")
+
+
+# پیام‌های هر گفتگو به ترتیب و یکی‌یکی، گفتگوهای مختلف هم‌زمان (با سقف) پردازش می‌شوند
+dispatcher = ChatDispatcher(handle_message, on_overflow=notify_queue_full)
+
+
+@client.on_message()
+async def on_message(message):
+    await dispatcher.submit(message.chat.id, message)
+
+
 if __name__ == "__main__":
 
+    # به‌روزرسانی خودکار طرح دیتابیس موجود (ایندکس‌ها و کلیدهای یکتا) پیش از شروع
+    run_migrations()
+
+    # پردازه‌های رسم نمودار پیش از اولین درخواست بالا می‌آیند (matplotlib و فونت‌ها یک بار بارگذاری می‌شوند)
+    render_service.warm_up()
+
     print("--- Client is ready ---")
     try:
         client.run()
     except Exception as e:
         logging.critical(f"❌ خطای بحرانی در اجرای کلاینت: {e}")
+    finally:
+        # وضعیت‌هایی که هنوز در نوبت نوشتن تأخیری بودند ذخیره می‌شوند
+        flush_sessions()
 
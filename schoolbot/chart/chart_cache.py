@@ -0,0 +1,257 @@
+# schoolbot/chart/chart_cache.py
+
+import datetime
+import functools
+import hashlib
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+from typing import Callable, List, Optional
+
+from schoolbot.database.connection_pool import CACHE_DIR
+
+log = logging.getLogger(__name__)
+
+# ======= کش تصاویر نمودار =======
+# دو لایه:
+#   ۱. انبار بر اساس محتوا: هر PNG با sha256 محتوایش در {CHART_CACHE_DIR}/{ab}/{digest}.png ذخیره می‌شود؛
+#      نمودارهای یکسان فقط یک بار روی دیسک می‌مانند و snapshot ها فقط digest را نگه می‌دارند.
+#   ۲. کلید ورودی: hash داده‌های نرمال‌شده‌ی ورودی + نوع نمودار + نسخه → digest(ها)ی تصویر
+#      در {CHART_CACHE_DIR}/keys/{ab}/{key}؛ درخواست تکراری با همان داده بدون رسم دوباره پاسخ می‌گیرد.
+# حجم کل تصاویر محدود است و قدیمی‌ترین‌ها (بر اساس آخرین استفاده = mtime) حذف می‌شوند.
+
+CHART_CACHE_DIR = os.environ.get("SCHOOLBOT_CHART_CACHE_DIR", os.path.join(CACHE_DIR, "chart_cache"))
+CHART_CACHE_MAX_BYTES = int(os.environ.get("SCHOOLBOT_CHART_CACHE_BYTES", 512 * 1024 * 1024))
+
+# با هر تغییر در ظاهر نمودارها (کد رسم، فونت، dpi) زیاد شود تا کلیدهای قدیمی بی‌اثر شوند
+CHART_CACHE_VERSION = 1
+
+# پس از پر شدن، تا این نسبت از سقف خالی می‌شود تا حذف در هر ذخیره تکرار نشود
+_EVICT_TARGET = 0.9
+
+_KEYS_DIR = "keys"
+_lock = threading.Lock()
+_total_bytes: Optional[int] = None  # حجم تقریبی تصاویر در این پردازه (با اولین ذخیره شمرده می‌شود)
+
+
+# ---------- انبار بر اساس محتوا ----------
+def image_digest(png: bytes) -> str:
+    return hashlib.sha256(png).hexdigest()
+
+
+def _image_path(digest: str) -> str:
+    return os.path.join(CHART_CACHE_DIR, digest[:2], f"{digest}.png")
+
+
+def _atomic_write(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def put_image(png: bytes) -> str:
+    """ذخیره‌ی تصویر (اگر از قبل نباشد) و برگرداندن digest آن"""
+    digest = image_digest(png)
+    path = _image_path(digest)
+    if os.path.exists(path):
+        _touch(path)
+        return digest
+    _atomic_write(path, png)
+    _account(len(png))
+    return digest
+
+
+def get_image(digest: str) -> Optional[bytes]:
+    path = _image_path(digest)
+    try:
+        with open(path, "rb") as f:
+            png = f.read()
+    except FileNotFoundError:
+        return None
+    _touch(path)
+    return png
+
+
+def has_image(digest: str) -> bool:
+    return os.path.exists(_image_path(digest))
+
+
+def _touch(path: str):
+    # mtime = زمان آخرین استفاده (مبنای LRU)
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+# ---------- حذف LRU ----------
+def _image_files():
+    for entry in os.scandir(CHART_CACHE_DIR) if os.path.isdir(CHART_CACHE_DIR) else ():
+        if entry.is_dir() and entry.name != _KEYS_DIR:
+            for image in os.scandir(entry.path):
+                if image.name.endswith(".png"):
+                    yield image
+
+
+def _account(size: int):
+    global _total_bytes
+    with _lock:
+        if _total_bytes is None:
+            _total_bytes = sum(image.stat().st_size for image in _image_files())
+        else:
+            _total_bytes += size
+        if _total_bytes > CHART_CACHE_MAX_BYTES:
+            _evict()
+
+
+def _evict():
+    """حذف قدیمی‌ترین تصاویر تا رسیدن به _EVICT_TARGET سقف؛ کلیدهای قدیمی‌تر از آخرین حذف هم پاک می‌شوند"""
+    global _total_bytes
+    images = []
+    for image in _image_files():
+        try:
+            stat = image.stat()
+        except FileNotFoundError:  # هم‌زمان در پردازه‌ی دیگری حذف شده
+            continue
+        images.append((stat.st_mtime, stat.st_size, image.path))
+    images.sort()
+    total = sum(size for _, size, _ in images)
+    cutoff, removed = None, 0
+    for mtime, size, path in images:
+        if total <= CHART_CACHE_MAX_BYTES * _EVICT_TARGET:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        cutoff, removed = mtime, removed + 1
+    _total_bytes = total
+    if cutoff is not None:
+        keys_dir = os.path.join(CHART_CACHE_DIR, _KEYS_DIR)
+        for entry in os.scandir(keys_dir) if os.path.isdir(keys_dir) else ():
+            for key_file in os.scandir(entry.path):
+                try:
+                    if key_file.stat().st_mtime <= cutoff:
+                        os.unlink(key_file.path)
+                except FileNotFoundError:
+                    pass
+        log.info(f"🧹 {removed} تصویر قدیمی از کش نمودارها حذف شد.")
+
+
+# ---------- کلید ورودی ----------
+def _normalize(value):
+    """تبدیل ورودی‌ها به شکل قابل JSON و پایدار (numpy، tuple، NaN، ...)"""
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set, frozenset)):
+        items = [_normalize(v) for v in value]
+        return sorted(items, key=repr) if isinstance(value, (set, frozenset)) else items
+    if hasattr(value, "tolist"):  # آرایه و عددهای numpy
+        return _normalize(value.tolist())
+    if isinstance(value, float):
+        return repr(value) if math.isnan(value) or math.isinf(value) else round(value, 6)
+    if value is None or isinstance(value, (bool, int, str)):
+        return value
+    return repr(value)
+
+
+def chart_key(chart_type: str, inputs, version: int = 1) -> str:
+    payload = json.dumps([chart_type, version, CHART_CACHE_VERSION, _normalize(inputs)],
+                         ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _key_path(key: str) -> str:
+    return os.path.join(CHART_CACHE_DIR, _KEYS_DIR, key[:2], key)
+
+
+def lookup_chart(key: str) -> Optional[List[str]]:
+    """digest های تصاویر ذخیره‌شده برای کلید یا None (در صورت نبود یا حذف شدن یکی از تصاویر)"""
+    path = _key_path(key)
+    try:
+        with open(path, "r", encoding="ascii") as f:
+            digests = f.read().split()
+    except FileNotFoundError:
+        return None
+    if not all(has_image(digest) for digest in digests):
+        os.unlink(path)
+        return None
+    _touch(path)
+    return digests
+
+
+def store_chart(key: str, images: List[bytes]) -> List[str]:
+    digests = [put_image(png) for png in images]
+    _atomic_write(_key_path(key), "\n".join(digests).encode("ascii"))
+    return digests
+
+
+# ---------- توابع رسم ----------
+def cached_chart_images(key: str) -> Optional[List[bytes]]:
+    """در صورت hit: تصاویر کش‌شده‌ی کلید؛ در غیر این صورت None"""
+    try:
+        digests = lookup_chart(key)
+        if digests is None:
+            return None
+        images = [get_image(digest) for digest in digests]
+        if all(image is not None for image in images):
+            return images
+    except OSError as e:
+        log.error(f"❌ خطا در خواندن کش نمودار: {e}")
+    return None
+
+
+def remember_chart(key: str, images: List[bytes]):
+    """مثل store_chart ولی خطای دیسک فقط ثبت می‌شود (کش نباید رسم نمودار را از کار بیندازد)"""
+    try:
+        store_chart(key, images)
+    except OSError as e:
+        log.error(f"❌ خطا در ذخیره‌ی کش نمودار: {e}")
+
+
+def cached_chart(chart_type: str, version: int = 1, dated: bool = False, many: bool = False):
+    """
+    دکوراتور برای توابع رسمی که تصویر PNG (bytes) یا با many=True فهرستی از تصاویر برمی‌گردانند.
+    کلید از همه‌ی آرگومان‌ها ساخته می‌شود؛ dated=True برای نمودارهایی که تاریخ امروز را در عنوان دارند.
+    خروجی None (خطا یا داده‌ی ناکافی) ذخیره نمی‌شود.
+    """
+
+    def decorator(func: Callable):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            inputs = [args, kwargs]
+            if dated:
+                inputs.append(datetime.date.today().isoformat())
+            key = chart_key(chart_type, inputs, version)
+            images = cached_chart_images(key)
+            if images is not None:
+                return images if many else images[0]
+
+            result = func(*args, **kwargs)
+            if result is not None:
+                remember_chart(key, result if many else [result])
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+# ---------- سازگاری با فراخوان‌هایی که مسیر فایل می‌خواهند ----------
+def png_to_temp_file(png: Optional[bytes]) -> Optional[str]:
+    """نوشتن تصویر در فایل موقت؛ فراخوان مسئول حذف آن است"""
+    if png is None:
+        return None
+    with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp_file:
+        tmp_file.write(png)
+    return tmp_file.name
@@ -1,6 +1,7 @@
 
+import io
+import logging
 import math
-import tempfile
 from typing import List, Tuple, Optional, Dict
 
 import arabic_reshaper
@@ -11,11 +12,18 @@ from adjustText import adjust_text
 from bidi.algorithm import get_display
 from matplotlib import rcParams
 
+from schoolbot.chart.chart_cache import cached_chart, png_to_temp_file
+
+logger = logging.getLogger(__name__)
 
 rcParams["font.family"] = "Tahoma"
 
+# توابع render_* تصویر PNG را به صورت bytes (بدون فایل موقت) برمی‌گردانند؛
+# توابع generate_* انتهای فایل فقط برای سازگاری با فراخوان‌هایی است که مسیر فایل می‌خواهند.
 
-def generate_multi_subject_charts(all_scores: List[Tuple], name: str = "") -> List[str]:
+
+@cached_chart("student_multi_subject", many=True)
+def render_multi_subject_charts(all_scores: List[Tuple], name: str = "") -> List[bytes]:
     """
     نسخه نهایی و حرفه‌ای برای ترسیم نمودارها با قابلیت‌های تحلیلی و جلوگیری از همپوشانی متن.
     """
@@ -47,7 +55,7 @@ def generate_multi_subject_charts(all_scores: List[Tuple], name: str = "") -> Li
     subjects = list(df["subject"].unique())
     group_size = 9
     n_groups = math.ceil(len(subjects) / group_size)
-    chart_files: List[str] = []
+    chart_images: List[bytes] = []
 
     for g in range(n_groups):
         start = g * group_size
@@ -111,14 +119,15 @@ def generate_multi_subject_charts(all_scores: List[Tuple], name: str = "") -> Li
         fig.suptitle(fix_farsi(f"تحلیل روند نمرات: {name} (درس های گروه {g + 1})"), fontsize=18, fontweight="bold")
         plt.tight_layout(rect=[0, 0, 1, 0.96])
 
-        tmp_file = tempfile.NamedTemporaryFile(suffix=".png", delete=False)
-        plt.savefig(tmp_file.name, bbox_inches="tight", dpi=150)
+        buffer = io.BytesIO()
+        plt.savefig(buffer, format="png", bbox_inches="tight", dpi=150)
         plt.close(fig)
-        chart_files.append(tmp_file.name)
+        chart_images.append(buffer.getvalue())
 
-    return chart_files
+    return chart_images
 
-def generate_combined_chart(student_scores, name, report_name):
+@cached_chart("student_combined")
+def render_combined_chart(student_scores, name, report_name) -> Optional[bytes]:
     try:
         def fix_farsi(text: str) -> str:
             return get_display(arabic_reshaper.reshape(text))
@@ -156,15 +165,17 @@ def generate_combined_chart(student_scores, name, report_name):
         for spine in ["top", "right"]: plt.gca().spines[spine].set_visible(False)
         plt.legend(fontsize=11)
 
-        tmp_file = tempfile.NamedTemporaryFile(suffix=".png", delete=False)
-        plt.savefig(tmp_file.name, bbox_inches="tight", dpi=150)
-        plt.close()
-        return tmp_file.name
+        buffer = io.BytesIO()
+        plt.savefig(buffer, format="png", bbox_inches="tight", dpi=150)
+        return buffer.getvalue()
     except Exception as e:
         logger.error("❌ خطا در تولید نمودار مقایسه: %s", str(e))
         return None
+    finally:
+        plt.close()
 
-def generate_radar_chart(data: Dict[str, Dict[str, Dict[str, float]]], name: str) -> Optional[str]:
+@cached_chart("student_radar")
+def render_radar_chart(data: Dict[str, Dict[str, Dict[str, float]]], name: str) -> Optional[bytes]:
     """
     برای هر دوره یک نمودار راداری برای دانش‌آموز و میانگین کلاس تولید کرده
     و همه را در یک تصویر نمایش می‌دهد.
@@ -259,14 +270,17 @@ def generate_radar_chart(data: Dict[str, Dict[str, Dict[str, float]]], name: str
     fig.suptitle(fix_farsi(f"نمودار راداری عملکرد: {name}"), fontsize=18, y=0.98)
     plt.tight_layout(pad=3.0)
 
-    tmp_file = tempfile.NamedTemporaryFile(suffix=".png", delete=False)
-    plt.savefig(tmp_file.name, bbox_inches="tight", dpi=150)
-    plt.close(fig)
-    return tmp_file.name
+    buffer = io.BytesIO()
+    try:
+        plt.savefig(buffer, format="png", bbox_inches="tight", dpi=150)
+    finally:
+        plt.close(fig)
+    return buffer.getvalue()
 
 
-def generate_average_trend_chart(averages: Dict[str, float], name: str,
-                                 class_averages_for_all_periods: Optional[Dict[str, float]] = None) -> Optional[str]:
+@cached_chart("student_average_trend")
+def render_average_trend_chart(averages: Dict[str, float], name: str,
+                               class_averages_for_all_periods: Optional[Dict[str, float]] = None) -> Optional[bytes]:
     if not averages:
         return None
 
@@ -353,14 +367,30 @@ def generate_average_trend_chart(averages: Dict[str, float], name: str,
     plt.tight_layout(pad=1.5)
 
     try:
-        tmp_file = tempfile.NamedTemporaryFile(suffix=".png", delete=False)
-        plt.savefig(tmp_file.name, bbox_inches="tight", dpi=150)
-        plt.close()
-        return tmp_file.name
+        buffer = io.BytesIO()
+        plt.savefig(buffer, format="png", bbox_inches="tight", dpi=150)
+        return buffer.getvalue()
     except Exception as e:
         print(f"Error saving chart: {e}")
         return None
+    finally:
+        plt.close()
+
+
+# ---------- سازگاری: نسخه‌های مسیر فایل ----------
+# فراخوان مسئول حذف فایل موقت است.
+def generate_multi_subject_charts(all_scores: List[Tuple], name: str = "") -> List[str]:
+    return [png_to_temp_file(png) for png in render_multi_subject_charts(all_scores, name)]
 
 
+def generate_combined_chart(student_scores, name, report_name) -> Optional[str]:
+    return png_to_temp_file(render_combined_chart(student_scores, name, report_name))
 
 
+def generate_radar_chart(data: Dict[str, Dict[str, Dict[str, float]]], name: str) -> Optional[str]:
+    return png_to_temp_file(render_radar_chart(data, name))
+
+
+def generate_average_trend_chart(averages: Dict[str, float], name: str,
+                                 class_averages_for_all_periods: Optional[Dict[str, float]] = None) -> Optional[str]:
+    return png_to_temp_file(render_average_trend_chart(averages, name, class_averages_for_all_periods))
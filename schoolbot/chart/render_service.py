@@ -0,0 +1,106 @@
+# schoolbot/chart/render_service.py
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+# ======= سرویس رسم نمودار با استخر پردازه =======
+# pyplot در thread امن نیست و به خاطر GIL رسم در thread ها فقط از یک هسته استفاده می‌کند؛
+# همه‌ی نمودارها (دانش‌آموز، معلم، مدیر) به صورت «کار داده‌ای» به این استخر سپرده می‌شوند:
+# ورودی فقط داده‌ی قابل pickle است و خروجی بایت‌های PNG (یا digest تصاویر در chart_cache).
+# هر پردازه یک بار هنگام شروع backend ‏Agg، ماژول‌های رسم و فونت‌ها را بارگذاری می‌کند.
+
+RENDER_WORKERS = int(os.environ.get("SCHOOLBOT_RENDER_WORKERS", os.cpu_count() or 2))
+
+# ماژول‌هایی که هر پردازه هنگام شروع بارگذاری می‌کند (rcParams و فونت‌ها در همین‌ها تنظیم می‌شوند)
+_WARM_MODULES = (
+    "schoolbot.chart.chart_student.chart_student",
+    "schoolbot.chart.teacher_chart.teacher_chart",
+    "schoolbot.utils.helpers",
+)
+
+
+def _init_worker():
+    import importlib
+
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot  # noqa: F401
+    from matplotlib import font_manager, rcParams
+
+    logging.getLogger("matplotlib.font_manager").setLevel(logging.ERROR)
+    for module in _WARM_MODULES:
+        importlib.import_module(module)
+    # جستجوی فونت یک بار انجام و در font_manager کش می‌شود
+    for family in rcParams["font.family"]:
+        font_manager.findfont(family)
+
+
+# ---------- کارهای رسم (داخل پردازه‌ی کارگر اجرا می‌شوند) ----------
+def class_summary_chart(scores_list: List[float], class_name: str = "", subject_name: str = "",
+                        name: str = "") -> Optional[bytes]:
+    """نمودار تحلیل آماری نمرات یک کلاس (معلم)"""
+    from schoolbot.chart.teacher_chart.teacher_chart import render_class_summary_chart
+    return render_class_summary_chart(scores_list, class_name, subject_name, name)
+
+
+def school_multi_period_analysis(analysis: Dict, name: str) -> Tuple[str, Optional[bytes]]:
+    """متن تحلیل چند دوره‌ای مدرسه و نمودار آن (مدیر)"""
+    from schoolbot.utils.helpers import build_school_multi_period_analysis
+    return build_school_multi_period_analysis(analysis, name)
+
+
+def student_report_charts(report_data: Dict, history_data: Dict, name: str,
+                          period_name: str) -> List[Tuple[str, str]]:
+    """همه‌ی نمودارهای کارنامه؛ تصاویر در chart_cache ذخیره و [(caption, digest), ...] برگردانده می‌شود"""
+    from schoolbot.services.report_snapshot import render_student_charts
+    return render_student_charts(report_data, history_data, name, period_name)
+
+
+# ---------- استخر ----------
+class RenderService:
+    def __init__(self, workers: int = RENDER_WORKERS):
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # spawn: پردازه‌ی کارگر قفل‌ها و اتصال‌های thread های ربات را به ارث نمی‌برد
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"),
+                                                 initializer=_init_worker)
+            return self._pool
+
+    def warm_up(self):
+        """راه‌اندازی همه‌ی پردازه‌ها از پیش (مثلاً هنگام شروع ربات) تا اولین درخواست منتظر بارگذاری نماند"""
+        pool = self._get_pool()
+        for future in [pool.submit(os.getpid) for _ in range(self.workers)]:
+            future.result()
+
+    def submit(self, job, *args, **kwargs) -> Future:
+        """job: یکی از توابع سطح ماژول بالا (یا هر تابع قابل pickle دیگر)"""
+        return self._get_pool().submit(job, *args, **kwargs)
+
+    def render(self, job, *args, **kwargs):
+        """اجرای هم‌گام (برای thread ها)"""
+        return self.submit(job, *args, **kwargs).result()
+
+    async def run(self, job, *args, **kwargs):
+        """اجرای غیرهم‌گام؛ event loop در طول رسم آزاد می‌ماند"""
+        return await asyncio.wrap_future(self.submit(job, *args, **kwargs))
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+
+# ---------- سرویس سراسری ----------
+render_service = RenderService()
@@ -1,3 +1,5 @@
+import io
+
 import jdatetime
 
 import matplotlib
@@ -7,6 +9,8 @@ import matplotlib.pyplot as plt
 import numpy as np
 import logging
 
+from schoolbot.chart.chart_cache import cached_chart, png_to_temp_file
+
 # ------------------ Logging: فقط خطاها ------------------
 logging.basicConfig(
     level=logging.ERROR,
@@ -44,9 +48,11 @@ else:
         return arabic_reshaper.reshape(text)
 
 
-def generate_class_summary_chart_robust(scores_list, class_name="", subject_name="", name=""):
+@cached_chart("class_summary", dated=True)
+def render_class_summary_chart(scores_list, class_name="", subject_name="", name=""):
     """
     نسخه نهایی و پایدار نمودار با مدیریت خطای کامل و بررسی ورودی.
+    خروجی: تصویر PNG به صورت bytes یا None
     """
     # 1. بررسی ورودی قبل از شروع هر کاری
     if not scores_list:
@@ -168,11 +174,9 @@ def generate_class_summary_chart_robust(scores_list, class_name="", subject_name
                  ha="center", fontsize=11, color="gray")
 
         plt.tight_layout(rect=[0, 0.03, 1, 0.96])
-        # tmp_file = tempfile.NamedTemporaryFile(suffix=".png", delete=False) # <--- این بخش به tempfile نیاز دارد
-        # plt.savefig(tmp_file.name, bbox_inches="tight")
-        # return tmp_file.name
-        plt.savefig("chart_vectorized.png", bbox_inches="tight")  # برای تست محلی
-        return "chart_vectorized.png"
+        buffer = io.BytesIO()
+        plt.savefig(buffer, format="png", bbox_inches="tight")
+        return buffer.getvalue()
 
 
     except Exception as e:
@@ -185,3 +189,7 @@ def generate_class_summary_chart_robust(scores_list, class_name="", subject_name
         if fig:
             plt.close(fig)
 
+
+def generate_class_summary_chart_robust(scores_list, class_name="", subject_name="", name=""):
+    """سازگاری: همان نمودار در یک فایل موقت (فراخوان مسئول حذف آن است)"""
+    return png_to_temp_file(render_class_summary_chart(scores_list, class_name, subject_name, name))
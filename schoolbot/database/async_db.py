@@ -0,0 +1,49 @@
+# schoolbot/database/async_db.py
+
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from schoolbot.database.db_writer import writer
+
+# ======= دسترسی غیرمسدودکننده به دیتابیس از هندلرهای async =======
+# توابع سرویس‌ها هم‌گام‌اند (sqlite3)؛ اجرای مستقیم آن‌ها داخل هندلر، event loop و همه‌ی گفتگوها را
+# تا پایان پرس‌وجو معطل می‌کند. خواندن‌ها در استخر thread اختصاصی دیتابیس اجرا می‌شوند (هر thread
+# اتصال ثابت خودش را از connection_pool دارد و در حالت WAL خواننده‌ها هم‌زمان کار می‌کنند) و
+# نوشتن‌ها مستقیماً به نویسنده‌ی واحد سپرده و با await منتظر می‌مانند.
+
+DB_READ_WORKERS = int(os.environ.get("SCHOOLBOT_DB_READ_WORKERS", 4))
+
+db_executor = ThreadPoolExecutor(max_workers=DB_READ_WORKERS, thread_name_prefix="db-read")
+
+
+async def run_db(func, *args, **kwargs):
+    """اجرای یک تابع هم‌گام دیتابیس در استخر db_executor بدون مسدود کردن event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, functools.partial(func, *args, **kwargs))
+
+
+async def run_write(func, *args, **kwargs):
+    """اجرای یک تابع نوشتن (معمولاً با @serialized_write) در thread نویسنده و انتظار برای نتیجه"""
+    return await asyncio.wrap_future(writer.submit(func, *args, **kwargs))
+
+
+def awaitable(func):
+    """نسخه‌ی await شدنی یک تابع خواندن: `get_x = awaitable(sync_get_x)`"""
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_db(func, *args, **kwargs)
+
+    return wrapper
+
+
+def awaitable_write(func):
+    """نسخه‌ی await شدنی یک تابع نوشتن"""
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_write(func, *args, **kwargs)
+
+    return wrapper
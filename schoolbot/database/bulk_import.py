@@ -0,0 +1,155 @@
+# schoolbot/database/bulk_import.py
+"""
+بارگذاری گروهی چند مدرسه (یک فایل اکسل برای هر مدرسه).
+
+    python -m schoolbot.database.bulk_import <پوشه یا فایل‌ها...> [--workers 4] [--force]
+
+فایل‌ها به صورت موازی در چند پردازه خوانده می‌شوند و هر مدرسه در تراکنش جداگانه‌ی خودش
+از طریق نویسنده‌ی واحد دیتابیس ثبت می‌شود. فایل‌هایی که قبلاً با موفقیت وارد شده‌اند
+(بر اساس هش محتوا) در اجرای دوباره رد می‌شوند؛ پس پس از خطا فقط کافی است دستور تکرار شود.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Dict, Iterable, List, Tuple
+
+from schoolbot.database.connection_pool import db_connection
+from schoolbot.database.data_loader import DEFAULT_PASSWORD, create_tables
+from schoolbot.database.db_writer import serialized_write
+from schoolbot.database.excel_importer import ROSTER_KEYS, SHEET_COLUMNS, import_roster
+from schoolbot.database.workbook_reader import StreamingWorkbook
+
+EXCEL_EXTENSIONS = (".xlsx", ".xlsm")
+
+
+# ======= پیدا کردن و خواندن فایل‌ها =======
+def collect_workbooks(paths: Iterable[str]) -> List[str]:
+    """ورودی می‌تواند پوشه یا فهرست فایل‌ها باشد؛ خروجی فهرست مرتب فایل‌های اکسل است."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(EXCEL_EXTENSIONS) and not name.startswith("~$"):
+                    files.append(os.path.join(path, name))
+        elif os.path.isfile(path):
+            files.append(path)
+        else:
+            print(f"⚠️ مسیر «{path}» یافت نشد.")
+    return files
+
+
+def file_hash(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def parse_workbook(file_path: str) -> Dict[str, List[Tuple]]:
+    """در پردازه‌ی جداگانه اجرا می‌شود؛ خروجی فقط داده‌ی ساده (قابل pickle) است."""
+    with StreamingWorkbook(file_path) as wb:
+        return {ROSTER_KEYS[sheet]: wb.read_all(sheet, columns) for sheet, columns in SHEET_COLUMNS.items()}
+
+
+# ======= سابقه‌ی اجرا (برای ادامه پس از خطا) =======
+def get_completed_hashes() -> set:
+    with db_connection() as conn:
+        rows = conn.execute("SELECT file_hash FROM import_runs WHERE status = 'done'").fetchall()
+    return {r[0] for r in rows}
+
+
+@serialized_write
+def record_import_run(digest: str, file_path: str, school_name, school_id, status: str,
+                      stats: Dict = None, error: str = None):
+    with db_connection() as conn:
+        conn.execute("""
+            INSERT INTO import_runs (file_hash, file_path, school_name, school_id, status, stats, error, finished_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(file_hash) DO UPDATE SET
+                file_path = excluded.file_path, school_name = excluded.school_name,
+                school_id = excluded.school_id, status = excluded.status, stats = excluded.stats,
+                error = excluded.error, finished_at = excluded.finished_at
+        """, (digest, file_path, school_name, school_id, status,
+              json.dumps(stats, ensure_ascii=False) if stats else None, error,
+              datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+
+
+# ======= اجرای اصلی =======
+def bulk_import(paths: Iterable[str], workers: int = None, force: bool = False) -> List[Dict]:
+    """
+    چند فایل اکسل (هر کدام یک مدرسه) را وارد می‌کند.
+    خروجی: خلاصه‌ی هر مدرسه [{file, school, status, students, subjects, seconds, error}, ...]
+    """
+    started = time.perf_counter()
+    files = collect_workbooks(paths)
+    done = set() if force else get_completed_hashes()
+
+    summary = []
+    pending = {}
+    for path in files:
+        digest = file_hash(path)
+        if digest in done:
+            summary.append({"file": path, "school": None, "status": "skipped"})
+        else:
+            pending[path] = digest
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(parse_workbook, path): path for path in pending}
+        # هر فایلی که زودتر خوانده شد، زودتر (و در تراکنش خودش) ثبت می‌شود
+        for future in as_completed(futures):
+            path = futures[future]
+            digest = pending[path]
+            school_name = None
+            try:
+                roster = future.result()
+                school_name = roster["schools"][0][0] if roster["schools"] else None
+                stats = import_roster(roster, DEFAULT_PASSWORD)
+                if stats.get("school_id") is None:
+                    raise ValueError("مدرسه‌ای در فایل یافت نشد.")
+                record_import_run(digest, path, school_name, stats["school_id"], "done", stats=stats)
+                summary.append({"file": path, "school": school_name, "status": "done", **stats})
+            except Exception as e:
+                record_import_run(digest, path, school_name, None, "failed", error=str(e))
+                summary.append({"file": path, "school": school_name, "status": "failed", "error": str(e)})
+
+    print_summary(summary, time.perf_counter() - started)
+    return summary
+
+
+def print_summary(summary: List[Dict], elapsed: float):
+    print("━" * 20)
+    for item in summary:
+        name = item.get("school") or os.path.basename(item["file"])
+        if item["status"] == "done":
+            print(f"✅ {name}: {item['students']} دانش‌آموز، {item['subjects']} درس "
+                  f"({item['rows']} ردیف در {item['seconds']} ثانیه)")
+        elif item["status"] == "skipped":
+            print(f"⏭️ {name}: قبلاً وارد شده است.")
+        else:
+            print(f"❌ {name}: {item.get('error')}")
+    counts = {status: sum(1 for i in summary if i["status"] == status) for status in ("done", "skipped", "failed")}
+    print("━" * 20)
+    print(f"📊 موفق: {counts['done']} | ردشده: {counts['skipped']} | ناموفق: {counts['failed']} "
+          f"| زمان کل: {elapsed:.1f} ثانیه")
+    if counts["failed"]:
+        print("🔁 برای تلاش دوباره فقط همین دستور را تکرار کنید؛ مدارس واردشده دوباره پردازش نمی‌شوند.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="بارگذاری گروهی مدارس از فایل‌های اکسل")
+    parser.add_argument("paths", nargs="+", help="پوشه یا فایل‌های اکسل (هر فایل یک مدرسه)")
+    parser.add_argument("--workers", type=int, default=None, help="تعداد پردازه‌های خواندن فایل")
+    parser.add_argument("--force", action="store_true", help="وارد کردن دوباره فایل‌های قبلاً واردشده")
+    args = parser.parse_args()
+
+    # هشدارهای واردکننده (مثلاً کلاس ناموجود) روی کنسول نمایش داده می‌شوند
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+    create_tables()
+    bulk_import(args.paths, workers=args.workers, force=args.force)
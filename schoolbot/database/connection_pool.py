@@ -0,0 +1,225 @@
+# schoolbot/database/connection_pool.py
+
+import asyncio
+import contextlib
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "school.db")
+
+# فایل‌های مشتق‌شده و قابل بازسازی (snapshot کارنامه‌ها، کش نمودارها) بیرون از پوشه‌ی کد و در این مسیر نوشته می‌شوند
+CACHE_DIR = os.environ.get(
+    "SCHOOLBOT_CACHE_DIR",
+    os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "schoolbot"),
+)
+
+# تعداد دستورات آماده‌شده‌ای که هر اتصال در حافظه نگه می‌دارد (کش statementها)
+STATEMENT_CACHE_SIZE = 256
+
+# اگر اتصال بیش از این مدت (ثانیه) بی‌استفاده مانده باشد، قبل از تحویل، سلامت آن بررسی می‌شود
+HEALTH_CHECK_IDLE_SECONDS = 30
+
+# حالت موتور ذخیره‌سازی:
+#   "wal"    → خواننده‌ها بدون قفل و هم‌زمان با نویسنده کار می‌کنند (پیش‌فرض)
+#   "legacy" → حالت rollback journal قدیمی SQLite
+DB_ENGINE_MODE = os.environ.get("SCHOOLBOT_DB_MODE", "wal").lower()
+
+# تنظیماتی که روی هر اتصال جدید اعمال می‌شوند
+PRAGMAS = (
+    ("busy_timeout", 10000),   # میلی‌ثانیه انتظار برای آزاد شدن قفل
+    ("temp_store", "MEMORY"),
+    ("cache_size", -16000),    # حدود ۱۶ مگابایت کش صفحات برای هر اتصال
+)
+
+WAL_PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),  # در حالت WAL امن است و fsync را فقط در checkpoint انجام می‌دهد
+    ("wal_autocheckpoint", 1000),
+)
+
+# دسترسی هم‌گام به دیتابیس از داخل thread ِ event loop (هندلرهای async) همه‌ی گفتگوها را معطل می‌کند:
+#   "warn"  → برای هر محل فراخوانی یک بار در لاگ ثبت می‌شود (پیش‌فرض)
+#   "raise" → خطای BlockingDatabaseCall (برای توسعه و پیدا کردن همه‌ی موارد)
+#   "off"   → بدون بررسی
+LOOP_GUARD_MODE = os.environ.get("SCHOOLBOT_DB_LOOP_GUARD", "warn").lower()
+
+log = logging.getLogger(__name__)
+
+
+class BlockingDatabaseCall(RuntimeError):
+    """فراخوانی مسدودکننده‌ی دیتابیس روی thread ِ event loop"""
+
+
+# فریم‌های این فایل‌ها در گزارش محل فراخوانی نادیده گرفته می‌شوند
+_GUARD_SKIP_FILES = {__file__, os.path.join(os.path.dirname(__file__), "db_writer.py"),
+                     contextlib.__file__}
+_flagged_sites = set()
+_flagged_lock = threading.Lock()
+
+
+def _call_site():
+    # اولین فریم بیرون از لایه‌ی دیتابیس (تابع سرویس) و فراخوان آن (معمولاً هندلر)
+    frame = sys._getframe(2)
+    while frame is not None and frame.f_code.co_filename in _GUARD_SKIP_FILES:
+        frame = frame.f_back
+    if frame is None:
+        return "?"
+    site = f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno} ({frame.f_code.co_name})"
+    caller = frame.f_back
+    if caller is not None:
+        site += f" ← {os.path.basename(caller.f_code.co_filename)}:{caller.f_lineno} ({caller.f_code.co_name})"
+    return site
+
+
+def guard_event_loop():
+    """
+    اگر thread جاری در حال اجرای event loop باشد، فراخوانی هم‌گام دیتابیس گزارش (یا با حالت raise رد) می‌شود.
+    راه درست در هندلرها: `await run_db(...)` یا توابع schoolbot.services.repository
+    """
+    if LOOP_GUARD_MODE == "off":
+        return
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return  # thread بدون event loop (استخر خواندن، نویسنده‌ی واحد یا اسکریپت‌ها)
+    site = _call_site()
+    if LOOP_GUARD_MODE == "raise":
+        raise BlockingDatabaseCall(f"دسترسی هم‌گام به دیتابیس روی event loop: {site}")
+    with _flagged_lock:
+        if site in _flagged_sites:
+            return
+        _flagged_sites.add(site)
+    log.error(f"⚠️ دسترسی هم‌گام به دیتابیس روی event loop (loop تا پایان پرس‌وجو معطل می‌ماند): {site}")
+
+
+class _ThreadConnection(threading.local):
+    """اتصال اختصاصی هر thread به همراه عمق تراکنش‌های تو در تو."""
+    conn = None
+    depth = 0
+    last_used = 0.0
+    generation = 0
+
+
+class ConnectionPool:
+    """
+    استخر اتصال‌های SQLite که به هر thread یک اتصال ثابت می‌دهد.
+    به جای باز و بسته کردن اتصال در هر فراخوانی، اتصال هر thread یک بار ساخته شده
+    و همراه با کش statementها دوباره استفاده می‌شود.
+    """
+
+    def __init__(self, db_path: str = DB_PATH, timeout: float = 10):
+        self.db_path = db_path
+        self.timeout = timeout
+        self._local = _ThreadConnection()
+        self._all_connections = set()
+        self._lock = threading.Lock()
+        self._generation = 0  # با هر close_all زیاد می‌شود تا اتصال‌های بسته‌شده کنار گذاشته شوند
+
+    # ---------- ساخت و بررسی اتصال ----------
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.timeout,
+            cached_statements=STATEMENT_CACHE_SIZE,
+            check_same_thread=False,  # فقط برای close_all؛ هر اتصال عملاً در thread خودش استفاده می‌شود
+        )
+        pragmas = PRAGMAS + WAL_PRAGMAS if DB_ENGINE_MODE == "wal" else PRAGMAS
+        for name, value in pragmas:
+            conn.execute(f"PRAGMA {name}={value}")
+        with self._lock:
+            self._all_connections.add(conn)
+        return conn
+
+    def _discard(self, conn: sqlite3.Connection):
+        with self._lock:
+            self._all_connections.discard(conn)
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    @staticmethod
+    def _is_healthy(conn: sqlite3.Connection) -> bool:
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _acquire(self) -> sqlite3.Connection:
+        local = self._local
+        if local.depth == 0:
+            guard_event_loop()
+        conn = local.conn
+        if conn is not None and local.generation != self._generation:
+            conn = None
+        if conn is not None and local.depth == 0:
+            idle = time.monotonic() - local.last_used
+            if idle > HEALTH_CHECK_IDLE_SECONDS and not self._is_healthy(conn):
+                log.error("❌ اتصال دیتابیس سالم نبود و دوباره ساخته می‌شود.")
+                self._discard(conn)
+                conn = None
+        if conn is None:
+            conn = self._connect()
+            local.conn = conn
+            local.generation = self._generation
+        return conn
+
+    # ---------- رابط اصلی ----------
+    @contextmanager
+    def connection(self):
+        """
+        اتصال thread جاری را برمی‌گرداند و مثل `with sqlite3.connect(...)` رفتار می‌کند:
+        در پایان بلاک commit و در صورت خطا rollback می‌شود (فقط در بیرونی‌ترین بلاک).
+        """
+        local = self._local
+        conn = self._acquire()
+        local.depth += 1
+        try:
+            yield conn
+        except BaseException:
+            if local.depth == 1:
+                conn.rollback()
+            raise
+        else:
+            if local.depth == 1:
+                conn.commit()
+        finally:
+            local.depth -= 1
+            local.last_used = time.monotonic()
+
+    def health_check(self) -> bool:
+        """سلامت اتصال thread جاری را بررسی می‌کند (در صورت نبودِ اتصال، آن را می‌سازد)."""
+        try:
+            with self.connection() as conn:
+                return self._is_healthy(conn)
+        except sqlite3.Error as e:
+            log.error(f"❌ خطا در health_check دیتابیس: {e}")
+            return False
+
+    def close_all(self):
+        """بستن همه اتصال‌های ساخته‌شده (مثلاً هنگام خاموش شدن ربات)."""
+        with self._lock:
+            connections = list(self._all_connections)
+            self._all_connections.clear()
+            self._generation += 1
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local.conn = None
+
+
+# ---------- استخر سراسری ----------
+pool = ConnectionPool()
+
+
+def db_connection():
+    """تنها راه دسترسی سرویس‌ها به دیتابیس: `with db_connection() as conn: ...`"""
+    return pool.connection()
@@ -0,0 +1,91 @@
+# schoolbot/database/db_writer.py
+
+import functools
+import queue
+import threading
+from concurrent.futures import Future
+
+from schoolbot.database.connection_pool import guard_event_loop
+
+# حداکثر تعداد عملیات نوشتن در صف؛ در صورت پر شدن، فراخوان تا آزاد شدن جا منتظر می‌ماند
+WRITE_QUEUE_SIZE = 1000
+
+
+class DatabaseWriter:
+    """
+    نویسنده‌ی واحد دیتابیس: همه عملیات نوشتن در یک thread اختصاصی و به ترتیب ورود اجرا می‌شوند.
+    این کلاس جایگزین قفل سراسری db_lock شده است؛ خواننده‌ها هیچ قفلی نمی‌گیرند و
+    در حالت WAL هم‌زمان با نویسنده کار می‌کنند.
+    """
+
+    def __init__(self, maxsize: int = WRITE_QUEUE_SIZE):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            future, fn, args, kwargs = item
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+            self._queue.task_done()
+
+    def in_writer_thread(self) -> bool:
+        return threading.current_thread() is self._thread
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """عملیات نوشتن را در صف قرار می‌دهد و یک Future برمی‌گرداند."""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((future, fn, args, kwargs))
+        return future
+
+    def run(self, fn, *args, **kwargs):
+        """عملیات نوشتن را در thread نویسنده اجرا کرده و منتظر نتیجه می‌ماند."""
+        if self.in_writer_thread():
+            # فراخوانی تو در تو از داخل خود نویسنده؛ اجرای مستقیم برای جلوگیری از بن‌بست
+            return fn(*args, **kwargs)
+        return self.submit(fn, *args, **kwargs).result()
+
+    def pending(self) -> int:
+        """تعداد عملیات نوشتن در انتظار."""
+        return self._queue.qsize()
+
+    def stop(self, wait: bool = True):
+        """توقف نویسنده پس از اجرای همه عملیات صف‌شده."""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self._queue.put(None)
+        if wait:
+            self._thread.join()
+
+
+# ---------- نویسنده سراسری ----------
+writer = DatabaseWriter()
+
+
+def serialized_write(func):
+    """دکوراتور: تابع نوشتن را از طریق نویسنده‌ی واحد دیتابیس اجرا می‌کند."""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # انتظار برای نویسنده روی event loop هم مسدودکننده است (راه درست: run_write در async_db)
+        guard_event_loop()
+        return writer.run(func, *args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,251 @@
+# schoolbot/database/excel_importer.py
+
+import logging
+import time
+from typing import Dict, Iterable, List, Tuple
+
+import pandas as pd
+
+from schoolbot.database.connection_pool import db_connection
+from schoolbot.database.db_writer import serialized_write
+from schoolbot.database.workbook_reader import DEFAULT_CHUNK_SIZE, StreamingWorkbook
+
+# پیام‌های واردکننده از طریق logging؛ چاپ خلاصه روی کنسول با اسکریپت‌های خط فرمان (data_loader، bulk_import) است
+log = logging.getLogger(__name__)
+
+# ---------- نام شیت‌ها و ستون‌های فایل اکسل ----------
+SCHOOLS_SHEET = "مدرسه و مدیر"
+GRADES_SHEET = "پایه ها و کلاس ها"
+SUBJECTS_SHEET = "درس ها و معلم ها"
+STUDENTS_SHEET = "دانش اموزان"
+
+SHEET_COLUMNS = {
+    SCHOOLS_SHEET: ["نام مدرسه", "نام مدیر", "نام کاربری"],
+    GRADES_SHEET: ["پایه", "کلاس"],
+    SUBJECTS_SHEET: ["درس ها", "کلاس", "معلم", "نام کاربری", "ضریب درس"],
+    STUDENTS_SHEET: ["نام و نام خانوادگی", "کلاس", "نام کاربری"],
+}
+
+# کلید هر شیت در ساختار roster
+ROSTER_KEYS = {
+    SCHOOLS_SHEET: "schools",
+    GRADES_SHEET: "grades_classes",
+    SUBJECTS_SHEET: "subjects",
+    STUDENTS_SHEET: "students",
+}
+
+
+# ======= مرحله ۱: خواندن و نرمال‌سازی (بدون دیتابیس) =======
+def _normalize_sheet(df: pd.DataFrame, sheet_name: str) -> List[Tuple]:
+    """
+    ستون‌های یک شیت را به صورت برداری (بدون iterrows) تمیز کرده و لیستی از tuple برمی‌گرداند.
+    رفتار مثل نسخه قبلی است: هر مقدار با str(...).strip() به متن تبدیل می‌شود.
+    """
+    columns = SHEET_COLUMNS[sheet_name]
+    out = pd.DataFrame(index=df.index)
+    for col in columns:
+        if col == "ضریب درس":
+            out[col] = pd.to_numeric(df[col], errors="coerce").fillna(1).astype(int)
+        else:
+            out[col] = df[col].astype(str).str.strip()
+    return list(out.itertuples(index=False, name=None))
+
+
+def read_roster_excel(file_path: str) -> Dict[str, List[Tuple]]:
+    """
+    هر چهار شیت را با یک بار باز کردن فایل می‌خواند و خروجی ساده (قابل pickle) برمی‌گرداند:
+    {"schools": [...], "grades_classes": [...], "subjects": [...], "students": [...]}
+    """
+    with pd.ExcelFile(file_path, engine="openpyxl") as xls:
+        return {
+            ROSTER_KEYS[sheet]: _normalize_sheet(xls.parse(sheet), sheet)
+            for sheet in SHEET_COLUMNS
+        }
+
+
+# ======= مرحله ۲: نوشتن مجموعه‌ای در دیتابیس =======
+def _resolve_usernames(cursor, table: str, usernames) -> Dict[str, int]:
+    """نگاشت username → id را با یک جدول موقت و یک JOIN (به جای یک SELECT برای هر ردیف) می‌سازد."""
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS _import_usernames (username TEXT PRIMARY KEY)")
+    cursor.execute("DELETE FROM _import_usernames")
+    cursor.executemany("INSERT OR IGNORE INTO _import_usernames (username) VALUES (?)",
+                       ((u,) for u in usernames))
+    cursor.execute(f"""
+        SELECT t.username, t.id FROM {table} t
+        JOIN _import_usernames u ON u.username = t.username
+    """)
+    return dict(cursor.fetchall())
+
+
+def _class_ids_for_school(cursor, school_id: int) -> Dict[str, int]:
+    cursor.execute("""
+        SELECT classes.name, classes.id FROM classes
+        JOIN grades ON grades.id = classes.grade_id
+        WHERE grades.school_id = ?
+    """, (school_id,))
+    return dict(cursor.fetchall())
+
+
+def _import_school(cursor, schools: List[Tuple], password_hash: str):
+    # هر فایل اکسل فقط یک مدرسه را توصیف می‌کند؛ برای چند مدرسه از bulk_import استفاده کنید
+    school_names = set(name for name, _, _ in schools)
+    if len(school_names) > 1:
+        raise ValueError(f"فایل شامل چند مدرسه است ({', '.join(sorted(school_names))}). "
+                         "برای هر مدرسه یک فایل جداگانه بسازید.")
+
+    cursor.executemany("""
+        INSERT OR IGNORE INTO schools (name, manager_name, username, password)
+        VALUES (?, ?, ?, ?)
+    """, [(name, manager, username, password_hash) for name, manager, username in schools])
+
+    school_name = schools[0][0]
+    cursor.execute("SELECT id FROM schools WHERE name=?", (school_name,))
+    row = cursor.fetchone()
+    if not row:
+        log.error(f"❌ مدرسه با نام '{school_name}' یافت نشد. بارگذاری داده‌ها متوقف شد.")
+        return None
+    return row[0]
+
+
+def _import_grades_and_classes(cursor, school_id: int, grades_classes: List[Tuple]) -> Dict[str, int]:
+    grade_names = list(dict.fromkeys(grade for grade, _ in grades_classes))
+    cursor.executemany("INSERT OR IGNORE INTO grades (name, school_id) VALUES (?, ?)",
+                       [(g, school_id) for g in grade_names])
+
+    cursor.execute("SELECT name, id FROM grades WHERE school_id=?", (school_id,))
+    grade_ids = dict(cursor.fetchall())
+    cursor.executemany("INSERT OR IGNORE INTO classes (name, grade_id) VALUES (?, ?)",
+                       [(class_name, grade_ids[grade]) for grade, class_name in grades_classes])
+    return _class_ids_for_school(cursor, school_id)
+
+
+def _import_subjects(cursor, school_id: int, subjects: List[Tuple], class_ids: Dict[str, int],
+                     password_hash: str) -> int:
+    # معلم‌ها: اولین ردیف هر نام کاربری ملاک است (مثل نسخه قبلی)
+    teachers = {}
+    for _, _, teacher_name, teacher_username, _ in subjects:
+        teachers.setdefault(teacher_username, teacher_name)
+    cursor.executemany("""
+        INSERT OR IGNORE INTO teachers (name, username, password, school_id)
+        VALUES (?, ?, ?, ?)
+    """, [(name, username, password_hash, school_id) for username, name in teachers.items()])
+    teacher_ids = _resolve_usernames(cursor, "teachers", teachers)
+
+    # دروسی که از قبل وجود دارند (برای جلوگیری از درج تکراری)
+    cursor.execute("""
+        SELECT s.name, s.class_id, s.teacher_id FROM subjects s
+        JOIN classes c ON c.id = s.class_id
+        JOIN grades g ON g.id = c.grade_id
+        WHERE g.school_id = ?
+    """, (school_id,))
+    existing = set(cursor.fetchall())
+
+    new_rows = []
+    for subject_name, class_name, _, teacher_username, coef in subjects:
+        class_id = class_ids.get(class_name)
+        if class_id is None:
+            log.warning(f"⚠️ کلاس «{class_name}» برای درس «{subject_name}» یافت نشد.")
+            continue
+        key = (subject_name, class_id, teacher_ids[teacher_username])
+        if key in existing:
+            continue
+        existing.add(key)
+        new_rows.append(key + (coef,))
+
+    cursor.executemany("""
+        INSERT INTO subjects (name, class_id, teacher_id, coefficient)
+        VALUES (?, ?, ?, ?)
+    """, new_rows)
+    return len(new_rows)
+
+
+def _import_students(cursor, students: List[Tuple], class_ids: Dict[str, int], password_hash: str) -> int:
+    rows = []
+    for student_name, class_name, student_username in students:
+        class_id = class_ids.get(class_name)
+        if class_id is None:
+            log.warning(f"⚠️ کلاس «{class_name}» برای دانش‌آموز «{student_name}» یافت نشد.")
+            continue
+        rows.append((student_name, student_username, password_hash, class_id))
+
+    cursor.executemany("""
+        INSERT OR IGNORE INTO students (name, username, password, class_id)
+        VALUES (?, ?, ?, ?)
+    """, rows)
+    return max(cursor.rowcount, 0)  # تعداد دانش‌آموزانی که واقعاً درج شدند
+
+
+def _import_rows(cursor, schools: List[Tuple], grades_classes: List[Tuple],
+                 subject_chunks: Iterable[List[Tuple]], student_chunks: Iterable[List[Tuple]],
+                 password_hash: str, stats: Dict):
+    """هسته مشترک واردکننده؛ دروس و دانش‌آموزان به صورت دسته‌ای (chunk) پردازش می‌شوند."""
+    stats["rows"] = len(schools) + len(grades_classes)
+
+    school_id = _import_school(cursor, schools, password_hash)
+    if school_id is None:
+        return
+    stats["school_id"] = school_id
+
+    class_ids = _import_grades_and_classes(cursor, school_id, grades_classes)
+    for chunk in subject_chunks:
+        stats["subjects"] += _import_subjects(cursor, school_id, chunk, class_ids, password_hash)
+        stats["rows"] += len(chunk)
+    for chunk in student_chunks:
+        stats["students"] += _import_students(cursor, chunk, class_ids, password_hash)
+        stats["rows"] += len(chunk)
+
+
+def _finish_stats(stats: Dict, started: float) -> Dict:
+    elapsed = time.perf_counter() - started
+    stats["seconds"] = round(elapsed, 3)
+    stats["rows_per_sec"] = round(stats["rows"] / elapsed) if elapsed > 0 else stats["rows"]
+    log.info(f"⏱️ {stats['rows']} ردیف در {stats['seconds']} ثانیه ({stats['rows_per_sec']} ردیف در ثانیه) بارگذاری شد.")
+    return stats
+
+
+@serialized_write
+def import_roster(roster: Dict[str, List[Tuple]], password_hash: str) -> Dict:
+    """
+    داده‌های خوانده‌شده از اکسل را به صورت مجموعه‌ای (executemany برای هر شیت و
+    نگاشت کلیدهای خارجی با دیکشنری در حافظه) و در یک تراکنش در دیتابیس می‌نویسد.
+    خروجی: آمار بارگذاری (تعداد ردیف‌ها، زمان و سرعت)
+    """
+    started = time.perf_counter()
+    stats = {"school_id": None, "rows": 0, "subjects": 0, "students": 0}
+
+    if not roster["schools"]:
+        log.error("❌ شیت مدرسه خالی است. بارگذاری داده‌ها متوقف شد.")
+        return stats
+
+    with db_connection() as conn:
+        _import_rows(conn.cursor(), roster["schools"], roster["grades_classes"],
+                     [roster["subjects"]], [roster["students"]], password_hash, stats)
+        # تمام تغییرات در پایان این بلاک به صورت یکجا commit می‌شوند.
+
+    return _finish_stats(stats, started)
+
+
+@serialized_write
+def import_workbook_streaming(file_path: str, password_hash: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Dict:
+    """
+    مسیر کم‌حافظه: فایل اکسل یک بار و به صورت جریانی باز می‌شود و دروس و دانش‌آموزان
+    در دسته‌های chunk_size تایی مستقیماً به واردکننده داده می‌شوند؛
+    مصرف حافظه مستقل از حجم فایل ثابت می‌ماند.
+    """
+    started = time.perf_counter()
+    stats = {"school_id": None, "rows": 0, "subjects": 0, "students": 0}
+
+    with StreamingWorkbook(file_path) as wb:
+        schools = wb.read_all(SCHOOLS_SHEET, SHEET_COLUMNS[SCHOOLS_SHEET])
+        if not schools:
+            log.error("❌ شیت مدرسه خالی است. بارگذاری داده‌ها متوقف شد.")
+            return stats
+        grades_classes = wb.read_all(GRADES_SHEET, SHEET_COLUMNS[GRADES_SHEET])
+
+        with db_connection() as conn:
+            _import_rows(conn.cursor(), schools, grades_classes,
+                         wb.chunks(SUBJECTS_SHEET, SHEET_COLUMNS[SUBJECTS_SHEET], chunk_size),
+                         wb.chunks(STUDENTS_SHEET, SHEET_COLUMNS[STUDENTS_SHEET], chunk_size),
+                         password_hash, stats)
+
+    return _finish_stats(stats, started)
@@ -0,0 +1,299 @@
+# schoolbot/database/migrations.py
+
+import logging
+import statistics
+
+from schoolbot.database.connection_pool import db_connection
+from schoolbot.database.db_writer import serialized_write
+
+log = logging.getLogger(__name__)
+
+
+# ======= مهاجرت‌ها =======
+# هر مهاجرت یک شماره نسخه دارد و فقط یک بار روی هر دیتابیس اجرا می‌شود.
+# شماره نسخه فعلی در PRAGMA user_version خود فایل دیتابیس نگه‌داری می‌شود.
+# مهاجرت‌ها به کد سرویس‌ها وابسته نیستند: پرکردن اولیه‌ی داده‌ها با SQL/محاسبه‌ی ثابت همین فایل
+# انجام می‌شود تا تغییرات بعدی سرویس‌ها نتیجه‌ی یک مهاجرت قدیمی را عوض نکند.
+
+_M001_INDEXES = (
+    # لیست دانش‌آموزان یک کلاس (get_students_by_class و get_students_scores_by_class)
+    "CREATE INDEX IF NOT EXISTS idx_students_class ON students(class_id, id, name)",
+    # میانگین کلاس در هر درس/دوره و وضعیت تکمیل نمرات
+    "CREATE INDEX IF NOT EXISTS idx_scores_period_subject "
+    "ON scores(report_period_id, subject_id, student_id, score)",
+    # پیمایش مدرسه ← پایه ← کلاس ← درس
+    "CREATE INDEX IF NOT EXISTS idx_grades_school ON grades(school_id)",
+    "CREATE INDEX IF NOT EXISTS idx_classes_grade ON classes(grade_id)",
+    "CREATE INDEX IF NOT EXISTS idx_subjects_class ON subjects(class_id)",
+    "CREATE INDEX IF NOT EXISTS idx_subjects_teacher ON subjects(teacher_id, name)",
+    "CREATE INDEX IF NOT EXISTS idx_teachers_school ON teachers(school_id)",
+    # دوره‌های یک مدرسه و شناسه‌های بله
+    "CREATE INDEX IF NOT EXISTS idx_report_periods_school ON report_periods(school_id, approved)",
+    "CREATE INDEX IF NOT EXISTS idx_user_message_user_role ON user_message(user_id, role)",
+)
+
+
+def _m001_indexes(cursor):
+    """ایندکس‌های پوشاننده برای مسیرهای پرتکرار خواندن."""
+    for statement in _M001_INDEXES:
+        cursor.execute(statement)
+
+
+def _m002_unique_scores(cursor):
+    """کلید یکتای (دانش‌آموز، درس، دوره) روی نمرات؛ رکوردهای تکراری قبلی حذف می‌شوند."""
+    # از هر گروه تکراری فقط آخرین رکورد ثبت‌شده نگه داشته می‌شود
+    cursor.execute("""
+        DELETE FROM scores
+        WHERE id NOT IN (
+            SELECT MAX(id) FROM scores
+            GROUP BY student_id, subject_id, report_period_id
+        )
+    """)
+    if cursor.rowcount:
+        log.warning(f"⚠️ {cursor.rowcount} نمره تکراری هنگام مهاجرت حذف شد.")
+    cursor.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_scores_student_subject_period
+            ON scores(student_id, subject_id, report_period_id)
+    """)
+
+
+def _m003_import_runs(cursor):
+    """سابقه‌ی بارگذاری فایل‌های اکسل برای ادامه دادن bulk import پس از خطا."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS import_runs (
+            file_hash TEXT PRIMARY KEY,           -- sha256 محتوای فایل
+            file_path TEXT NOT NULL,
+            school_name TEXT,
+            school_id INTEGER,
+            status TEXT NOT NULL,                 -- done / failed
+            stats TEXT,                           -- آمار به صورت JSON
+            error TEXT,
+            finished_at TEXT
+        )
+    """)
+
+
+def _m004_roster_sync_state(cursor):
+    """آخرین وضعیت همگام‌سازی فهرست هر مدرسه (برای تشخیص سریع فایل بدون تغییر)."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS roster_sync_state (
+            school_id INTEGER PRIMARY KEY,
+            file_hash TEXT NOT NULL,              -- sha256 محتوای فایل اکسل
+            sheet_digests TEXT NOT NULL,          -- هش ردیف‌های هر شیت به صورت JSON
+            synced_at TEXT,
+            FOREIGN KEY (school_id) REFERENCES schools(id)
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_roster_sync_file ON roster_sync_state(file_hash)")
+
+
+def _m005_period_rankings(cursor):
+    """رتبه‌های از پیش محاسبه‌شده‌ی هر دوره؛ دوره‌های تأییدشده‌ی فعلی همین‌جا ساخته می‌شوند."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS period_rankings (
+            report_period_id INTEGER NOT NULL,
+            student_id INTEGER NOT NULL,
+            school_id INTEGER NOT NULL,
+            class_id INTEGER NOT NULL,
+            grade_id INTEGER NOT NULL,
+            weighted_average REAL NOT NULL,
+            class_rank INTEGER, class_count INTEGER,
+            grade_rank INTEGER, grade_count INTEGER,
+            school_rank INTEGER, school_count INTEGER,
+            PRIMARY KEY (report_period_id, student_id)
+        ) WITHOUT ROWID
+    """)
+    # نفرات برتر هر کلاس/پایه/مدرسه مستقیماً از روی ایندکس رتبه خوانده می‌شوند
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_period_rankings_class "
+                   "ON period_rankings(report_period_id, class_id, class_rank)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_period_rankings_grade "
+                   "ON period_rankings(report_period_id, grade_id, grade_rank)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_period_rankings_school "
+                   "ON period_rankings(report_period_id, school_rank)")
+
+    # پرکردن اولیه برای همه‌ی دوره‌های تأییدشده در یک گذر (نسخه‌ی ثابت محاسبه‌ی معدل و رتبه)
+    cursor.execute("""
+        INSERT OR REPLACE INTO period_rankings
+            (report_period_id, student_id, school_id, class_id, grade_id, weighted_average)
+        SELECT sc.report_period_id, st.id, g.school_id, st.class_id, c.grade_id,
+               SUM(sc.score * s.coefficient) / SUM(s.coefficient)
+        FROM scores sc
+        JOIN subjects s ON sc.subject_id = s.id
+        JOIN students st ON sc.student_id = st.id
+        JOIN classes c ON st.class_id = c.id
+        JOIN grades g ON c.grade_id = g.id
+        JOIN report_periods rp ON rp.id = sc.report_period_id
+        WHERE rp.approved = 1 AND sc.score IS NOT NULL AND g.school_id = rp.school_id
+        GROUP BY sc.report_period_id, st.id, st.class_id, c.grade_id
+    """)
+    cursor.execute("""
+        UPDATE period_rankings SET
+            class_rank = r.class_rank, class_count = r.class_count,
+            grade_rank = r.grade_rank, grade_count = r.grade_count,
+            school_rank = r.school_rank, school_count = r.school_count
+        FROM (
+            SELECT report_period_id, student_id,
+                   RANK() OVER (PARTITION BY report_period_id, class_id ORDER BY weighted_average DESC) AS class_rank,
+                   COUNT(*) OVER (PARTITION BY report_period_id, class_id) AS class_count,
+                   RANK() OVER (PARTITION BY report_period_id, grade_id ORDER BY weighted_average DESC) AS grade_rank,
+                   COUNT(*) OVER (PARTITION BY report_period_id, grade_id) AS grade_count,
+                   RANK() OVER (PARTITION BY report_period_id ORDER BY weighted_average DESC) AS school_rank,
+                   COUNT(*) OVER (PARTITION BY report_period_id) AS school_count
+            FROM period_rankings
+        ) AS r
+        WHERE period_rankings.report_period_id = r.report_period_id
+          AND period_rankings.student_id = r.student_id
+    """)
+
+
+def _m006_group_stats(scores):
+    """آمار یک گروه نمره با همان تعریف‌های زمان مهاجرت (انحراف معیار جمعیتی، چارک‌های inclusive)."""
+    scores = sorted(float(s) for s in scores)
+    n = len(scores)
+    if n == 1:
+        q1 = median = q3 = scores[0]
+    else:
+        q1, median, q3 = statistics.quantiles(scores, n=4, method="inclusive")
+    mode = min(statistics.multimode(scores))
+    return (n, sum(scores), statistics.fmean(scores), statistics.pstdev(scores),
+            scores[0], q1, median, q3, scores[-1], mode, scores.count(mode),
+            sum(1 for s in scores if s < 10), sum(1 for s in scores if s >= 15))
+
+
+def _m006_class_subject_stats(cursor):
+    """آمار آماده‌ی هر کلاس در هر درس و دوره (میانگین، انحراف معیار، چارک‌ها و ...)."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS class_subject_stats (
+            report_period_id INTEGER NOT NULL,
+            subject_id INTEGER NOT NULL,
+            class_id INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            sum REAL NOT NULL,
+            mean REAL NOT NULL,
+            stddev REAL NOT NULL,
+            min REAL, q1 REAL, median REAL, q3 REAL, max REAL,
+            mode REAL, mode_freq INTEGER,
+            below_10 INTEGER, above_15 INTEGER,
+            PRIMARY KEY (report_period_id, subject_id, class_id)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        SELECT sc.report_period_id, sc.subject_id, st.class_id, sc.score
+        FROM scores sc
+        JOIN students st ON st.id = sc.student_id
+        WHERE sc.score IS NOT NULL
+    """)
+    groups = {}
+    for period_id, subject_id, class_id, score in cursor.fetchall():
+        groups.setdefault((period_id, subject_id, class_id), []).append(score)
+    cursor.executemany("""
+        INSERT OR REPLACE INTO class_subject_stats
+            (report_period_id, subject_id, class_id, count, sum, mean, stddev,
+             min, q1, median, q3, max, mode, mode_freq, below_10, above_15)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, [key + _m006_group_stats(scores) for key, scores in groups.items()])
+
+
+def _m007_period_data_version(cursor):
+    """شمارنده‌ی تغییر داده‌های هر دوره؛ با هر ثبت نمره یا تغییر تأیید زیاد می‌شود (اعتبار snapshot کارنامه‌ها)."""
+    cursor.execute("PRAGMA table_info(report_periods)")
+    if "data_version" not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute("ALTER TABLE report_periods ADD COLUMN data_version INTEGER NOT NULL DEFAULT 0")
+
+
+def _m008_bale_file_ids(cursor):
+    """شناسه‌ی فایل بله برای هر تصویر ارسال‌شده (بر اساس hash محتوا) تا ارسال دوباره بدون آپلود انجام شود."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS bale_file_ids (
+            content_hash TEXT PRIMARY KEY,
+            file_id TEXT NOT NULL,
+            uploaded_at TEXT NOT NULL DEFAULT (datetime('now'))
+        ) WITHOUT ROWID
+    """)
+
+
+def _m009_sessions(cursor):
+    """وضعیت گفتگوی کاربران (session_store) تا با راه‌اندازی دوباره‌ی ربات کسی از حساب خارج نشود."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sessions (
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            state BLOB NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (namespace, key)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_updated ON sessions(updated_at)")
+
+
+def _m010_broadcasts(cursor):
+    """پیام‌های گروهی مدیر (یادآوری‌ها) و وضعیت تحویل هر گیرنده تا ارسال دوباره فقط به موارد ناموفق برسد."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            school_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            created_at TEXT NOT NULL DEFAULT (datetime('now'))
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_broadcasts_school ON broadcasts(school_id, id)")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+            broadcast_id INTEGER NOT NULL REFERENCES broadcasts(id) ON DELETE CASCADE,
+            role TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            name TEXT,
+            id_bale TEXT,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            updated_at TEXT NOT NULL DEFAULT (datetime('now')),
+            PRIMARY KEY (broadcast_id, role, user_id)
+        ) WITHOUT ROWID
+    """)
+
+
+MIGRATIONS = [
+    (1, "ایندکس‌های پایه", _m001_indexes),
+    (2, "کلید یکتای نمرات", _m002_unique_scores),
+    (3, "سابقه‌ی بارگذاری اکسل", _m003_import_runs),
+    (4, "وضعیت همگام‌سازی فهرست مدارس", _m004_roster_sync_state),
+    (5, "جدول رتبه‌های دوره", _m005_period_rankings),
+    (6, "آمار کلاس/درس/دوره", _m006_class_subject_stats),
+    (7, "نسخه‌ی داده‌های دوره", _m007_period_data_version),
+    (8, "شناسه‌ی فایل‌های آپلودشده در بله", _m008_bale_file_ids),
+    (9, "وضعیت گفتگوی کاربران", _m009_sessions),
+    (10, "پیام‌های گروهی و وضعیت تحویل", _m010_broadcasts),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+@serialized_write
+def run_migrations():
+    """
+    دیتابیس موجود را تا آخرین نسخه طرح (schema) به‌روز می‌کند.
+    هر مهاجرت جداگانه commit می‌شود و تکرار آن بی‌خطر است (IF NOT EXISTS)،
+    پس اگر اجرا نیمه‌کاره بماند، در اجرای بعدی از همان نسخه ادامه پیدا می‌کند.
+    """
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='scores'")
+        if cursor.fetchone() is None:
+            log.warning("⚠️ جداول هنوز ساخته نشده‌اند؛ مهاجرت‌ها پس از create_tables اجرا می‌شوند.")
+            return 0
+        current = cursor.execute("PRAGMA user_version").fetchone()[0]
+
+    for version, title, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            migrate(cursor)
+            # PRAGMA پارامتر نمی‌پذیرد؛ version همیشه یک عدد صحیح داخلی است
+            cursor.execute(f"PRAGMA user_version = {int(version)}")
+        log.info(f"✅ مهاجرت {version} ({title}) اعمال شد.")
+        current = version
+
+    return current
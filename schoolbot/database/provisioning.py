@@ -0,0 +1,152 @@
+# schoolbot/database/provisioning.py
+"""
+ساخت رمز اولیه‌ی اختصاصی برای حساب‌های واردشده از اکسل.
+
+    python -m schoolbot.database.provisioning [--school-id 3] [--rounds 12] [--workers 4] [--out credentials.xlsx]
+
+حساب‌هایی که رمزشان هنوز bcrypt نیست (مثلاً رمز پیش‌فرض بارگذاری اکسل) یک رمز تصادفی می‌گیرند.
+هش bcrypt به صورت دسته‌ای و موازی در چند پردازه ساخته می‌شود و رمزهای اولیه برای توزیع
+در یک فایل اکسل ذخیره می‌شوند. فایل پیش از ثبت هش‌ها نوشته می‌شود تا هیچ رمزی گم نشود.
+"""
+
+import argparse
+import secrets
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+from openpyxl import Workbook
+
+from schoolbot.auth.auth import BCRYPT_ROUNDS, hash_password
+from schoolbot.database.connection_pool import db_connection
+from schoolbot.database.data_loader import create_tables
+from schoolbot.database.db_writer import serialized_write
+
+# حروف و ارقام بدون نویسه‌های شبیه به هم (0/o، 1/l/i)
+PASSWORD_ALPHABET = "23456789abcdefghjkmnpqrstuvwxyz"
+PASSWORD_LENGTH = 8
+
+# تعداد رمزی که در هر بار به یک پردازه فرستاده می‌شود
+HASH_BATCH_SIZE = 200
+
+ROLE_TABLES = {"manager": "schools", "teacher": "teachers", "student": "students"}
+ROLE_TITLES = {"manager": "مدیر", "teacher": "معلم", "student": "دانش‌آموز"}
+
+
+def _not_bcrypt(column: str) -> str:
+    """شرط SQL برای حساب‌هایی که رمزشان هنوز هش bcrypt نیست."""
+    return f"({column} IS NULL OR {column} NOT LIKE '$2%')"
+
+
+def generate_password(length: int = PASSWORD_LENGTH) -> str:
+    return "".join(secrets.choice(PASSWORD_ALPHABET) for _ in range(length))
+
+
+def _hash_batch(passwords: List[str], rounds: int) -> List[str]:
+    """در پردازه‌ی جداگانه اجرا می‌شود."""
+    return [hash_password(p, rounds) for p in passwords]
+
+
+def hash_passwords_parallel(passwords: List[str], rounds: int = BCRYPT_ROUNDS, workers: int = None) -> List[str]:
+    """هش bcrypt فهرستی از رمزها به صورت موازی؛ ترتیب خروجی همان ترتیب ورودی است."""
+    batches = [passwords[i:i + HASH_BATCH_SIZE] for i in range(0, len(passwords), HASH_BATCH_SIZE)]
+    hashes = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for batch_hashes in pool.map(_hash_batch, batches, [rounds] * len(batches)):
+            hashes.extend(batch_hashes)
+    return hashes
+
+
+# ======= حساب‌های نیازمند رمز =======
+def get_unprovisioned_accounts(school_id: int = None) -> List[Tuple]:
+    """خروجی: [(role, user_id, name, username, school_name, class_name), ...]"""
+    school_filter = "" if school_id is None else " AND sc.id = ?"
+    params = () if school_id is None else (school_id,)
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT 'manager', sc.id, sc.manager_name, sc.username, sc.name, ''
+            FROM schools sc
+            WHERE {_not_bcrypt('sc.password')}{school_filter}
+        """, params)
+        accounts = cursor.fetchall()
+        cursor.execute(f"""
+            SELECT 'teacher', t.id, t.name, t.username, sc.name, ''
+            FROM teachers t
+            JOIN schools sc ON sc.id = t.school_id
+            WHERE {_not_bcrypt('t.password')}{school_filter}
+            ORDER BY t.name
+        """, params)
+        accounts += cursor.fetchall()
+        cursor.execute(f"""
+            SELECT 'student', st.id, st.name, st.username, sc.name, c.name
+            FROM students st
+            JOIN classes c ON c.id = st.class_id
+            JOIN grades g ON g.id = c.grade_id
+            JOIN schools sc ON sc.id = g.school_id
+            WHERE {_not_bcrypt('st.password')}{school_filter}
+            ORDER BY c.name, st.name
+        """, params)
+        accounts += cursor.fetchall()
+    return accounts
+
+
+@serialized_write
+def store_password_hashes(rows: List[Tuple[str, int, str]]) -> int:
+    """rows: [(role, user_id, hashed_password), ...] — همه در یک تراکنش."""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        for role, table in ROLE_TABLES.items():
+            cursor.executemany(f"UPDATE {table} SET password = ? WHERE id = ?",
+                               [(hashed, user_id) for r, user_id, hashed in rows if r == role])
+    return len(rows)
+
+
+def export_credentials(accounts: List[Tuple], passwords: List[str], out_path: str):
+    """برگه‌ی رمزهای اولیه؛ یک شیت برای هر نقش."""
+    wb = Workbook(write_only=True)
+    sheets = {}
+    for (role, _, name, username, school_name, class_name), password in zip(accounts, passwords):
+        ws = sheets.get(role)
+        if ws is None:
+            ws = sheets[role] = wb.create_sheet(ROLE_TITLES[role])
+            ws.append(["مدرسه", "کلاس", "نام", "نام کاربری", "رمز اولیه"])
+        ws.append([school_name, class_name, name, username, password])
+    wb.save(out_path)
+
+
+# ======= اجرای اصلی =======
+def provision_accounts(school_id: int = None, rounds: int = BCRYPT_ROUNDS, workers: int = None,
+                       out_path: str = "credentials.xlsx") -> Dict:
+    """
+    برای حساب‌های بدون رمز bcrypt رمز اولیه می‌سازد، آن را در out_path ذخیره و هش آن را ثبت می‌کند.
+    خروجی: {"accounts", "seconds", "file"}
+    """
+    started = time.perf_counter()
+    accounts = get_unprovisioned_accounts(school_id)
+    if not accounts:
+        print("✅ همه حساب‌ها رمز bcrypt دارند؛ کاری برای انجام نیست.")
+        return {"accounts": 0, "seconds": 0, "file": None}
+
+    passwords = [generate_password() for _ in accounts]
+    hashes = hash_passwords_parallel(passwords, rounds, workers)
+
+    export_credentials(accounts, passwords, out_path)
+    store_password_hashes([(role, user_id, hashed) for (role, user_id, *_), hashed in zip(accounts, hashes)])
+
+    elapsed = round(time.perf_counter() - started, 3)
+    print(f"🔑 برای {len(accounts)} حساب رمز اولیه ساخته شد ({elapsed} ثانیه، rounds={rounds}).")
+    print(f"📄 فهرست رمزها در «{out_path}» ذخیره شد؛ پس از توزیع آن را حذف کنید.")
+    return {"accounts": len(accounts), "seconds": elapsed, "file": out_path}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ساخت رمز اولیه برای حساب‌های واردشده")
+    parser.add_argument("--school-id", type=int, default=None, help="فقط حساب‌های یک مدرسه")
+    parser.add_argument("--rounds", type=int, default=BCRYPT_ROUNDS, help="هزینه‌ی bcrypt (۴ تا ۳۱)")
+    parser.add_argument("--workers", type=int, default=None, help="تعداد پردازه‌های هش")
+    parser.add_argument("--out", default="credentials.xlsx", help="مسیر فایل اکسل رمزها")
+    args = parser.parse_args()
+
+    create_tables()
+    provision_accounts(args.school_id, rounds=args.rounds, workers=args.workers, out_path=args.out)
@@ -0,0 +1,439 @@
+# schoolbot/database/roster_sync.py
+"""
+همگام‌سازی تدریجی فهرست مدرسه با فایل اکسل (به جای بارگذاری کامل دوباره).
+
+    python -m schoolbot.database.roster_sync school_data.xlsx [--dry-run]
+
+ردیف‌های فایل با وضعیت فعلی دیتابیس مقایسه می‌شوند و فقط تغییرات اعمال می‌شود:
+درج‌های جدید، تغییر نام، جابه‌جایی دانش‌آموز بین کلاس‌ها و تغییر معلم یا ضریب درس.
+تغییر ضریب یا کلاس در همان تراکنش رتبه‌ها و آمار کلاس/درس دوره‌های متأثر را دوباره می‌سازد.
+هیچ ردیفی حذف نمی‌شود؛ دانش‌آموزانی که در فایل نیستند فقط در گزارش می‌آیند.
+اگر محتوای فایل (یا ردیف‌های همه شیت‌ها) با آخرین همگام‌سازی یکی باشد، مقایسه کامل انجام نمی‌شود.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple
+
+from schoolbot.database.bulk_import import file_hash, parse_workbook
+from schoolbot.database.connection_pool import db_connection
+from schoolbot.database.data_loader import DEFAULT_PASSWORD, create_tables
+from schoolbot.database.db_writer import serialized_write
+from schoolbot.database.excel_importer import _class_ids_for_school, _resolve_usernames, import_roster
+
+log = logging.getLogger(__name__)
+
+# حداکثر تعداد نمونه‌ای که از هر نوع تغییر در گزارش چاپ می‌شود
+REPORT_SAMPLE_SIZE = 10
+
+# ======= نقاط اتصال سرویس‌ها =======
+# این ماژول به سرویس‌ها وابسته نیست؛ بازسازی آمار و رتبه‌ها و ابطال کش کارنامه‌ها را
+# schoolbot.services.roster_refresh هنگام import در این فهرست‌ها ثبت می‌کند:
+#   period_refresh_hooks: (cursor, period_id, approved, stats_subject_ids) در همان تراکنش، برای هر دوره‌ی متأثر
+#   roster_commit_hooks: (school_id) پس از commit تغییرات
+period_refresh_hooks: List[Callable] = []
+roster_commit_hooks: List[Callable] = []
+
+
+# ======= هش ردیف‌ها =======
+def sheet_digest(rows: List[Tuple]) -> str:
+    """هش یک شیت، مستقل از ترتیب ردیف‌ها (مرتب‌سازی روی هش هر ردیف)."""
+    row_hashes = sorted(hashlib.sha1(repr(row).encode()).digest() for row in rows)
+    return hashlib.sha256(b"".join(row_hashes)).hexdigest()
+
+
+def roster_digests(roster: Dict[str, List[Tuple]]) -> Dict[str, str]:
+    return {key: sheet_digest(rows) for key, rows in roster.items()}
+
+
+# ======= وضعیت آخرین همگام‌سازی =======
+def _synced_school_for_file(digest: str):
+    with db_connection() as conn:
+        row = conn.execute("SELECT school_id FROM roster_sync_state WHERE file_hash = ?", (digest,)).fetchone()
+    return row[0] if row else None
+
+
+def _stored_digests(cursor, school_id: int) -> Dict[str, str]:
+    cursor.execute("SELECT sheet_digests FROM roster_sync_state WHERE school_id = ?", (school_id,))
+    row = cursor.fetchone()
+    return json.loads(row[0]) if row else {}
+
+
+def _save_sync_state(cursor, school_id: int, digest: str, digests: Dict[str, str]):
+    cursor.execute("""
+        INSERT INTO roster_sync_state (school_id, file_hash, sheet_digests, synced_at)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(school_id) DO UPDATE SET
+            file_hash = excluded.file_hash, sheet_digests = excluded.sheet_digests,
+            synced_at = excluded.synced_at
+    """, (school_id, digest, json.dumps(digests), datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+
+
+# ======= مقایسه و اعمال تغییرات هر بخش =======
+def _new_report(school_id=None, status="synced") -> Dict:
+    return {
+        "school_id": school_id, "status": status,
+        "school_updated": 0, "grades_added": 0, "classes_added": 0,
+        "teachers_added": 0, "teachers_renamed": 0,
+        "subjects_added": 0, "subjects_updated": 0,
+        "students_added": 0, "students_renamed": 0, "students_moved": 0,
+        "students_missing": 0, "conflicts": 0, "periods_refreshed": 0,
+        "details": {},
+    }
+
+
+def _note(report: Dict, kind: str, text: str):
+    report["details"].setdefault(kind, []).append(text)
+
+
+def _sync_school(cursor, school_id: int, schools: List[Tuple], report: Dict):
+    _, manager, _ = schools[0]
+    cursor.execute("SELECT manager_name FROM schools WHERE id = ?", (school_id,))
+    if cursor.fetchone()[0] != manager:
+        cursor.execute("UPDATE schools SET manager_name = ? WHERE id = ?", (manager, school_id))
+        report["school_updated"] = 1
+        _note(report, "school_updated", f"مدیر: {manager}")
+
+
+def _sync_grades_and_classes(cursor, school_id: int, grades_classes: List[Tuple], report: Dict) -> Dict[str, int]:
+    cursor.execute("SELECT name, id FROM grades WHERE school_id = ?", (school_id,))
+    grade_ids = dict(cursor.fetchall())
+    new_grades = [g for g in dict.fromkeys(grade for grade, _ in grades_classes) if g not in grade_ids]
+    if new_grades:
+        cursor.executemany("INSERT INTO grades (name, school_id) VALUES (?, ?)",
+                           [(g, school_id) for g in new_grades])
+        cursor.execute("SELECT name, id FROM grades WHERE school_id = ?", (school_id,))
+        grade_ids = dict(cursor.fetchall())
+        report["grades_added"] = len(new_grades)
+        for g in new_grades:
+            _note(report, "grades_added", g)
+
+    class_ids = _class_ids_for_school(cursor, school_id)
+    new_classes = {}
+    for grade, class_name in grades_classes:
+        if class_name not in class_ids and class_name not in new_classes:
+            new_classes[class_name] = grade_ids[grade]
+    if new_classes:
+        cursor.executemany("INSERT OR IGNORE INTO classes (name, grade_id) VALUES (?, ?)", new_classes.items())
+        class_ids = _class_ids_for_school(cursor, school_id)
+        report["classes_added"] = len(new_classes)
+        for c in new_classes:
+            _note(report, "classes_added", c)
+    return class_ids
+
+
+def _sync_teachers(cursor, school_id: int, subjects: List[Tuple], password_hash: str, report: Dict) -> Dict[str, int]:
+    file_teachers = {}
+    for _, _, teacher_name, teacher_username, _ in subjects:
+        file_teachers.setdefault(teacher_username, teacher_name)
+
+    cursor.execute("SELECT username, id, name FROM teachers WHERE school_id = ?", (school_id,))
+    db_teachers = {username: (tid, name) for username, tid, name in cursor.fetchall()}
+
+    new, renamed = [], []
+    for username, name in file_teachers.items():
+        current = db_teachers.get(username)
+        if current is None:
+            new.append(username)
+        elif current[1] != name:
+            renamed.append((name, current[0]))
+            _note(report, "teachers_renamed", f"{current[1]} ← {name}")
+
+    # نام کاربری‌ای که در مدرسه دیگری ثبت شده، درج نمی‌شود (مثل بارگذاری کامل همان معلم استفاده می‌شود)
+    elsewhere = _resolve_usernames(cursor, "teachers", new) if new else {}
+    to_insert = [u for u in new if u not in elsewhere]
+    cursor.executemany("""
+        INSERT INTO teachers (name, username, password, school_id) VALUES (?, ?, ?, ?)
+    """, [(file_teachers[u], u, password_hash, school_id) for u in to_insert])
+    cursor.executemany("UPDATE teachers SET name = ? WHERE id = ?", renamed)
+
+    report["teachers_added"] = len(to_insert)
+    report["teachers_renamed"] = len(renamed)
+    report["conflicts"] += len(elsewhere)
+    for u in to_insert:
+        _note(report, "teachers_added", f"{file_teachers[u]} ({u})")
+    for u in elsewhere:
+        _note(report, "conflicts", f"معلم {u} در مدرسه دیگری ثبت شده است")
+    return _resolve_usernames(cursor, "teachers", file_teachers)
+
+
+def _sync_subjects(cursor, school_id: int, subjects: List[Tuple], class_ids: Dict[str, int],
+                   teacher_ids: Dict[str, int], report: Dict) -> List[int]:
+    # هر درس با (نام درس، کلاس) شناخته می‌شود؛ تغییر معلم یا ضریب یک به‌روزرسانی است نه درس جدید
+    # خروجی: شناسه‌ی درس‌هایی که ضریبشان تغییر کرده
+    cursor.execute("""
+        SELECT s.name, s.class_id, s.id, s.teacher_id, s.coefficient FROM subjects s
+        JOIN classes c ON c.id = s.class_id
+        JOIN grades g ON g.id = c.grade_id
+        WHERE g.school_id = ?
+        ORDER BY s.id
+    """, (school_id,))
+    db_subjects = {}
+    for name, class_id, subject_id, teacher_id, coef in cursor.fetchall():
+        db_subjects.setdefault((name, class_id), (subject_id, teacher_id, coef))
+
+    inserts, updates, coefficient_changed, seen = [], [], [], set()
+    for subject_name, class_name, _, teacher_username, coef in subjects:
+        class_id = class_ids.get(class_name)
+        if class_id is None:
+            print(f"⚠️ کلاس «{class_name}» برای درس «{subject_name}» یافت نشد.")
+            continue
+        key = (subject_name, class_id)
+        if key in seen:
+            continue
+        seen.add(key)
+        teacher_id = teacher_ids[teacher_username]
+        current = db_subjects.get(key)
+        if current is None:
+            inserts.append((subject_name, class_id, teacher_id, coef))
+            _note(report, "subjects_added", f"{subject_name} ({class_name})")
+        elif current[1:] != (teacher_id, coef):
+            updates.append((teacher_id, coef, current[0]))
+            if current[2] != coef:
+                coefficient_changed.append(current[0])
+            _note(report, "subjects_updated", f"{subject_name} ({class_name}): ضریب {current[2]} ← {coef}"
+                  if current[2] != coef else f"{subject_name} ({class_name}): معلم جدید {teacher_username}")
+
+    cursor.executemany("INSERT INTO subjects (name, class_id, teacher_id, coefficient) VALUES (?, ?, ?, ?)", inserts)
+    cursor.executemany("UPDATE subjects SET teacher_id = ?, coefficient = ? WHERE id = ?", updates)
+    report["subjects_added"] = len(inserts)
+    report["subjects_updated"] = len(updates)
+    return coefficient_changed
+
+
+def _sync_students(cursor, school_id: int, students: List[Tuple], class_ids: Dict[str, int],
+                   password_hash: str, report: Dict) -> List[int]:
+    """خروجی: شناسه‌ی دانش‌آموزانی که کلاسشان تغییر کرده"""
+    cursor.execute("""
+        SELECT st.username, st.id, st.name, st.class_id FROM students st
+        JOIN classes c ON c.id = st.class_id
+        JOIN grades g ON g.id = c.grade_id
+        WHERE g.school_id = ?
+    """, (school_id,))
+    db_students = {username: (sid, name, class_id) for username, sid, name, class_id in cursor.fetchall()}
+    class_names = {cid: name for name, cid in class_ids.items()}
+
+    new, renamed, moved, seen = [], [], [], set()
+    for student_name, class_name, username in students:
+        class_id = class_ids.get(class_name)
+        if class_id is None:
+            print(f"⚠️ کلاس «{class_name}» برای دانش‌آموز «{student_name}» یافت نشد.")
+            continue
+        if username in seen:
+            continue
+        seen.add(username)
+        current = db_students.get(username)
+        if current is None:
+            new.append((student_name, username, class_id))
+            continue
+        sid, db_name, db_class_id = current
+        if db_name != student_name:
+            renamed.append((student_name, sid))
+            _note(report, "students_renamed", f"{db_name} ← {student_name}")
+        if db_class_id != class_id:
+            moved.append((class_id, sid))
+            _note(report, "students_moved",
+                  f"{student_name}: {class_names.get(db_class_id, db_class_id)} ← {class_name}")
+
+    elsewhere = _resolve_usernames(cursor, "students", [u for _, u, _ in new]) if new else {}
+    to_insert = [row for row in new if row[1] not in elsewhere]
+    cursor.executemany("INSERT INTO students (name, username, password, class_id) VALUES (?, ?, ?, ?)",
+                       [(name, username, password_hash, class_id) for name, username, class_id in to_insert])
+    cursor.executemany("UPDATE students SET name = ? WHERE id = ?", renamed)
+    cursor.executemany("UPDATE students SET class_id = ? WHERE id = ?", moved)
+
+    missing = [u for u in db_students if u not in seen]
+    report["students_added"] = len(to_insert)
+    report["students_renamed"] = len(renamed)
+    report["students_moved"] = len(moved)
+    report["students_missing"] = len(missing)
+    report["conflicts"] += len(elsewhere)
+    for name, username, _ in to_insert:
+        _note(report, "students_added", f"{name} ({username})")
+    for u in elsewhere:
+        _note(report, "conflicts", f"دانش‌آموز {u} در مدرسه دیگری ثبت شده است")
+    for u in missing:
+        _note(report, "students_missing", f"{db_students[u][1]} ({u})")
+    return [sid for _, sid in moved]
+
+
+def _refresh_periods(cursor, school_id: int, subject_ids: List[int], student_ids: List[int],
+                     report: Dict, dry_run: bool):
+    """
+    معدل‌های وزنی period_rankings به ضریب درس‌ها و کلاس/پایه‌ی دانش‌آموز وابسته‌اند و class_subject_stats
+    به کلاس دانش‌آموز؛ پس از تغییر این‌ها رتبه‌های دوره‌های تأییدشده و آمار درس‌های متأثر دوباره ساخته
+    و data_version دوره‌ها زیاد می‌شود (تا snapshot کارنامه‌ها هم دوباره ساخته شوند).
+    """
+    if not subject_ids and not student_ids:
+        return
+    # (دوره، درس) هایی که دانش‌آموزان جابه‌جاشده در آن‌ها نمره دارند → آمار کلاس‌های مبدأ و مقصد
+    cursor.execute("""
+        SELECT DISTINCT sc.report_period_id, sc.subject_id FROM scores sc
+        JOIN report_periods rp ON rp.id = sc.report_period_id
+        WHERE rp.school_id = ? AND sc.student_id IN (SELECT value FROM json_each(?))
+    """, (school_id, json.dumps(student_ids)))
+    stats_subjects = {}
+    for period_id, subject_id in cursor.fetchall():
+        stats_subjects.setdefault(period_id, []).append(subject_id)
+    cursor.execute("""
+        SELECT DISTINCT rp.id, rp.name, rp.approved FROM scores sc
+        JOIN report_periods rp ON rp.id = sc.report_period_id
+        WHERE rp.school_id = ? AND sc.subject_id IN (SELECT value FROM json_each(?))
+    """, (school_id, json.dumps(subject_ids)))
+    periods = {period_id: (name, approved) for period_id, name, approved in cursor.fetchall()}
+    if stats_subjects:
+        cursor.execute(f"""
+            SELECT id, name, approved FROM report_periods
+            WHERE id IN ({", ".join("?" * len(stats_subjects))})
+        """, list(stats_subjects))
+        periods.update({period_id: (name, approved) for period_id, name, approved in cursor.fetchall()})
+
+    report["periods_refreshed"] = len(periods)
+    for period_id, (name, _) in sorted(periods.items()):
+        _note(report, "periods_refreshed", name)
+    if dry_run:
+        return
+    if periods and not period_refresh_hooks:
+        log.warning("⚠️ هیچ تابع بازسازی ثبت نشده است (schoolbot.services.roster_refresh import نشده)؛ "
+                    "رتبه‌ها و آمار دوره‌های متأثر به‌روز نشدند.")
+    for period_id, (_, approved) in periods.items():
+        for hook in period_refresh_hooks:
+            hook(cursor, period_id, bool(approved), stats_subjects.get(period_id, []))
+    cursor.executemany("UPDATE report_periods SET data_version = data_version + 1 WHERE id = ?",
+                       [(period_id,) for period_id in periods])
+
+
+@serialized_write
+def apply_roster_changes(school_id: int, roster: Dict[str, List[Tuple]], digest: str,
+                         digests: Dict[str, str], password_hash: str, dry_run: bool = False) -> Dict:
+    """
+    خواندن وضعیت فعلی، مقایسه و نوشتن تغییرات در یک تراکنش و در thread نویسنده انجام می‌شود
+    تا بین مقایسه و نوشتن تغییر دیگری وارد دیتابیس نشود. با dry_run فقط گزارش ساخته می‌شود.
+    """
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        if _stored_digests(cursor, school_id) == digests:
+            # فایل دوباره ذخیره شده ولی ردیف‌ها همان است
+            if not dry_run:
+                _save_sync_state(cursor, school_id, digest, digests)
+            return _new_report(school_id, "unchanged")
+
+        report = _new_report(school_id, "dry_run" if dry_run else "synced")
+        _sync_school(cursor, school_id, roster["schools"], report)
+        class_ids = _sync_grades_and_classes(cursor, school_id, roster["grades_classes"], report)
+        teacher_ids = _sync_teachers(cursor, school_id, roster["subjects"], password_hash, report)
+        changed_subjects = _sync_subjects(cursor, school_id, roster["subjects"], class_ids, teacher_ids, report)
+        moved_students = _sync_students(cursor, school_id, roster["students"], class_ids, password_hash, report)
+        _refresh_periods(cursor, school_id, changed_subjects, moved_students, report, dry_run)
+
+        if dry_run:
+            conn.rollback()
+        else:
+            _save_sync_state(cursor, school_id, digest, digests)
+    if not dry_run:
+        for hook in roster_commit_hooks:
+            hook(school_id)
+    return report
+
+
+@serialized_write
+def _record_full_import(school_id: int, digest: str, digests: Dict[str, str]):
+    with db_connection() as conn:
+        _save_sync_state(conn.cursor(), school_id, digest, digests)
+
+
+# ======= اجرای اصلی =======
+def sync_roster(file_path: str, password_hash: str = DEFAULT_PASSWORD, dry_run: bool = False) -> Dict:
+    """
+    فایل اکسل یک مدرسه را با دیتابیس همگام می‌کند و گزارش تغییرات را برمی‌گرداند.
+    اگر مدرسه هنوز در دیتابیس نباشد، بارگذاری کامل (import_roster) انجام می‌شود.
+    """
+    started = time.perf_counter()
+    digest = file_hash(file_path)
+
+    school_id = _synced_school_for_file(digest)
+    if school_id is not None:
+        # همان فایل قبلاً همگام شده؛ نیازی به خواندن اکسل نیست
+        report = _new_report(school_id, "unchanged")
+    else:
+        roster = parse_workbook(file_path)
+        if not roster["schools"]:
+            raise ValueError("شیت مدرسه خالی است.")
+        school_names = set(name for name, _, _ in roster["schools"])
+        if len(school_names) > 1:
+            raise ValueError(f"فایل شامل چند مدرسه است ({', '.join(sorted(school_names))}).")
+        digests = roster_digests(roster)
+
+        with db_connection() as conn:
+            row = conn.execute("SELECT id FROM schools WHERE name = ?", (roster["schools"][0][0],)).fetchone()
+        if row is None:
+            if dry_run:
+                report = _new_report(None, "new_school")
+            else:
+                stats = import_roster(roster, password_hash)
+                report = _new_report(stats["school_id"], "imported")
+                report["students_added"] = stats["students"]
+                report["subjects_added"] = stats["subjects"]
+                _record_full_import(stats["school_id"], digest, digests)
+        else:
+            report = apply_roster_changes(row[0], roster, digest, digests, password_hash, dry_run)
+
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    return report
+
+
+def print_report(report: Dict):
+    titles = {
+        "school_updated": "🏫 اطلاعات مدرسه به‌روز شد",
+        "grades_added": "➕ پایه جدید",
+        "classes_added": "➕ کلاس جدید",
+        "teachers_added": "➕ معلم جدید",
+        "teachers_renamed": "✏️ تغییر نام معلم",
+        "subjects_added": "➕ درس جدید",
+        "subjects_updated": "✏️ تغییر معلم/ضریب درس",
+        "students_added": "➕ دانش‌آموز جدید",
+        "students_renamed": "✏️ تغییر نام دانش‌آموز",
+        "students_moved": "🔀 جابه‌جایی کلاس",
+        "students_missing": "⚠️ در فایل نیست (حذف نشد)",
+        "conflicts": "⛔ نام کاربری تکراری در مدرسه دیگر",
+        "periods_refreshed": "🔄 بازسازی رتبه‌ها و آمار دوره",
+    }
+    print("━" * 20)
+    if report["status"] == "unchanged":
+        print(f"✅ تغییری نسبت به آخرین همگام‌سازی وجود ندارد ({report['seconds']} ثانیه).")
+        return
+    if report["status"] == "new_school":
+        print("ℹ️ این مدرسه هنوز در دیتابیس نیست؛ در اجرای واقعی به طور کامل بارگذاری می‌شود.")
+        return
+
+    for key, title in titles.items():
+        if not report[key]:
+            continue
+        print(f"{title}: {report[key]}")
+        details = report["details"].get(key, [])
+        for line in details[:REPORT_SAMPLE_SIZE]:
+            print(f"    • {line}")
+        if len(details) > REPORT_SAMPLE_SIZE:
+            print(f"    … و {len(details) - REPORT_SAMPLE_SIZE} مورد دیگر")
+    print("━" * 20)
+    if report["status"] == "dry_run":
+        print(f"🔍 اجرای آزمایشی؛ تغییری ذخیره نشد ({report['seconds']} ثانیه).")
+    else:
+        print(f"✅ همگام‌سازی انجام شد ({report['seconds']} ثانیه).")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="همگام‌سازی تدریجی فهرست مدرسه با فایل اکسل")
+    parser.add_argument("path", nargs="?", default="school_data.xlsx", help="فایل اکسل مدرسه")
+    parser.add_argument("--dry-run", action="store_true", help="فقط گزارش تغییرات، بدون ذخیره")
+    args = parser.parse_args()
+
+    # ثبت بازسازی رتبه‌ها/آمار و ابطال کش در نقاط اتصال همگام‌سازی
+    import schoolbot.services.roster_refresh  # noqa: F401
+
+    create_tables()
+    print_report(sync_roster(args.path, dry_run=args.dry_run))
@@ -0,0 +1,93 @@
+# schoolbot/database/workbook_reader.py
+
+from itertools import islice
+from typing import Iterator, List, Tuple
+
+from openpyxl import load_workbook
+
+# تعداد ردیف‌هایی که در هر مرحله به واردکننده داده می‌شود
+DEFAULT_CHUNK_SIZE = 2000
+
+# ستون‌هایی که باید عدد صحیح باشند و مقدار پیش‌فرضشان
+INT_COLUMNS = {"ضریب درس": 1}
+
+
+def _cell_text(value) -> str:
+    return "" if value is None else str(value).strip()
+
+
+def _cell_int(value, default: int) -> int:
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return default
+
+
+def iter_sheet_rows(worksheet, columns: List[str]) -> Iterator[Tuple]:
+    """
+    ردیف‌های یک شیت را یکی‌یکی (بدون بارگذاری کل شیت در حافظه) و با ترتیب ستون‌های خواسته‌شده برمی‌گرداند.
+    ردیف اول سرستون فرض می‌شود؛ ردیف‌های کاملاً خالی نادیده گرفته می‌شوند.
+    """
+    rows = worksheet.iter_rows(values_only=True)
+    header = next(rows, None)
+    if header is None:
+        return
+    positions = {_cell_text(name): i for i, name in enumerate(header)}
+    missing = [col for col in columns if col not in positions]
+    if missing:
+        raise ValueError(f"ستون‌های {missing} در شیت «{worksheet.title}» یافت نشد.")
+    indexes = [positions[col] for col in columns]
+
+    for row in rows:
+        if row is None or all(v is None for v in row):
+            continue
+        values = []
+        for col, idx in zip(columns, indexes):
+            value = row[idx] if idx < len(row) else None
+            if col in INT_COLUMNS:
+                values.append(_cell_int(value, INT_COLUMNS[col]))
+            else:
+                values.append(_cell_text(value))
+        yield tuple(values)
+
+
+def iter_chunks(rows: Iterator[Tuple], chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[List[Tuple]]:
+    """ردیف‌ها را در دسته‌های با اندازه محدود برمی‌گرداند تا مصرف حافظه ثابت بماند."""
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class StreamingWorkbook:
+    """
+    فایل اکسل را فقط یک بار و در حالت read-only (جریانی) باز می‌کند.
+    استفاده: `with StreamingWorkbook(path) as wb: for chunk in wb.chunks(sheet, columns): ...`
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self._workbook = None
+
+    def __enter__(self):
+        self._workbook = load_workbook(self.file_path, read_only=True, data_only=True)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._workbook is not None:
+            self._workbook.close()
+            self._workbook = None
+
+    def rows(self, sheet_name: str, columns: List[str]) -> Iterator[Tuple]:
+        return iter_sheet_rows(self._workbook[sheet_name], columns)
+
+    def chunks(self, sheet_name: str, columns: List[str],
+               chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[List[Tuple]]:
+        return iter_chunks(self.rows(sheet_name, columns), chunk_size)
+
+    def read_all(self, sheet_name: str, columns: List[str]) -> List[Tuple]:
+        """برای شیت‌های کوچک (مدرسه، پایه‌ها) که کل آن‌ها لازم است."""
+        return list(self.rows(sheet_name, columns))
+
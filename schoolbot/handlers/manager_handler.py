@@ -1,19 +1,18 @@
+import asyncio
 import logging
-import os
 
 import jdatetime
 
 from schoolbot.services.open_ai_response import get_chatbot_response
-from schoolbot.services.report_service import (
-    create_report_period,
-    toggle_report_period_approval,
-    get_all_report_periods,
-    get_scores_completion_status,
-    get_all_user_messages_user_id_role
-)
+from schoolbot.database.async_db import run_db
+from schoolbot.services import repository as repo
+from schoolbot.services.broadcast import start_broadcast
+from schoolbot.services.media_service import send_photo_cached
+from schoolbot.services.render_queue import render_queue
+from schoolbot.services.session_store import session_store
 
 from schoolbot.services.score_service_manager import get_school_multi_period_analysis
-from schoolbot.utils.helpers import format_school_multi_period_analysis
+from schoolbot.chart.render_service import render_service, school_multi_period_analysis
 from schoolbot.utils.keyboards import normalize_digits, to_persian_digits
 from schoolbot.utils.manager_report_ai_text import extract_course_stats
 
@@ -26,7 +25,7 @@ logging.basicConfig(
 logging.getLogger("aiohttp").setLevel(logging.WARNING)
 logging.getLogger("balethon").setLevel(logging.WARNING)
 
-manager_states = {}  # ذخیره وضعیت مدیران
+manager_states = session_store("manager")  # ذخیره وضعیت مدیران
 
 
 # ---------- تابع کمکی: تغییر مرحله و نمایش منو ----------
@@ -41,38 +40,71 @@ async def set_step_and_show_menu(user_id, st, step, client, chat_id):
 
 
 # ---------- تابع کمکی: ارسال پیام یادآوری ----------
-async def send_reminder_messages(client, chat_id, incomplete_teachers, selected_period_name):
+def broadcast_progress_reporter(client, chat_id, title):
+    """گزارش پیشرفت ارسال گروهی به مدیر در هر ربع کار و خلاصه‌ی نهایی"""
+
+    async def on_progress(summary):
+        done, total = to_persian_digits(str(summary["done"])), to_persian_digits(str(summary["total"]))
+        if summary["done"] < summary["total"]:
+            await client.send_message(chat_id, f"📨 {title}: {done} از {total} پیام ارسال شد.")
+            return
+        text = f"✅ {title}: {to_persian_digits(str(summary['sent']))} از {total} پیام تحویل شد."
+        if summary["failed_names"]:
+            text += "\n⚠️ ارسال به این افراد ممکن نبود (آیدی بله ثبت نشده یا خطای ارسال):\n"
+            text += "\n".join(f"   • {name}" for name in summary["failed_names"])
+            text += "\n🔁 برای ارسال دوباره فقط به موارد ناموفق، در منوی مدیر «5» را بفرستید."
+        await client.send_message(chat_id, text)
+
+    return on_progress
+
+
+async def send_reminder_messages(client, chat_id, school_id, incomplete_teachers, selected_period_name):
     try:
-        manager_message = ""
+        # شناسه‌های بله‌ی همه‌ی دبیران با یک پرس‌وجو؛ ارسال هم‌زمان و در پس‌زمینه (منوی مدیر معطل نمی‌ماند)
+        bale_ids = await repo.get_bale_ids(list(incomplete_teachers), "teacher")
+        today = jdatetime.datetime.now().strftime(' %Y/%m/%d ساعت: %H:%M')
+        recipients = []
         for teacher_id, info in incomplete_teachers.items():
-            try:
-                id_bale_list = get_all_user_messages_user_id_role(user_id=teacher_id, role="teacher")
-                if not id_bale_list:
-                    manager_message += f"\n⚠️ آیدی بله {info['teacher']} پیدا نشد."
-                    continue
-
-                lessons_text = "\n".join(info["lessons"])
-                await client.send_message(
-                    id_bale_list[0][0],  # اولین id_bale معتبر
-                    f"{info['teacher']}\n📢 یادآوری: لطفاً هرچه سریع‌تر نمرات '{selected_period_name}' را تکمیل کنید.\n❗ موارد ناقص شما:\n{lessons_text} \n تاریخ امروز: {jdatetime.datetime.now().strftime(' %Y/%m/%d ساعت: %H:%M')}"
-                )
-                manager_message += f"\n✅ پیام یادآوری برای {info['teacher']} ارسال شد."
-            except Exception as e:
-                logging.error(f"❌ خطا در ارسال پیام یادآوری به {info['teacher']}: {e}")
-                manager_message += f"\n⚠️ ارسال پیام به {info['teacher']} ممکن نبود."
-
-        if manager_message:
-            await client.send_message(chat_id, manager_message)
+            lessons_text = "\n".join(info["lessons"])
+            recipients.append((
+                teacher_id,
+                info["teacher"],
+                bale_ids.get(teacher_id),
+                f"{info['teacher']}\n📢 یادآوری: لطفاً هرچه سریع‌تر نمرات '{selected_period_name}' را تکمیل کنید.\n❗ موارد ناقص شما:\n{lessons_text} \n تاریخ امروز: {today}"
+            ))
+
+        title = f"یادآوری نمرات «{selected_period_name}»"
+        broadcast_id = await repo.create_broadcast(school_id, title, "teacher", recipients)
+        start_broadcast(client, broadcast_id, broadcast_progress_reporter(client, chat_id, title))
+        await client.send_message(
+            chat_id, f"📨 ارسال یادآوری به {to_persian_digits(str(len(recipients)))} دبیر آغاز شد؛ پیشرفت کار گزارش می‌شود.")
 
     except Exception as e:
         logging.error(f"❌ خطا در send_reminder_messages: {e}")
         await client.send_message(chat_id, "⚠️ خطا در ارسال پیام‌های یادآوری.")
 
 
+async def retry_last_broadcast(client, chat_id, school_id):
+    """ارسال دوباره‌ی آخرین پیام گروهی فقط به گیرنده‌هایی که پیامشان تحویل نشده است"""
+    try:
+        latest = await repo.get_latest_broadcast(school_id)
+        if not latest or not latest["undelivered"]:
+            await client.send_message(chat_id, "✅ پیام تحویل‌نشده‌ای برای ارسال دوباره وجود ندارد.")
+        elif not start_broadcast(client, latest["id"], broadcast_progress_reporter(client, chat_id, latest["title"])):
+            await client.send_message(chat_id, "⏳ این ارسال هنوز در جریان است؛ پس از پایان آن دوباره تلاش کنید.")
+        else:
+            await client.send_message(
+                chat_id, f"🔁 ارسال دوباره‌ی «{latest['title']}» به {to_persian_digits(str(latest['undelivered']))} گیرنده آغاز شد.")
+    except Exception as e:
+        logging.error(f"❌ خطا در retry_last_broadcast: {e}")
+        await client.send_message(chat_id, "⚠️ خطا در ارسال دوباره‌ی پیام‌ها.")
+
+
 # ---------- تابع اصلی هندل پیام مدیر ----------
 async def handle_manager_message(client, chat_id, user_id, text, name):
     try:
         text = normalize_digits(text.strip())
+        await manager_states.prefetch(user_id)
         st = manager_states.get(user_id, {})
 
         # خروج کامل
@@ -136,7 +168,7 @@ async def handle_manager_message(client, chat_id, user_id, text, name):
         step = st.get("step")
         if step == "create_report_period":
             try:
-                create_report_period(text, user_id)
+                await repo.create_report_period(text, user_id)
                 await client.send_message(chat_id, f"✅ دوره «{text}» ایجاد شد.")
             except Exception as e:
                 logging.error(f"❌ خطا در create_report_period: {e}")
@@ -168,10 +200,10 @@ async def handle_manager_main_menu(client, chat_id, user_id, text, st, name):
 
 
         elif text == "2":
-            chart_path = None  # متغیر را برای استفاده در finally تعریف می‌کنیم
             try:
-                analysis = get_school_multi_period_analysis(user_id)
-                msg, chart_path = format_school_multi_period_analysis(analysis, name)
+                analysis = await run_db(get_school_multi_period_analysis, user_id)
+                # متن و نمودار تحلیل در استخر پردازه‌ی رسم ساخته می‌شوند
+                msg, chart = await render_service.run(school_multi_period_analysis, analysis, name)
 
                 if "_@_error_@_" not in (
                         response := get_chatbot_response(role="manager", user_question=extract_course_stats(msg))):
@@ -180,10 +212,9 @@ async def handle_manager_main_menu(client, chat_id, user_id, text, st, name):
 
                 await client.send_message(chat_id, to_persian_digits(msg))
 
-                if chart_path and os.path.exists(chart_path):
-                    with open(chart_path, "rb") as photo_file:
-                        await client.send_photo(chat_id, photo_file,
-                                                caption=f"تحلیل و آنالیز تصویری مدرسه {name} \n {jdatetime.datetime.now().strftime(' %Y/%m/%d')} \n🔸 برای بازگشت «#» و برای خروج کامل «*»")
+                if chart:
+                    await send_photo_cached(client, chat_id, chart,
+                                            caption=f"تحلیل و آنالیز تصویری مدرسه {name} \n {jdatetime.datetime.now().strftime(' %Y/%m/%d')} \n🔸 برای بازگشت «#» و برای خروج کامل «*»")
                 else:
                     await client.send_message(chat_id, "⚠️ فایل نمودار یافت نشد.")
                 st["step"] = "viewed_report"
@@ -191,16 +222,9 @@ async def handle_manager_main_menu(client, chat_id, user_id, text, st, name):
             except Exception as e:
                 logging.error(f"❌ خطا در تحلیل کارنامه‌ها: {e}")
                 await client.send_message(chat_id, "⚠️ خطا در نمایش کارنامه‌ها.")
-            finally:
-                # در هر صورت (موفق یا ناموفق)، فایل موقت نمودار را حذف می‌کنیم
-                if chart_path and os.path.exists(chart_path):
-                    try:
-                        os.unlink(chart_path)
-                    except Exception as e:
-                        logging.error(f"❌ خطا در حذف فایل نمودار مدیر: {e}")
         elif text == "3":
             try:
-                periods = get_all_report_periods(user_id)
+                periods = await repo.get_all_report_periods(user_id)
                 if not periods:
                     await client.send_message(chat_id, "⚠️ هیچ دوره‌ای وجود ندارد.")
                     return
@@ -221,7 +245,7 @@ async def handle_manager_main_menu(client, chat_id, user_id, text, st, name):
 
         elif text == "4":
             try:
-                periods = get_all_report_periods(user_id)
+                periods = await repo.get_all_report_periods(user_id)
                 if not periods:
                     await client.send_message(chat_id, "⚠️ هیچ دوره‌ای برای بررسی وجود ندارد.")
                     return
@@ -238,6 +262,9 @@ async def handle_manager_main_menu(client, chat_id, user_id, text, st, name):
                 logging.error(f"❌ خطا در گرفتن وضعیت نمرات: {e}")
                 await client.send_message(chat_id, "⚠️ خطا در دریافت وضعیت نمرات.")
 
+        elif text == "5":
+            await retry_last_broadcast(client, chat_id, user_id)
+
         else:
             await client.send_message(chat_id, "⚠️ لطفاً عدد معتبر را وارد کنید.")
     except Exception as e:
@@ -246,6 +273,22 @@ async def handle_manager_main_menu(client, chat_id, user_id, text, st, name):
 
 
 # ---------- تایید/عدم تایید دوره ----------
+def snapshot_progress_reporter(client, chat_id, period_name):
+    """گزارش پیشرفت صف ساخت کارنامه‌ها به مدیر (از thread صف روی event loop ربات)"""
+    loop = asyncio.get_running_loop()
+
+    def on_progress(done, total, failed):
+        if done < total:
+            text = f"🖼️ کارنامه‌های دوره «{period_name}»: {to_persian_digits(str(done))} از {to_persian_digits(str(total))} آماده شد."
+        else:
+            text = f"✅ همه‌ی کارنامه‌های دوره «{period_name}» آماده شد."
+            if failed:
+                text += f"\n⚠️ {to_persian_digits(str(failed))} کارنامه با خطا مواجه شد و هنگام مشاهده ساخته می‌شود."
+        asyncio.run_coroutine_threadsafe(client.send_message(chat_id, text), loop)
+
+    return on_progress
+
+
 async def handle_approve_report_period(client, chat_id, user_id, text, st):
     try:
         choice = int(text)
@@ -253,8 +296,17 @@ async def handle_approve_report_period(client, chat_id, user_id, text, st):
         if 1 <= choice <= len(periods):
             selected = periods[choice - 1]
             try:
-                new_status = toggle_report_period_approval(selected["id"])
+                new_status = await repo.toggle_report_period_approval(selected["id"])
                 status_text = "✅ تأیید شد" if new_status else "❌ عدم تأیید شد"
+                # نمرات دوره‌ی تأییدشده نهایی است: کارنامه‌ها یک بار در پس‌زمینه ساخته می‌شوند
+                if new_status:
+                    count = await repo.enqueue_period_snapshots(
+                        selected["id"], snapshot_progress_reporter(client, chat_id, selected["name"]))
+                    if count:
+                        status_text += f"\n🖼️ آماده‌سازی کارنامه‌ی {to_persian_digits(str(count))} دانش‌آموز در پس‌زمینه آغاز شد."
+                else:
+                    render_queue.cancel_period(selected["id"])
+                    await repo.drop_period_snapshots(selected["id"])
                 await client.send_message(chat_id, f"دوره «{selected['name']}» {status_text}.")
             except Exception as e:
                 logging.error(f"❌ خطا در toggle_report_period_approval: {e}")
@@ -280,7 +332,7 @@ async def handle_check_scores_status(client, chat_id, user_id, text, st):
 
         selected = periods[choice - 1]
         try:
-            status_list = get_scores_completion_status(selected["id"], user_id)
+            status_list = await repo.get_scores_completion_status(selected["id"], user_id)
         except Exception as e:
             logging.error(f"❌ خطا در get_scores_completion_status: {e}")
             await client.send_message(chat_id, "⚠️ خطا در دریافت وضعیت نمرات.")
@@ -333,7 +385,7 @@ async def handle_check_scores_status(client, chat_id, user_id, text, st):
 async def handle_manager_decision(client, chat_id, user_id, text, st):
     try:
         if text == "1":
-            await send_reminder_messages(client, chat_id, st.get("incomplete_teachers", {}),
+            await send_reminder_messages(client, chat_id, user_id, st.get("incomplete_teachers", {}),
                                          st['selected_period']['name'])
             await set_step_and_show_menu(user_id, st, "manager_menu", client, chat_id)
         elif text == "2":
@@ -353,7 +405,8 @@ async def show_manager_menu(client, chat_id):
             "1️⃣ ایجاد دوره کارنامه\n"
             "2️⃣ مشاهده وضعیت دانش‌آموزان\n"
             "3️⃣ تأیید دوره کارنامه\n"
-            "4️⃣ بررسی وضعیت ثبت نمرات\n\n"
+            "4️⃣ بررسی وضعیت ثبت نمرات\n"
+            "5️⃣ ارسال دوباره‌ی یادآوری‌های ناموفق\n\n"
             "🔸 برای بازگشت ⬅️ #\n"
             "🔸 برای خروج از ربات ❌ *"
         )
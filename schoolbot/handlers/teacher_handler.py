@@ -1,24 +1,19 @@
 # teacher_handler
-import os
 
 import jdatetime
 import matplotlib
 
-from schoolbot.chart.teacher_chart.teacher_chart import generate_class_summary_chart_robust
-from schoolbot.present.teacher_presenter.teacher_presenter import summarize_class, _safe_prev_score_lookup
-from schoolbot.services.score_service_teacher import get_report_periods_teachers, get_teacher_school_id
+from schoolbot.chart.render_service import class_summary_chart, render_service
+from schoolbot.database.db_writer import writer
+from schoolbot.present.teacher_presenter.teacher_presenter import summarize_class
+from schoolbot.services import report_service, repository as repo
+from schoolbot.services.media_service import send_photo_cached
+from schoolbot.services.session_store import session_store
 from schoolbot.utils.keyboards import normalize_digits, to_persian_digits
 
 matplotlib.use('Agg')
 import logging
 
-from schoolbot.services.report_service import (
-    get_subjects_by_teacher,
-    get_students_by_class,
-    save_student_score,
-    get_class_by_id, get_students_scores_by_class,
-)
-
 # ------------------ Logging: فقط خطاها ------------------
 logging.basicConfig(
     level=logging.ERROR,
@@ -29,7 +24,51 @@ logging.getLogger("matplotlib").setLevel(logging.WARNING)
 logging.getLogger("aiohttp").setLevel(logging.WARNING)
 logging.getLogger("balethon").setLevel(logging.WARNING)
 
-teacher_states = {}  # keyed by teacher's DB id (user_id)
+teacher_states = session_store("teacher")  # keyed by teacher's DB id (user_id)
+
+# در ثبت نمرات کل کلاس، نمرات به صورت دسته‌ای (هر چند دانش‌آموز یک بار) در دیتابیس نوشته می‌شوند.
+# بافر داخل وضعیت معلم (session_store ماندگار) است و با راه‌اندازی دوباره‌ی ربات از بین نمی‌رود؛
+# خروج، بازگشت، /start، تغییر رمز و کنار گذاشته شدن وضعیت، بافر را ذخیره می‌کنند.
+SCORE_FLUSH_BATCH = 10
+
+
+# ----------------- توابع کمکی -----------------
+async def flush_pending_scores(st):
+    """نمرات بافرشده‌ی ثبت کلاسی را در یک تراکنش ذخیره و بافر را خالی می‌کند."""
+    pending = st.get("pending_scores")
+    if pending:
+        await repo.save_student_scores_bulk(st["subject_id"], st["report_period_id"], pending)
+    st["pending_scores"] = []
+
+
+async def flush_teacher_scores(user_id):
+    """ذخیره‌ی بافر نمرات یک معلم وقتی گفتگو از بیرون منوی معلم ریست می‌شود (/start، تغییر رمز)."""
+    await teacher_states.prefetch(user_id)
+    st = teacher_states.get(user_id)
+    if st and st.get("pending_scores"):
+        await flush_pending_scores(st)
+        teacher_states[user_id] = st
+
+
+def _save_discarded_scores(user_id, st):
+    """on_discard: نمرات بافرشده‌ی وضعیتی که منقضی یا از حافظه خارج می‌شود در صف نویسنده قرار می‌گیرند."""
+    pending = st.get("pending_scores") if isinstance(st, dict) else None
+    if not pending:
+        return
+    args = (st["subject_id"], st["report_period_id"], pending)
+    if writer.in_writer_thread():
+        # حذف ردیف‌های منقضی خودش در نویسنده اجرا می‌شود؛ اجرای مستقیم تا صف پر باعث بن‌بست نشود
+        report_service.save_student_scores_bulk(*args)
+        return
+
+    def _report(future):
+        if future.exception() is not None:
+            logging.error(f"❌ خطا در ذخیره نمرات بافرشده‌ی معلم {user_id}: {future.exception()}")
+
+    writer.submit(report_service.save_student_scores_bulk, *args).add_done_callback(_report)
+
+
+teacher_states.on_discard = _save_discarded_scores
 
 
 # ----------------- رندر منو -----------------
@@ -49,8 +88,8 @@ async def render_menu(client, chat_id, user_id):
 
         if step == "select_period":
             try:
-                ss = get_teacher_school_id(user_id)
-                periods = get_report_periods_teachers(ss)
+                ss = await repo.get_teacher_school_id(user_id)
+                periods = await repo.get_report_periods_teachers(ss)
             except Exception:
                 logging.exception("❌ خطا در دریافت دوره‌ها در render_menu")
                 await client.send_message(chat_id, "❌ خطا در دریافت دوره‌ها. لطفاً بعداً تلاش کنید.")
@@ -68,7 +107,7 @@ async def render_menu(client, chat_id, user_id):
 
         if step == "select_subject":
             try:
-                subjects = get_subjects_by_teacher(user_id)
+                subjects = await repo.get_subjects_by_teacher(user_id)
             except Exception:
                 logging.exception("❌ خطا در get_subjects_by_teacher در render_menu")
                 await client.send_message(chat_id, "❌ خطا در دریافت دروس.")
@@ -79,7 +118,7 @@ async def render_menu(client, chat_id, user_id):
             for i, s in enumerate(subjects, 1):
                 subject_id, subject_name, class_id = s
                 try:
-                    class_info = get_class_by_id(class_id)
+                    class_info = await repo.get_class_by_id(class_id)
                     class_name = class_info[1] if class_info else ""
                 except Exception:
                     logging.exception("❌ خطا در get_class_by_id در render_menu")
@@ -115,7 +154,7 @@ async def render_menu(client, chat_id, user_id):
                 await render_menu(client, chat_id, user_id)
                 return
             student_id, student_name = students[idx]
-            prev = _safe_prev_score_lookup(student_id, st.get("subject_id"), st.get("report_period_id"))
+            prev = await repo.prev_score_lookup(student_id, st.get("subject_id"), st.get("report_period_id"))
             msg = f"👨‍🎓 وارد کردن نمره برای: {student_name}\n"
             if prev:
                 msg += f"نمره قبلی: {prev.get('score')}, توضیح: {prev.get('description')}\n"
@@ -129,7 +168,7 @@ async def render_menu(client, chat_id, user_id):
 
         if step == "enter_score_single":
             student_id, student_name = st.get("current_student", ("?", "?"))
-            prev = _safe_prev_score_lookup(student_id, st.get("subject_id"), st.get("report_period_id"))
+            prev = await repo.prev_score_lookup(student_id, st.get("subject_id"), st.get("report_period_id"))
             msg = f"👨‍🎓 وارد کردن نمره برای: {student_name}\n"
             if prev:
                 msg += f"نمره قبلی: {prev.get('score')}, توضیح: {prev.get('description')}\n"
@@ -169,10 +208,16 @@ async def handle_teacher_message(client, chat_id, user_id, text, name):
         text = text.strip()
         text = normalize_digits(text)  # ← نرمال‌سازی اعداد
 
+        await teacher_states.prefetch(user_id)
         st = teacher_states.get(user_id, {})
 
         # خروج کامل
         if text in ("/خروج", "*", "خروج"):
+            try:
+                await flush_pending_scores(st)
+            except Exception:
+                logging.exception("❌ خطا در ذخیره نمرات باقی‌مانده هنگام خروج")
+                await client.send_message(chat_id, "❌ خطا در ذخیرهٔ نمرات ثبت‌شده.")
             teacher_states.pop(user_id, None)
             await client.send_message(chat_id, "✅ از حالت معلم خارج شدید. برای شروع مجدد /start را ارسال کنید.")
             return "RESET_SESSION"  # ارسال سیگنال برای ریست کامل به فایل اصلی
@@ -192,6 +237,11 @@ async def handle_teacher_message(client, chat_id, user_id, text, name):
             elif step == "choose_action":
                 st["step"] = "select_subject"
             elif step in ("enter_score", "enter_description"):
+                try:
+                    await flush_pending_scores(st)
+                except Exception:
+                    logging.exception("❌ خطا در ذخیره نمرات باقی‌مانده هنگام بازگشت")
+                    await client.send_message(chat_id, "❌ خطا در ذخیرهٔ نمرات ثبت‌شده.")
                 st["step"] = "choose_action"
             elif step == "select_student":
                 st["step"] = "choose_action"
@@ -239,7 +289,7 @@ async def handle_teacher_message(client, chat_id, user_id, text, name):
         if step == "choose_action":
             if text == "1":
                 try:
-                    students = get_students_by_class(st["class_id"])
+                    students = await repo.get_students_by_class(st["class_id"])
                 except Exception:
                     logging.exception("❌ خطا در get_students_by_class گزینه 1")
                     await client.send_message(chat_id, "❌ خطا در دریافت دانش‌آموزان.")
@@ -249,51 +299,53 @@ async def handle_teacher_message(client, chat_id, user_id, text, name):
                     await client.send_message(chat_id, "❌ هیچ دانش‌آموزی یافت نشد.")
                     teacher_states.pop(user_id, None)
                     return
-                st.update({"students": students, "current_index": 0, "step": "enter_score"})
+                st.update({"students": students, "current_index": 0, "pending_scores": [], "step": "enter_score"})
                 teacher_states[user_id] = st
                 await render_menu(client, chat_id, user_id)
                 return
 
             elif text == "2":
                 try:
-                    students_scores = get_students_scores_by_class(
+                    # آمار آماده + فقط ستون نمره‌ها؛ فهرست کامل دانش‌آموزان فقط اگر آماری ثبت نشده باشد خوانده می‌شود
+                    class_stats, class_size, class_scores = await repo.get_class_summary_inputs(
                         st["class_id"], st["subject_id"], st["report_period_id"]
                     )
-                    report, scores_list = summarize_class(
-                        st['subject_name'], students_scores, st.get('class_name', '')
-                    )
+                    if class_stats:
+                        report, scores_list = summarize_class(
+                            st['subject_name'], None, st.get('class_name', ''), class_stats, class_size, class_scores
+                        )
+                    else:
+                        students_scores = await repo.get_students_scores_by_class(
+                            st["class_id"], st["subject_id"], st["report_period_id"]
+                        )
+                        report, scores_list = summarize_class(
+                            st['subject_name'], students_scores, st.get('class_name', '')
+                        )
                     await client.send_message(chat_id, to_persian_digits(report))
 
-                    # تلاش برای ساخت، ارسال و حذف امن نمودار
+                    # تلاش برای ساخت و ارسال نمودار (رسم در استخر پردازه، بدون مسدود کردن ربات)
                     if scores_list:
-                        chart_path = None  # متغیر را برای استفاده در finally تعریف می‌کنیم
                         try:
-                            chart_path = generate_class_summary_chart_robust(
+                            chart = await render_service.run(
+                                class_summary_chart,
                                 scores_list,
                                 class_name=st.get("class_name", ""),
                                 subject_name=st.get('subject_name', ''),
                                 name=name
                             )
-                            if chart_path:
-                                # 1. فایل را با 'with' باز کرده و شیء فایل را به send_photo می‌دهیم
-                                with open(chart_path, "rb") as photo_file:
-                                    await client.send_photo(
-                                        chat_id,
-                                        photo=photo_file,
-                                        caption=f"تحلیل آماری نمرات {st.get('subject_name', '')} {st.get('class_name', '')}: {name} \n {jdatetime.datetime.now().strftime(' %Y/%m/%d')}"
-                                    )
+                            if chart:
+                                # تصویر تکراری (همان داده) با شناسه‌ی فایل قبلی بله و بدون آپلود ارسال می‌شود
+                                await send_photo_cached(
+                                    client,
+                                    chat_id,
+                                    chart,
+                                    caption=f"تحلیل آماری نمرات {st.get('subject_name', '')} {st.get('class_name', '')}: {name} \n {jdatetime.datetime.now().strftime(' %Y/%m/%d')}"
+                                )
                             else:
                                 await client.send_message(chat_id, "⚠️ تولید نمودار موفقیت‌آمیز نبود.")
                         except Exception as e:
                             logging.exception(f"❌ خطا در تولید یا ارسال نمودار (گزینه 2): {e}")
                             await client.send_message(chat_id, "⚠️ خطا در تولید نمودار.")
-                        finally:
-                            # 2. در هر صورت فایل موقت را بعد از اتمام کار 'with' حذف می‌کنیم
-                            if chart_path and os.path.exists(chart_path):
-                                try:
-                                    os.unlink(chart_path)
-                                except Exception as e:
-                                    logging.error(f"❌ خطا در حذف فایل نمودار موقت: {e}")
 
                 except Exception as e:
                     logging.exception(f"❌ خطا در دریافت یا خلاصه‌سازی نمرات (گزینه 2): {e}")
@@ -309,7 +361,7 @@ async def handle_teacher_message(client, chat_id, user_id, text, name):
 
             elif text == "3":
                 try:
-                    students = get_students_by_class(st["class_id"])
+                    students = await repo.get_students_by_class(st["class_id"])
                 except Exception:
                     logging.exception("❌ خطا در get_students_by_class گزینه 3")
                     await client.send_message(chat_id, "❌ خطا در دریافت دانش‌آموزان.")
@@ -322,7 +374,7 @@ async def handle_teacher_message(client, chat_id, user_id, text, name):
                 students_map = {}
                 for i, (student_id, student_name) in enumerate(students, 1):
                     msg += f"{i}. {student_name}\n"
-                    prev = _safe_prev_score_lookup(student_id, st["subject_id"], st["report_period_id"])
+                    prev = await repo.prev_score_lookup(student_id, st["subject_id"], st["report_period_id"])
                     if prev:
                         msg += f"نمره قبلی: {prev.get('score')}, توضیح: {prev.get('description')}\n"
                     students_map[str(i)] = (student_id, student_name)
@@ -379,8 +431,8 @@ async def handle_teacher_message(client, chat_id, user_id, text, name):
             student_id, _ = st["current_student"]
             if st.get("current_score") is not None or description:
                 try:
-                    save_student_score(student_id, st["subject_id"], st["report_period_id"], st["current_score"],
-                                       description)
+                    await repo.save_student_score(student_id, st["subject_id"], st["report_period_id"],
+                                                  st["current_score"], description)
                 except Exception:
                     logging.exception("❌ خطا در save_student_score (single)")
                     await client.send_message(chat_id, "❌ خطا در ذخیرهٔ نمره.")
@@ -426,15 +478,17 @@ async def handle_teacher_message(client, chat_id, user_id, text, name):
                 return
             student_id, _ = students[idx]
             if st.get("current_score") is not None or description:
+                st.setdefault("pending_scores", []).append((student_id, st["current_score"], description))
+            st["current_index"] = idx + 1
+            is_last = st["current_index"] >= len(students)
+            if is_last or len(st.get("pending_scores", [])) >= SCORE_FLUSH_BATCH:
                 try:
-                    save_student_score(student_id, st["subject_id"], st["report_period_id"], st["current_score"],
-                                       description)
+                    await flush_pending_scores(st)
                 except Exception:
-                    logging.exception("❌ خطا در save_student_score (batch)")
+                    logging.exception("❌ خطا در save_student_scores_bulk (batch)")
                     await client.send_message(chat_id, "❌ خطا در ذخیرهٔ نمره.")
                     teacher_states.pop(user_id, None)
                     return
-            st["current_index"] = idx + 1
             if st["current_index"] < len(students):
                 st["step"] = "enter_score"
                 teacher_states[user_id] = st
@@ -445,6 +499,7 @@ async def handle_teacher_message(client, chat_id, user_id, text, name):
                 st.pop("students", None)
                 st.pop("current_index", None)
                 st.pop("current_score", None)
+                st.pop("pending_scores", None)
                 st["step"] = "choose_action"
                 teacher_states[user_id] = st
                 await render_menu(client, chat_id, user_id)
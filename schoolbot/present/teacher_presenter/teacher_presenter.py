@@ -68,37 +68,51 @@ def _safe_prev_score_lookup(student_id, subject_id, report_period_id):
 
 
 # گزارش کلاس در یک درس
-def summarize_class(subject_name, students_scores, class_name):
+def summarize_class(subject_name, students_scores, class_name, stats=None, class_size=None, scores=None):
     """
-    محاسبه آمار کلاس با استفاده از NumPy برای حداکثر سرعت.
+    خلاصه‌ی آماری کلاس. اگر stats (از جدول class_subject_stats) داده شود همان اعداد آماده استفاده می‌شوند
+    و students_scores لازم نیست: class_size تعداد دانش‌آموزان کلاس و scores نمرات ثبت‌شده (برای نمودار) است؛
+    در غیر این صورت آمار با NumPy از روی students_scores محاسبه می‌شود.
     """
     try:
-        # استخراج نمرات معتبر و تبدیل به آرایه NumPy تنها یک بار
-        scores_array = np.array([s["score"] for s in students_scores if s["score"] is not None], dtype=float)
-
-        if scores_array.size == 0:
-            return f"📊 برای درس {subject_name} هیچ نمره‌ای ثبت نشده است.", []
-
-        n = scores_array.size
-
-        # --- اجرای تمام محاسبات با NumPy ---
-        avg = np.mean(scores_array)
-        std_dev = np.std(scores_array)
-        min_score, q1, median, q3, max_score = np.percentile(scores_array, [0, 25, 50, 75, 100])
-
-        # شمارش دسته‌ها به صورت برداری (بسیار سریع‌تر از list comprehension)
-        below_10 = np.count_nonzero(scores_array < 10)
-        above_15 = np.count_nonzero(scores_array >= 15)
+        if stats:
+            scores_array = np.array(scores or [], dtype=float)
+        else:
+            # استخراج نمرات معتبر و تبدیل به آرایه NumPy تنها یک بار
+            scores_array = np.array([s["score"] for s in students_scores if s["score"] is not None], dtype=float)
+            class_size = len(students_scores)
+
+            if scores_array.size == 0:
+                return f"📊 برای درس {subject_name} هیچ نمره‌ای ثبت نشده است.", []
+
+        if stats:
+            n = stats["count"]
+            avg, std_dev = stats["mean"], stats["stddev"]
+            min_score, q1, median, q3, max_score = (stats["min"], stats["q1"], stats["median"],
+                                                    stats["q3"], stats["max"])
+            below_10, above_15 = stats["below_10"], stats["above_15"]
+            mode_score, mode_freq = stats["mode"], stats["mode_freq"]
+        else:
+            n = scores_array.size
+
+            # --- اجرای تمام محاسبات با NumPy ---
+            avg = np.mean(scores_array)
+            std_dev = np.std(scores_array)
+            min_score, q1, median, q3, max_score = np.percentile(scores_array, [0, 25, 50, 75, 100])
+
+            # شمارش دسته‌ها به صورت برداری (بسیار سریع‌تر از list comprehension)
+            below_10 = np.count_nonzero(scores_array < 10)
+            above_15 = np.count_nonzero(scores_array >= 15)
+
+            # پیدا کردن مد (پرتکرارترین نمره)
+            vals, counts = np.unique(scores_array, return_counts=True)
+            index = np.argmax(counts)
+            mode_score, mode_freq = vals[index], counts[index]
         between_10_15 = n - below_10 - above_15
 
-        # پیدا کردن مد (پرتکرارترین نمره)
-        vals, counts = np.unique(scores_array, return_counts=True)
-        index = np.argmax(counts)
-        mode_score, mode_freq = vals[index], counts[index]
-
         summary_msg = (
             f"📊 خلاصه وضعیت کلاس {subject_name} {class_name}:\n"
-            f"📊 تعداد کل دانش‌آموزان کلاس: {len(students_scores)}\n"
+            f"📊 تعداد کل دانش‌آموزان کلاس: {class_size}\n"
             f"👥 تعداد دانش‌آموزان با نمره: {n}\n"
             f"📈 میانگin: {avg:.2f}\n"  # استفاده از f-string برای گرد کردن
             f"📉 انحراف معیار: {std_dev:.2f}\n"
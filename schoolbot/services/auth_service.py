@@ -1,45 +1,98 @@
 # services/auth_service.py
 
-from schoolbot.auth.auth import verify_password, hash_password
-from schoolbot.database.data_loader import get_connection
+import asyncio
+import logging
 
+from schoolbot.auth.auth import (
+    is_bcrypt_hash,
+    verify_password,
+    hash_password,
+    verify_password_async,
+    hash_password_async
+)
+from schoolbot.database.async_db import run_db
+from schoolbot.database.connection_pool import db_connection
+from schoolbot.database.db_writer import serialized_write, writer
 
-def check_login(username, password, role):
-    """
-    بررسی ورود کاربر بر اساس نقش (مدیر، معلم، دانش‌آموز)
-    خروجی: (موفق/ناموفق, user_id یا None, name یا None)
-    """
+logger = logging.getLogger(__name__)
+
+
+def _get_login_row(username, role):
     table = {"manager": "schools", "teacher": "teachers", "student": "students"}[role]
 
-    with get_connection() as conn:  # کانکشن مخصوص thread جاری
+    with db_connection() as conn:  # کانکشن مخصوص thread جاری (از استخر اتصال‌ها)
         cursor = conn.cursor()  # فقط خواندن، نیازی به قفل نیست
         cursor.execute(
             f"SELECT id, password, name FROM {table} WHERE username=?",
             (username,),
         )
-        res = cursor.fetchone()
+        return cursor.fetchone()
 
-        if not res:
-            return False, None, None
 
-        user_id, db_password, name = res
-        # return db_password == password, user_id, name
-        # 🔑 بررسی رمز با bcrypt
-        if verify_password(password, db_password):
-            return True, user_id, name
-        else:
-            return False, None, None
+def _has_bcrypt_password(user_id, db_password, role) -> bool:
+    # حساب‌هایی که هنوز رمز اختصاصی نگرفته‌اند (مثلاً دانش‌آموز تازه‌ی همگام‌سازی فهرست) رمز پیش‌فرض SHA-256 دارند؛
+    # bcrypt.checkpw روی آن خطای Invalid salt می‌دهد، پس ورود بدون بررسی رد می‌شود
+    if is_bcrypt_hash(db_password):
+        return True
+    logger.warning(f"⚠️ رمز حساب {role}:{user_id} هنوز bcrypt نیست؛ "
+                   f"python -m schoolbot.database.provisioning را برای ساخت رمز اولیه اجرا کنید.")
+    return False
+
+
+def check_login(username, password, role):
+    """
+    بررسی ورود کاربر بر اساس نقش (مدیر، معلم، دانش‌آموز)
+    خروجی: (موفق/ناموفق, user_id یا None, name یا None)
+    """
+    res = _get_login_row(username, role)
+    if not res:
+        return False, None, None
+
+    user_id, db_password, name = res
+    if not _has_bcrypt_password(user_id, db_password, role):
+        return False, None, None
+    # 🔑 بررسی رمز با bcrypt
+    if verify_password(password, db_password):
+        return True, user_id, name
+    else:
+        return False, None, None
+
+
+async def check_login_async(username, password, role):
+    """مثل check_login؛ خواندن از دیتابیس و بررسی bcrypt هر دو بیرون از event loop انجام می‌شوند."""
+    res = await run_db(_get_login_row, username, role)
+    if not res:
+        return False, None, None
+
+    user_id, db_password, name = res
+    if not _has_bcrypt_password(user_id, db_password, role):
+        return False, None, None
+    if await verify_password_async(password, db_password):
+        return True, user_id, name
+    else:
+        return False, None, None
 
 
 def change_password(user_id, new_password, role, id_bale):
     """
     تغییر رمز عبور کاربر با نقش مشخص
     """
-    table = {"manager": "schools", "teacher": "teachers", "student": "students"}[role]
+    # هش کردن (کند و پرمصرف) بیرون از thread نویسنده انجام می‌شود تا صف نوشتن معطل نماند
+    hashed_password = hash_password(new_password)
+    _store_new_password(user_id, hashed_password, role, id_bale)
+
 
-    with get_connection() as conn:
-        hashed_password = hash_password(new_password)
+async def change_password_async(user_id, new_password, role, id_bale):
+    """مثل change_password؛ نه هش bcrypt و نه انتظار برای نویسنده‌ی دیتابیس loop را مسدود نمی‌کند."""
+    hashed_password = await hash_password_async(new_password)
+    await asyncio.wrap_future(writer.submit(_store_new_password, user_id, hashed_password, role, id_bale))
+
+
+@serialized_write
+def _store_new_password(user_id, hashed_password, role, id_bale):
+    table = {"manager": "schools", "teacher": "teachers", "student": "students"}[role]
 
+    with db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute(
             f"UPDATE {table} SET password=? WHERE id=?",
@@ -76,7 +129,7 @@ def change_password(user_id, new_password, role, id_bale):
 
 
 def get_all_user_data():
-    with get_connection() as conn:
+    with db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT * FROM user_data")
         rows = cursor.fetchall()
@@ -0,0 +1,173 @@
+# services/broadcast.py
+
+import asyncio
+import json
+import logging
+import os
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from schoolbot.database.async_db import run_db, run_write
+from schoolbot.database.connection_pool import db_connection
+from schoolbot.database.db_writer import serialized_write
+from schoolbot.services.outbox import Outbox
+
+logger = logging.getLogger(__name__)
+
+# ======= ارسال گروهی پیام (یادآوری‌های مدیر) =======
+# هر ارسال گروهی یک ردیف در broadcasts و برای هر گیرنده یک ردیف در broadcast_deliveries دارد
+# (متن پیام، شناسه‌ی بله، وضعیت: pending / sent / failed / no_bale_id).
+# شناسه‌های بله همه‌ی گیرنده‌ها با یک پرس‌وجو پیدا می‌شوند و پیام‌ها هم‌زمان (حداکثر BROADCAST_CONCURRENCY
+# در جریان) ارسال می‌شوند؛ محدودیت نرخ را صف ارسال (Outbox) اعمال می‌کند.
+# اجرای دوباره‌ی یک ارسال گروهی فقط گیرنده‌هایی را هدف می‌گیرد که پیامشان هنوز تحویل نشده است.
+
+BROADCAST_CONCURRENCY = int(os.environ.get("SCHOOLBOT_BROADCAST_CONCURRENCY", 10))
+
+# گزارش پیشرفت در هر ربع کار (و ذخیره‌ی وضعیت‌های تحویل در همان لحظه)
+PROGRESS_STEPS = 4
+
+STATUS_PENDING, STATUS_SENT, STATUS_FAILED, STATUS_NO_BALE_ID = "pending", "sent", "failed", "no_bale_id"
+
+_running = {}  # broadcast_id → task (یک اجرای هم‌زمان برای هر ارسال گروهی)
+
+
+# ---------- دیتابیس ----------
+def get_bale_ids(user_ids: Iterable[int], role: str) -> Dict[int, str]:
+    """شناسه‌ی بله‌ی همه‌ی کاربران با یک پرس‌وجو (برای هر کاربر اولین شناسه‌ی ثبت‌شده)"""
+    with db_connection() as conn:
+        rows = conn.execute("""
+            SELECT user_id, id_bale FROM user_message
+            WHERE role = ? AND user_id IN (SELECT value FROM json_each(?))
+            ORDER BY id
+        """, (role, json.dumps(list(user_ids)))).fetchall()
+    bale_ids = {}
+    for user_id, id_bale in rows:
+        bale_ids.setdefault(user_id, id_bale)
+    return bale_ids
+
+
+@serialized_write
+def create_broadcast(school_id: int, title: str, role: str,
+                     recipients: List[Tuple[int, str, Optional[str], str]]) -> int:
+    """recipients: [(user_id, name, id_bale یا None, text), ...]؛ خروجی: شناسه‌ی ارسال گروهی"""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO broadcasts (school_id, title) VALUES (?, ?)", (school_id, title))
+        broadcast_id = cursor.lastrowid
+        cursor.executemany("""
+            INSERT INTO broadcast_deliveries (broadcast_id, role, user_id, name, id_bale, text, status)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, [(broadcast_id, role, user_id, name, id_bale, text,
+               STATUS_PENDING if id_bale else STATUS_NO_BALE_ID)
+              for user_id, name, id_bale, text in recipients])
+    return broadcast_id
+
+
+def _undelivered(broadcast_id: int) -> List[tuple]:
+    """گیرنده‌های تحویل‌نشده؛ شناسه‌ی بله‌ی گیرنده‌هایی که نداشتند دوباره جستجو می‌شود"""
+    with db_connection() as conn:
+        rows = conn.execute("""
+            SELECT role, user_id, name, id_bale, text FROM broadcast_deliveries
+            WHERE broadcast_id = ? AND status != ?
+            ORDER BY name
+        """, (broadcast_id, STATUS_SENT)).fetchall()
+    missing = {}
+    for role, user_id, _, id_bale, _ in rows:
+        if not id_bale:
+            missing.setdefault(role, []).append(user_id)
+    found = {(role, user_id): id_bale for role, user_ids in missing.items()
+             for user_id, id_bale in get_bale_ids(user_ids, role).items()}
+    return [(role, user_id, name, id_bale or found.get((role, user_id)), text)
+            for role, user_id, name, id_bale, text in rows]
+
+
+@serialized_write
+def _record_deliveries(results: List[tuple]):
+    """results: [(status, error, id_bale, broadcast_id, role, user_id), ...]"""
+    with db_connection() as conn:
+        conn.executemany("""
+            UPDATE broadcast_deliveries
+            SET status = ?, error = ?, id_bale = ?, attempts = attempts + 1, updated_at = datetime('now')
+            WHERE broadcast_id = ? AND role = ? AND user_id = ?
+        """, results)
+
+
+def get_latest_broadcast(school_id: int) -> Optional[Dict]:
+    """آخرین ارسال گروهی مدرسه با شمار وضعیت‌ها"""
+    with db_connection() as conn:
+        row = conn.execute("SELECT id, title FROM broadcasts WHERE school_id = ? ORDER BY id DESC LIMIT 1",
+                           (school_id,)).fetchone()
+        if not row:
+            return None
+        counts = dict(conn.execute("""
+            SELECT status, COUNT(*) FROM broadcast_deliveries WHERE broadcast_id = ? GROUP BY status
+        """, (row[0],)).fetchall())
+    return {"id": row[0], "title": row[1], "total": sum(counts.values()),
+            "sent": counts.get(STATUS_SENT, 0), "undelivered": sum(counts.values()) - counts.get(STATUS_SENT, 0)}
+
+
+# ---------- ارسال ----------
+async def run_broadcast(client, broadcast_id: int,
+                        on_progress: Callable[[Dict], Awaitable] = None) -> Dict:
+    """
+    ارسال پیام به همه‌ی گیرنده‌های تحویل‌نشده‌ی یک ارسال گروهی.
+    on_progress(summary) در هر ربع کار و در پایان await می‌شود؛
+    summary: total, done, sent, failed, no_bale_id و failed_names
+    """
+    targets = await run_db(_undelivered, broadcast_id)
+    summary = {"total": len(targets), "done": 0, "sent": 0, "failed": 0, "no_bale_id": 0, "failed_names": []}
+    results, next_report = [], 1
+    slots, reporting = asyncio.Semaphore(BROADCAST_CONCURRENCY), asyncio.Lock()
+    # صف ارسال (Outbox) به طور پیش‌فرض منتظر تحویل نمی‌ماند؛ این‌جا نتیجه‌ی هر ارسال لازم است
+    wait = {"wait": True} if isinstance(client, Outbox) else {}
+
+    async def deliver(role, user_id, name, id_bale, text):
+        nonlocal next_report
+        if not id_bale:
+            status, error = STATUS_NO_BALE_ID, None
+        else:
+            async with slots:
+                try:
+                    await client.send_message(id_bale, text, **wait)
+                    status, error = STATUS_SENT, None
+                except Exception as e:
+                    status, error = STATUS_FAILED, str(e)[:500]
+        results.append((status, error, id_bale, broadcast_id, role, user_id))
+        summary["done"] += 1
+        summary[status] += 1
+        if status != STATUS_SENT:
+            summary["failed_names"].append(name)
+        if summary["done"] * PROGRESS_STEPS >= summary["total"] * next_report:
+            next_report = summary["done"] * PROGRESS_STEPS // summary["total"] + 1
+            # وضعیت‌های تحویل در همان نقاط گزارش یک‌جا ذخیره می‌شوند (پیش از گزارش به مدیر)؛
+            # گزارش‌ها به ترتیب و با وضعیت همان لحظه (نه پس از انتظار برای نوشتن) ارسال می‌شوند
+            batch, results[:] = list(results), []
+            progress = dict(summary, failed_names=list(summary["failed_names"]))
+            async with reporting:
+                await run_write(_record_deliveries, batch)
+                if on_progress:
+                    try:
+                        await on_progress(progress)
+                    except Exception as e:
+                        logger.error(f"❌ خطا در گزارش پیشرفت ارسال گروهی {broadcast_id}: {e}")
+
+    await asyncio.gather(*(deliver(*target) for target in targets))
+    if results:
+        await run_write(_record_deliveries, results)
+    return summary
+
+
+def start_broadcast(client, broadcast_id: int, on_progress: Callable[[Dict], Awaitable] = None) -> bool:
+    """اجرای ارسال گروهی در پس‌زمینه (هندلر مدیر منتظر نمی‌ماند)؛ False اگر همین حالا در حال اجرا باشد"""
+    if broadcast_id in _running:
+        return False
+
+    async def run():
+        try:
+            await run_broadcast(client, broadcast_id, on_progress)
+        except Exception as e:
+            logger.error(f"❌ خطا در ارسال گروهی {broadcast_id}: {e}")
+        finally:
+            _running.pop(broadcast_id, None)
+
+    _running[broadcast_id] = asyncio.create_task(run())
+    return True
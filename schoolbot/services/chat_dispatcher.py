@@ -0,0 +1,147 @@
+# services/chat_dispatcher.py
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict
+
+logger = logging.getLogger(__name__)
+
+# ======= توزیع پیام‌ها: ترتیبی در هر گفتگو، هم‌زمان بین گفتگوها =======
+# balethon هر پیام را در یکی از ده‌ها worker خود اجرا می‌کند؛ بدون این لایه دو پیام پشت سر هم از یک کاربر
+# (مثلاً نمره و توضیح در ثبت نمرات کلاس) هم‌زمان پردازش می‌شوند و وضعیت گفتگو به هم می‌ریزد.
+# هر گفتگو صف خودش را دارد و پیام‌هایش یکی‌یکی و به ترتیب ورود پردازش می‌شوند؛ گفتگوهای مختلف هم‌زمان
+# اجرا می‌شوند ولی حداکثر CHAT_CONCURRENCY پیام در هر لحظه در حال پردازش است.
+# فشار برگشتی: اگر کل پیام‌های در انتظار از سقف بگذرد، ثبت پیام جدید تا خالی شدن جا منتظر می‌ماند و
+# پیام‌های اضافه‌ی یک گفتگوی پرحجم (بیش از CHAT_QUEUE_LIMIT در انتظار) کنار گذاشته می‌شوند.
+
+CHAT_CONCURRENCY = int(os.environ.get("SCHOOLBOT_CHAT_CONCURRENCY", 32))
+CHAT_QUEUE_LIMIT = int(os.environ.get("SCHOOLBOT_CHAT_QUEUE_LIMIT", 20))
+PENDING_LIMIT = int(os.environ.get("SCHOOLBOT_PENDING_LIMIT", 1000))
+
+# گزارش عمق صف در لاگ حداکثر یک بار در این بازه (ثانیه)
+DEPTH_REPORT_INTERVAL = 60
+
+
+class ChatDispatcher:
+    def __init__(self, handler: Callable[[object], Awaitable], concurrency: int = CHAT_CONCURRENCY,
+                 chat_queue_limit: int = CHAT_QUEUE_LIMIT, pending_limit: int = PENDING_LIMIT,
+                 on_overflow: Callable[[object], Awaitable] = None):
+        """
+        handler(update): پردازش یک پیام (مثلاً bot.handle_message)
+        on_overflow(chat_id): اطلاع به کاربری که پیام‌هایش به خاطر پر بودن صف کنار گذاشته شد (یک بار در هر نوبت پر شدن)
+        """
+        self.handler = handler
+        self.chat_queue_limit = chat_queue_limit
+        self.pending_limit = pending_limit
+        self.on_overflow = on_overflow
+        self._slots = asyncio.Semaphore(concurrency)
+        self._has_space = asyncio.Event()
+        self._has_space.set()
+        self._queues: Dict[object, Deque] = {}
+        self._overflowed = set()
+        self._tasks = set()  # event loop فقط ارجاع ضعیف به task ها نگه می‌دارد
+        self._pending = 0
+        self._running = 0
+        self._processed = 0
+        self._dropped = 0
+        self._max_depth = 0
+        self._last_report = 0.0
+
+    # ---------- ثبت پیام ----------
+    async def submit(self, chat_id, update) -> bool:
+        """قرار دادن پیام در صف گفتگو؛ خروجی False یعنی پیام کنار گذاشته شد"""
+        while self._pending >= self.pending_limit:
+            self._report_depth("⏳ صف پیام‌ها پر است؛ دریافت پیام‌های جدید تا خالی شدن جا متوقف شد")
+            self._has_space.clear()
+            await self._has_space.wait()
+
+        queue = self._queues.get(chat_id)
+        if queue is not None and len(queue) >= self.chat_queue_limit:
+            self._dropped += 1
+            if chat_id not in self._overflowed:
+                self._overflowed.add(chat_id)
+                logger.error(f"⚠️ صف گفتگو {chat_id} پر است ({len(queue)} پیام)؛ پیام‌های اضافه کنار گذاشته می‌شوند.")
+                if self.on_overflow:
+                    self._spawn(self._notify_overflow(chat_id))
+            return False
+
+        self._pending += 1
+        if queue is None:
+            # اولین پیام گفتگو: یک task پیام‌های این گفتگو را به ترتیب پردازش و پس از خالی شدن صف تمام می‌شود
+            queue = self._queues[chat_id] = deque([update])
+            self._spawn(self._drain(chat_id, queue))
+        else:
+            queue.append(update)
+        self._max_depth = max(self._max_depth, len(queue))
+        return True
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _notify_overflow(self, chat_id):
+        try:
+            await self.on_overflow(chat_id)
+        except Exception as e:
+            logger.error(f"❌ خطا در اطلاع پر بودن صف به گفتگو {chat_id}: {e}")
+
+    # ---------- پردازش ----------
+    async def _drain(self, chat_id, queue: Deque):
+        try:
+            while queue:
+                update = queue[0]
+                async with self._slots:
+                    self._running += 1
+                    try:
+                        await self.handler(update)
+                    except Exception as e:
+                        logger.error(f"❌ خطا در پردازش پیام گفتگو {chat_id}: {e}")
+                    finally:
+                        self._running -= 1
+                queue.popleft()
+                self._processed += 1
+                self._release(1)
+                if len(queue) < self.chat_queue_limit:
+                    self._overflowed.discard(chat_id)
+        finally:
+            # پیام جدید پس از این نقطه یک task تازه برای گفتگو می‌سازد
+            if self._queues.get(chat_id) is queue:
+                del self._queues[chat_id]
+            self._overflowed.discard(chat_id)
+            if queue:  # لغو task (مثلاً هنگام خاموش شدن)؛ پیام‌های باقی‌مانده از شمارش خارج می‌شوند
+                self._dropped += len(queue)
+                self._release(len(queue))
+                queue.clear()
+
+    def _release(self, count: int):
+        self._pending -= count
+        if self._pending < self.pending_limit:
+            self._has_space.set()
+
+    # ---------- گزارش ----------
+    def stats(self) -> Dict:
+        """عمق صف‌ها و شمارنده‌ها (برای پایش)"""
+        depths = [len(queue) for queue in self._queues.values()]
+        return {
+            "chats": len(depths),
+            "pending": self._pending,
+            "running": self._running,
+            "deepest_chat": max(depths, default=0),
+            "max_depth": self._max_depth,
+            "processed": self._processed,
+            "dropped": self._dropped,
+        }
+
+    def _report_depth(self, reason: str):
+        now = time.monotonic()
+        if now - self._last_report < DEPTH_REPORT_INTERVAL:
+            return
+        self._last_report = now
+        stats = self.stats()
+        logger.error(f"{reason}: {stats['pending']} پیام در انتظار در {stats['chats']} گفتگو، "
+                     f"{stats['running']} در حال پردازش، عمیق‌ترین صف {stats['deepest_chat']} پیام "
+                     f"(کنارگذاشته‌شده تاکنون: {stats['dropped']}).")
@@ -0,0 +1,105 @@
+# services/media_service.py
+
+import io
+import logging
+import threading
+from typing import Dict, Optional
+
+from balethon.errors import BadRequestError, NotFoundError
+
+from schoolbot.chart.chart_cache import image_digest
+from schoolbot.database.async_db import run_db
+from schoolbot.database.connection_pool import db_connection
+from schoolbot.database.db_writer import serialized_write, writer
+
+logger = logging.getLogger(__name__)
+
+# ======= استفاده‌ی دوباره از فایل‌های آپلودشده در بله =======
+# پس از اولین ارسال هر تصویر، شناسه‌ی فایلی که بله برمی‌گرداند با hash محتوای تصویر ذخیره می‌شود
+# (جدول bale_file_ids + حافظه). ارسال‌های بعدیِ همان تصویر فقط شناسه را می‌فرستند و بایتی آپلود نمی‌شود؛
+# اگر بله شناسه را نپذیرد، شناسه فراموش و تصویر دوباره آپلود می‌شود.
+
+_file_ids: Dict[str, str] = {}
+_lock = threading.Lock()
+
+
+def _cached_file_id(content_hash: str) -> Optional[str]:
+    with _lock:
+        return _file_ids.get(content_hash)
+
+
+def get_file_id(content_hash: str) -> Optional[str]:
+    file_id = _cached_file_id(content_hash)
+    if file_id:
+        return file_id
+    with db_connection() as conn:
+        row = conn.execute("SELECT file_id FROM bale_file_ids WHERE content_hash = ?", (content_hash,)).fetchone()
+    if row:
+        with _lock:
+            _file_ids[content_hash] = row[0]
+        return row[0]
+    return None
+
+
+async def get_file_id_async(content_hash: str) -> Optional[str]:
+    # بیشتر درخواست‌ها از حافظه پاسخ می‌گیرند؛ فقط در نبود آن سراغ دیتابیس (خارج از event loop) می‌رویم
+    return _cached_file_id(content_hash) or await run_db(get_file_id, content_hash)
+
+
+@serialized_write
+def _store_file_id(content_hash: str, file_id: str):
+    with db_connection() as conn:
+        conn.execute("""
+            INSERT INTO bale_file_ids (content_hash, file_id) VALUES (?, ?)
+            ON CONFLICT(content_hash) DO UPDATE SET file_id = excluded.file_id, uploaded_at = datetime('now')
+        """, (content_hash, file_id))
+
+
+@serialized_write
+def _delete_file_id(content_hash: str, file_id: str):
+    with db_connection() as conn:
+        conn.execute("DELETE FROM bale_file_ids WHERE content_hash = ? AND file_id = ?", (content_hash, file_id))
+
+
+def remember_file_id(content_hash: str, file_id: str):
+    with _lock:
+        _file_ids[content_hash] = file_id
+    # نوشتن در پس‌زمینه (بدون انتظار)؛ حافظه همین حالا به‌روز است
+    writer.submit(_store_file_id, content_hash, file_id)
+
+
+def forget_file_id(content_hash: str, file_id: str):
+    with _lock:
+        if _file_ids.get(content_hash) == file_id:
+            del _file_ids[content_hash]
+    writer.submit(_delete_file_id, content_hash, file_id)
+
+
+def _uploaded_file_id(message) -> Optional[str]:
+    # بله چند اندازه از تصویر برمی‌گرداند؛ بزرگ‌ترین همان تصویر اصلی است
+    photos = getattr(message, "photo", None) or []
+    largest = max(photos, key=lambda p: (p.width or 0) * (p.height or 0), default=None)
+    return largest.id if largest else None
+
+
+async def send_photo_cached(client, chat_id, image: bytes, caption: str = None):
+    """
+    ارسال تصویر PNG: اگر همین محتوا قبلاً آپلود شده باشد فقط شناسه‌ی فایل فرستاده می‌شود،
+    در غیر این صورت (یا اگر بله شناسه را نپذیرد) آپلود و شناسه‌ی جدید ذخیره می‌شود.
+    """
+    content_hash = image_digest(image)
+    file_id = await get_file_id_async(content_hash)
+    if file_id:
+        try:
+            return await client.send_photo(chat_id, file_id, caption=caption)
+        except (BadRequestError, NotFoundError) as e:
+            logger.error(f"⚠️ شناسه‌ی فایل {file_id} پذیرفته نشد؛ تصویر دوباره آپلود می‌شود: {e}")
+            forget_file_id(content_hash, file_id)
+
+    photo = io.BytesIO(image)
+    photo.name = "chart.png"
+    message = await client.send_photo(chat_id, photo, caption=caption)
+    new_file_id = _uploaded_file_id(message)
+    if new_file_id:
+        remember_file_id(content_hash, new_file_id)
+    return message
@@ -0,0 +1,238 @@
+# services/outbox.py
+
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import deque
+from typing import Deque, Dict, List
+
+import httpx
+from balethon.errors import FloodError, RPCError, TooManyRequestsError
+
+logger = logging.getLogger(__name__)
+
+# ======= صف ارسال پیام‌ها به بله =======
+# هندلرها به جای client از Outbox استفاده می‌کنند (همان send_message / send_photo):
+#   • هر گفتگو صف خودش را دارد و پیام‌هایش به ترتیب ارسال می‌شوند؛
+#   • دو سطل توکن نرخ ارسال را محدود می‌کنند: یکی برای هر گفتگو و یکی برای کل ربات؛
+#   • متن‌های پشت سر همِ یک گفتگو که هنوز ارسال نشده‌اند (مثلاً «بازگشتید» + منو) در یک پیام ادغام می‌شوند؛
+#   • خطای 429 / 420 و خطاهای سمت سرور یا شبکه با تأخیر فزاینده دوباره تلاش می‌شوند.
+# send_message منتظر تحویل نمی‌ماند (مگر با wait=True)؛ send_photo منتظر می‌ماند چون پیام برگشتی
+# (شناسه‌ی فایل) و خطای آن برای media_service لازم است.
+
+SEND_RATE = float(os.environ.get("SCHOOLBOT_SEND_RATE", 20))              # پیام در ثانیه برای کل ربات
+SEND_BURST = int(os.environ.get("SCHOOLBOT_SEND_BURST", 30))
+CHAT_SEND_RATE = float(os.environ.get("SCHOOLBOT_CHAT_SEND_RATE", 1))     # پیام در ثانیه برای هر گفتگو
+CHAT_SEND_BURST = int(os.environ.get("SCHOOLBOT_CHAT_SEND_BURST", 5))
+SEND_RETRIES = int(os.environ.get("SCHOOLBOT_SEND_RETRIES", 4))
+
+# سقف طول متن پیام در بله
+MAX_MESSAGE_LENGTH = 4096
+COALESCE_SEPARATOR = "\n\n"
+
+_BACKOFF_BASE, _BACKOFF_MAX = 0.5, 30.0
+
+# سطل‌های توکن گفتگوهایی که این مدت پیامی نداشته‌اند (و دوباره پر شده‌اند) حذف می‌شوند
+_IDLE_BUCKET_SECONDS = 300
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """زمان انتظار تا در دسترس بودن یک توکن (صفر یعنی همین حالا)"""
+        now = time.monotonic()
+        self._refill(now)
+        if now < self.paused_until:
+            return self.paused_until - now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        """توقف کامل (مثلاً پس از 429 با retry_after)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def idle(self) -> bool:
+        return self.tokens >= self.burst and time.monotonic() - self.updated > _IDLE_BUCKET_SECONDS
+
+
+class _Outgoing:
+    __slots__ = ("method", "chat_id", "args", "kwargs", "future", "queued_at")
+
+    def __init__(self, method: str, chat_id, args: tuple, kwargs: dict, future: asyncio.Future):
+        self.method = method
+        self.chat_id = chat_id
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+        self.queued_at = time.monotonic()
+
+    @property
+    def plain_text(self) -> bool:
+        """متن ساده (بدون دکمه، پاسخ و ...) که می‌تواند با متن‌های مجاور ادغام شود"""
+        return self.method == "send_message" and len(self.args) == 1 and not self.kwargs
+
+
+class Outbox:
+    def __init__(self, client, rate: float = SEND_RATE, burst: int = SEND_BURST,
+                 chat_rate: float = CHAT_SEND_RATE, chat_burst: int = CHAT_SEND_BURST):
+        self.client = client
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._global = TokenBucket(rate, burst)
+        self._buckets: Dict[object, TokenBucket] = {}
+        self._queues: Dict[object, Deque[_Outgoing]] = {}
+        self._tasks = set()
+        self._metrics = {"enqueued": 0, "sent": 0, "coalesced": 0, "retried": 0, "rate_limited": 0,
+                         "failed": 0, "latency_total": 0.0, "latency_max": 0.0}
+
+    # ---------- رابط شبیه client ----------
+    async def send_message(self, chat_id, text: str, *args, wait: bool = False, **kwargs):
+        future = self._enqueue("send_message", chat_id, (text,) + args, kwargs)
+        if wait:
+            return await future
+        # خطای ارسال‌های بدون انتظار فقط در لاگ و آمار ثبت می‌شود
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        return None
+
+    async def send_photo(self, chat_id, photo, *args, **kwargs):
+        return await self._enqueue("send_photo", chat_id, (photo,) + args, kwargs)
+
+    def __getattr__(self, name):
+        # سایر متدهای client (بدون صف)
+        return getattr(self.client, name)
+
+    # ---------- صف ----------
+    def _enqueue(self, method: str, chat_id, args: tuple, kwargs: dict) -> asyncio.Future:
+        item = _Outgoing(method, chat_id, args, kwargs, asyncio.get_running_loop().create_future())
+        self._metrics["enqueued"] += 1
+        queue = self._queues.get(chat_id)
+        if queue is None:
+            queue = self._queues[chat_id] = deque([item])
+            task = asyncio.create_task(self._drain(chat_id, queue))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        else:
+            queue.append(item)
+        return item.future
+
+    def _bucket(self, chat_id) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) > 1000:
+                for idle_chat in [c for c, b in self._buckets.items() if b.idle()]:
+                    del self._buckets[idle_chat]
+            bucket = self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _acquire(self, chat_id):
+        bucket = self._bucket(chat_id)
+        while True:
+            delay = max(bucket.delay(), self._global.delay())
+            if delay <= 0:
+                bucket.take()
+                self._global.take()
+                return
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def _next_batch(queue: Deque[_Outgoing]) -> List[_Outgoing]:
+        # متن‌های ساده‌ی پشت سر هم در سر صف (تا سقف طول پیام) یک ارسال می‌شوند
+        batch = [queue.popleft()]
+        if batch[0].plain_text:
+            length = len(batch[0].args[0])
+            while queue and queue[0].plain_text:
+                length += len(COALESCE_SEPARATOR) + len(queue[0].args[0])
+                if length > MAX_MESSAGE_LENGTH:
+                    break
+                batch.append(queue.popleft())
+        return batch
+
+    async def _drain(self, chat_id, queue: Deque[_Outgoing]):
+        try:
+            while queue:
+                await self._acquire(chat_id)
+                await self._deliver(self._next_batch(queue))
+        finally:
+            if self._queues.get(chat_id) is queue:
+                del self._queues[chat_id]
+            for item in queue:  # لغو task (خاموش شدن ربات)
+                item.future.cancel()
+
+    async def _deliver(self, batch: List[_Outgoing]):
+        item = batch[0]
+        args = item.args
+        if len(batch) > 1:
+            args = (COALESCE_SEPARATOR.join(part.args[0] for part in batch),)
+        for attempt in range(SEND_RETRIES + 1):
+            backoff = self._backoff(attempt)
+            try:
+                result = await getattr(self.client, item.method)(item.chat_id, *args, **item.kwargs)
+            except (TooManyRequestsError, FloodError) as e:
+                self._metrics["rate_limited"] += 1
+                retry_after = (e.parameters or {}).get("retry_after") or backoff
+                # محدودیت نرخ سمت بله: کل ارسال‌ها (نه فقط همین گفتگو) متوقف می‌شوند؛ انتظار در _acquire
+                self._global.pause(retry_after)
+                backoff = 0
+                error = e
+            except RPCError as e:
+                if not (e.code or 0) >= 500:
+                    self._fail(batch, e)
+                    return
+                error = e
+            except (OSError, asyncio.TimeoutError, httpx.TransportError, ValueError) as e:
+                # خطای شبکه‌ی httpx (قطع اتصال، timeout) یا پاسخ ناقص / غیر JSON از سرور
+                error = e
+            except Exception as e:
+                self._fail(batch, e)
+                return
+            else:
+                now = time.monotonic()
+                latency = now - item.queued_at
+                self._metrics["sent"] += 1
+                self._metrics["coalesced"] += len(batch) - 1
+                self._metrics["latency_total"] += latency
+                self._metrics["latency_max"] = max(self._metrics["latency_max"], latency)
+                for part in batch:
+                    if not part.future.done():
+                        part.future.set_result(result)
+                return
+            if attempt < SEND_RETRIES:
+                self._metrics["retried"] += 1
+                await asyncio.sleep(backoff)
+                await self._acquire(item.chat_id)
+        self._fail(batch, error)
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        return min(_BACKOFF_MAX, _BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    def _fail(self, batch: List[_Outgoing], error: Exception):
+        self._metrics["failed"] += len(batch)
+        logger.error(f"❌ ارسال {batch[0].method} به گفتگو {batch[0].chat_id} ناموفق بود: {error}")
+        for part in batch:
+            if not part.future.done():
+                part.future.set_exception(error)
+
+    # ---------- آمار ----------
+    def stats(self) -> Dict:
+        metrics = dict(self._metrics)
+        latency_total = metrics.pop("latency_total")
+        metrics["latency_avg"] = round(latency_total / metrics["sent"], 3) if metrics["sent"] else 0.0
+        metrics["latency_max"] = round(metrics["latency_max"], 3)
+        metrics["pending"] = sum(len(queue) for queue in self._queues.values())
+        metrics["chats"] = len(self._queues)
+        return metrics
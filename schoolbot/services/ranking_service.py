@@ -0,0 +1,209 @@
+# services/ranking_service.py
+
+from typing import Dict, Iterable, Optional
+
+from schoolbot.database.connection_pool import db_connection
+from schoolbot.services.report_cache import get_or_compute
+
+# ======= جدول رتبه‌های هر دوره (period_rankings) =======
+# معدل وزنی و رتبه‌ی کلاسی/پایه/مدرسه‌ی هر دانش‌آموز یک بار هنگام تأیید دوره ساخته می‌شود
+# و پس از آن فقط برای دانش‌آموزانی که نمره‌شان تغییر کرده دوباره محاسبه می‌شود.
+# کارنامه‌ها به جای محاسبه‌ی دوباره‌ی رتبه‌ی کل مدرسه، فقط یک ردیف از این جدول می‌خوانند.
+# توابعی که cursor می‌گیرند باید در همان تراکنش نوشتن (داخل serialized_write) صدا زده شوند.
+
+_RANKING_COLUMNS = "report_period_id, student_id, school_id, class_id, grade_id, weighted_average"
+
+_AVERAGES_SQL = """
+    SELECT sc.report_period_id, st.id, g.school_id, st.class_id, c.grade_id,
+           SUM(sc.score * s.coefficient) / SUM(s.coefficient)
+    FROM scores sc
+    JOIN subjects s ON sc.subject_id = s.id
+    JOIN students st ON sc.student_id = st.id
+    JOIN classes c ON st.class_id = c.id
+    JOIN grades g ON c.grade_id = g.id
+    JOIN report_periods rp ON rp.id = sc.report_period_id
+    WHERE sc.report_period_id = ? AND sc.score IS NOT NULL
+      AND g.school_id = rp.school_id {student_filter}
+    GROUP BY st.id, st.class_id, c.grade_id
+"""
+
+_INSERT_AVERAGES_SQL = f"INSERT INTO period_rankings ({_RANKING_COLUMNS}) {_AVERAGES_SQL}"
+
+# رتبه‌ها فقط از روی معدل‌های ذخیره‌شده (نه جدول نمرات) و فقط در همان دوره (یعنی همان مدرسه) محاسبه می‌شوند
+_RERANK_SQL = """
+    UPDATE period_rankings SET
+        class_rank = r.class_rank, class_count = r.class_count,
+        grade_rank = r.grade_rank, grade_count = r.grade_count,
+        school_rank = r.school_rank, school_count = r.school_count
+    FROM (
+        SELECT student_id,
+               RANK() OVER (PARTITION BY class_id ORDER BY weighted_average DESC) AS class_rank,
+               COUNT(*) OVER (PARTITION BY class_id) AS class_count,
+               RANK() OVER (PARTITION BY grade_id ORDER BY weighted_average DESC) AS grade_rank,
+               COUNT(*) OVER (PARTITION BY grade_id) AS grade_count,
+               RANK() OVER (ORDER BY weighted_average DESC) AS school_rank,
+               COUNT(*) OVER () AS school_count
+        FROM period_rankings
+        WHERE report_period_id = ?
+    ) AS r
+    WHERE period_rankings.report_period_id = ? AND period_rankings.student_id = r.student_id
+      -- فقط ردیف‌هایی که رتبه یا تعدادشان واقعاً عوض شده بازنویسی می‌شوند
+      AND (period_rankings.class_rank IS NOT r.class_rank OR period_rankings.class_count IS NOT r.class_count
+           OR period_rankings.grade_rank IS NOT r.grade_rank OR period_rankings.grade_count IS NOT r.grade_count
+           OR period_rankings.school_rank IS NOT r.school_rank OR period_rankings.school_count IS NOT r.school_count)
+"""
+
+
+def rebuild_period_rankings(cursor, report_period_id: int) -> int:
+    """ساخت کامل رتبه‌های یک دوره در یک گذر؛ خروجی: تعداد دانش‌آموزان رتبه‌بندی‌شده."""
+    cursor.execute("DELETE FROM period_rankings WHERE report_period_id = ?", (report_period_id,))
+    cursor.execute(_INSERT_AVERAGES_SQL.format(student_filter=""), (report_period_id,))
+    count = cursor.rowcount
+    cursor.execute(_RERANK_SQL, (report_period_id, report_period_id))
+    return count
+
+
+def clear_period_rankings(cursor, report_period_id: int):
+    cursor.execute("DELETE FROM period_rankings WHERE report_period_id = ?", (report_period_id,))
+
+
+def refresh_student_rankings(cursor, report_period_id: int, student_ids: Iterable[int]) -> bool:
+    """
+    پس از تغییر نمره در دوره‌ی تأییدشده: فقط معدل همین دانش‌آموزان دوباره جمع زده می‌شود
+    و رتبه‌ها از روی معدل‌های ذخیره‌شده‌ی همان دوره به‌روز می‌شوند.
+    برای دوره‌ی تأییدنشده کاری انجام نمی‌شود (رتبه‌ها هنگام تأیید ساخته می‌شوند).
+    رتبه‌بندی دوباره‌ی کل دوره فقط یک بار برای همه‌ی دانش‌آموزان ورودی و فقط وقتی انجام می‌شود که
+    معدل یا کلاس کسی واقعاً عوض شده باشد (مثلاً ویرایش توضیح نمره یا ثبت همان نمره رتبه‌بندی ندارد).
+    خروجی: True اگر رتبه‌ها دوباره محاسبه شدند.
+    """
+    cursor.execute("SELECT approved FROM report_periods WHERE id = ?", (report_period_id,))
+    row = cursor.fetchone()
+    if not row or not row[0]:
+        return False
+
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS _ranking_students (student_id INTEGER PRIMARY KEY)")
+    cursor.execute("DELETE FROM _ranking_students")
+    cursor.executemany("INSERT OR IGNORE INTO _ranking_students (student_id) VALUES (?)",
+                       ((sid,) for sid in student_ids))
+    cursor.execute(_AVERAGES_SQL.format(
+        student_filter="AND st.id IN (SELECT student_id FROM _ranking_students)"), (report_period_id,))
+    fresh = {row[1]: row for row in cursor.fetchall()}
+    cursor.execute(f"""
+        SELECT {_RANKING_COLUMNS} FROM period_rankings
+        WHERE report_period_id = ? AND student_id IN (SELECT student_id FROM _ranking_students)
+    """, (report_period_id,))
+    stored = {row[1]: row for row in cursor.fetchall()}
+
+    changed = [row for student_id, row in fresh.items() if stored.get(student_id) != row]
+    removed = [(report_period_id, student_id) for student_id in stored if student_id not in fresh]
+    if not changed and not removed:
+        return False
+    cursor.executemany("DELETE FROM period_rankings WHERE report_period_id = ? AND student_id = ?", removed)
+    # ستون‌های رتبه‌ی ردیف‌های جایگزین‌شده NULL می‌شوند و _RERANK_SQL آن‌ها را دوباره پر می‌کند
+    cursor.executemany(f"INSERT OR REPLACE INTO period_rankings ({_RANKING_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)",
+                       changed)
+    cursor.execute(_RERANK_SQL, (report_period_id, report_period_id))
+    return True
+
+
+def get_student_ranking(student_id: int, report_period_id: int) -> Optional[Dict]:
+    """
+    معدل و رتبه‌های یک دانش‌آموز در یک دوره‌ی تأییدشده (یک جستجوی ایندکس‌دار).
+    خروجی: {"weighted_average", "class_rank", "class_count", ...} یا None
+    """
+    with db_connection() as conn:
+        row = conn.execute("""
+            SELECT weighted_average, class_rank, class_count, grade_rank, grade_count, school_rank, school_count
+            FROM period_rankings
+            WHERE report_period_id = ? AND student_id = ?
+        """, (report_period_id, student_id)).fetchone()
+    if not row:
+        return None
+    return {
+        "weighted_average": row[0],
+        "class_rank": row[1], "class_count": row[2],
+        "grade_rank": row[3], "grade_count": row[4],
+        "school_rank": row[5], "school_count": row[6],
+    }
+
+
+# ======= نفرات برتر کلاس، پایه و مدرسه =======
+LEADERBOARD_SIZE = 3
+
+_LEADERBOARD_SQL = """
+    SELECT pr.student_id, st.name, c.name, pr.class_id, pr.grade_id, ROUND(pr.weighted_average, 2),
+           pr.class_rank, pr.grade_rank, pr.school_rank
+    FROM period_rankings pr
+    JOIN students st ON st.id = pr.student_id
+    JOIN classes c ON c.id = pr.class_id
+    WHERE pr.report_period_id = ? AND (pr.class_rank <= ? OR pr.grade_rank <= ? OR pr.school_rank <= ?)
+"""
+
+# برای دوره‌ای که هنوز تأیید نشده و رتبه‌هایش ساخته نشده: همان محاسبه در یک گذر و فقط در مدرسه‌ی همان دوره
+_LIVE_LEADERBOARD_SQL = """
+    WITH averages AS (
+        SELECT st.id AS student_id, st.name AS student_name, c.name AS class_name,
+               st.class_id, c.grade_id,
+               SUM(sc.score * s.coefficient) / SUM(s.coefficient) AS weighted_average
+        FROM scores sc
+        JOIN subjects s ON sc.subject_id = s.id
+        JOIN students st ON sc.student_id = st.id
+        JOIN classes c ON st.class_id = c.id
+        JOIN grades g ON c.grade_id = g.id
+        JOIN report_periods rp ON rp.id = sc.report_period_id
+        WHERE sc.report_period_id = ? AND sc.score IS NOT NULL AND g.school_id = rp.school_id
+        GROUP BY st.id, st.class_id, c.grade_id
+    ),
+    ranked AS (
+        SELECT *,
+               RANK() OVER (PARTITION BY class_id ORDER BY weighted_average DESC) AS class_rank,
+               RANK() OVER (PARTITION BY grade_id ORDER BY weighted_average DESC) AS grade_rank,
+               RANK() OVER (ORDER BY weighted_average DESC) AS school_rank
+        FROM averages
+    )
+    SELECT student_id, student_name, class_name, class_id, grade_id, ROUND(weighted_average, 2),
+           class_rank, grade_rank, school_rank
+    FROM ranked
+    WHERE class_rank <= ? OR grade_rank <= ? OR school_rank <= ?
+"""
+
+
+def _build_leaderboards(report_period_id: int, top_n: int) -> Dict:
+    params = (report_period_id, top_n, top_n, top_n)
+    with db_connection() as conn:
+        approved = conn.execute("SELECT approved FROM report_periods WHERE id = ?", (report_period_id,)).fetchone()
+        sql = _LEADERBOARD_SQL if approved and approved[0] else _LIVE_LEADERBOARD_SQL
+        rows = conn.execute(sql, params).fetchall()
+
+    boards = {"class": {}, "grade": {}, "school": []}
+    # ترتیب: رتبه، سپس شناسه (برای نتیجه‌ی ثابت در رتبه‌های مساوی)
+    for student_id, name, class_name, class_id, grade_id, avg, class_rank, grade_rank, school_rank in sorted(
+            rows, key=lambda r: (-r[5], r[0])):
+        entry = {"id": student_id, "name": name, "class": class_name, "avg": avg}
+        if class_rank <= top_n:
+            boards["class"].setdefault(class_id, []).append(entry)
+        if grade_rank <= top_n:
+            boards["grade"].setdefault(grade_id, []).append(entry)
+        if school_rank <= top_n:
+            boards["school"].append(entry)
+
+    # در رتبه‌های مساوی ممکن است بیش از top_n نفر برسند؛ مثل LIMIT قبلی فقط top_n نفر نگه داشته می‌شود
+    for scope in ("class", "grade"):
+        boards[scope] = {scope_id: entries[:top_n] for scope_id, entries in boards[scope].items()}
+    boards["school"] = boards["school"][:top_n]
+    return boards
+
+
+def get_period_leaderboards(report_period_id: int, top_n: int = LEADERBOARD_SIZE) -> Dict:
+    """
+    نفرات برتر همه‌ی کلاس‌ها، پایه‌ها و کل مدرسه‌ی یک دوره با یک کوئری.
+    نتیجه برای هر دوره یک بار ساخته و بین همه‌ی دانش‌آموزان مدرسه به اشتراک گذاشته می‌شود
+    (با ثبت نمره یا تغییر تأیید دوره باطل می‌شود).
+    خروجی: {"class": {class_id: [...]}, "grade": {grade_id: [...]}, "school": [...]}
+    """
+    with db_connection() as conn:
+        row = conn.execute("SELECT school_id FROM report_periods WHERE id = ?", (report_period_id,)).fetchone()
+    if not row:
+        return {"class": {}, "grade": {}, "school": []}
+    key = (row[0], report_period_id, None, f"leaderboard:{top_n}")
+    return get_or_compute(key, lambda: _build_leaderboards(report_period_id, top_n))
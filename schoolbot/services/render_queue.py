@@ -0,0 +1,231 @@
+# services/render_queue.py
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from schoolbot.chart.render_service import RenderService, render_service, student_report_charts
+from schoolbot.services.report_snapshot import (
+    get_period_state,
+    get_period_students,
+    load_snapshot,
+    prepare_student_snapshot,
+    save_snapshot
+)
+
+logger = logging.getLogger(__name__)
+
+# ======= صف پس‌زمینه‌ی ساخت کارنامه‌ها پس از تأیید دوره =======
+# با تأیید یک دوره همه‌ی دانش‌آموزانِ دارای نمره در صف قرار می‌گیرند. یک thread توزیع‌کننده به ترتیب
+# اولویت، بخش متنی هر کارنامه را می‌سازد و رسم نمودارها را به استخر پردازه‌ی render_service می‌سپارد.
+# تعداد کارهای در حال رسم محدود است تا داده‌های آماده‌شده در حافظه انباشته نشوند.
+# دانش‌آموزانی که اخیراً با ربات کار کرده‌اند (آنلاین) جلوتر از بقیه ساخته می‌شوند.
+
+# حداکثر کارنامه‌های در حال رسم به ازای هر پردازه‌ی رسم
+IN_FLIGHT_PER_WORKER = 2
+
+# دانش‌آموزی که در این بازه پیامی فرستاده «آنلاین» حساب می‌شود
+ONLINE_WINDOW_SECONDS = 15 * 60
+
+# گزارش پیشرفت به مدیر در هر ربع کار
+PROGRESS_STEPS = 4
+
+PRIORITY_ONLINE, PRIORITY_NORMAL = 0, 1
+
+
+class _PeriodJob:
+    def __init__(self, report_period_id, state, students, on_progress):
+        self.report_period_id = report_period_id
+        self.state = state  # (version, approved, period_name)؛ با تغییر داده‌ها در حین کار به‌روز می‌شود
+        self.names = dict(students)
+        self.total = len(students)
+        self.done = self.built = self.failed = 0
+        self.on_progress = on_progress
+        self.cancelled = False
+        self._next_report = 1
+
+
+class RenderQueue:
+    def __init__(self, renderer: RenderService = render_service, max_in_flight: int = None):
+        self.renderer = renderer
+        self._cond = threading.Condition()
+        self._heap = []                      # (priority, seq, student_id, job)
+        self._seq = itertools.count()
+        self._queued: Dict[tuple, int] = {}  # (report_period_id, student_id) → seq آخرین ورودی معتبر
+        self._jobs: Dict[int, _PeriodJob] = {}
+        self._last_seen: Dict[int, float] = {}  # به ترتیب آخرین فعالیت؛ فقط دانش‌آموزان آنلاین نگه داشته می‌شوند
+        self._slots = threading.BoundedSemaphore(max_in_flight or renderer.workers * IN_FLIGHT_PER_WORKER)
+        self._thread: Optional[threading.Thread] = None
+
+    # ---------- آنلاین بودن و اولویت ----------
+    def touch(self, student_id: int):
+        """ثبت فعالیت دانش‌آموز؛ کارهای در صف او به اولویت بالا منتقل می‌شوند"""
+        now = time.monotonic()
+        with self._cond:
+            self._last_seen.pop(student_id, None)
+            self._last_seen[student_id] = now
+            # قدیمی‌ترین‌ها در ابتدای dict اند؛ دانش‌آموزانی که دیگر آنلاین نیستند حذف می‌شوند
+            for stale in itertools.takewhile(lambda sid: now - self._last_seen[sid] >= ONLINE_WINDOW_SECONDS,
+                                             list(self._last_seen)):
+                del self._last_seen[stale]
+            for job in self._jobs.values():
+                key = (job.report_period_id, student_id)
+                if key in self._queued:
+                    self._push(job, student_id, PRIORITY_ONLINE)
+
+    def _is_online(self, student_id: int) -> bool:
+        seen = self._last_seen.get(student_id)
+        return seen is not None and time.monotonic() - seen < ONLINE_WINDOW_SECONDS
+
+    def _push(self, job: _PeriodJob, student_id: int, priority: int):
+        # ورودی قبلی همین دانش‌آموز در heap می‌ماند و هنگام برداشتن نادیده گرفته می‌شود
+        seq = next(self._seq)
+        self._queued[(job.report_period_id, student_id)] = seq
+        heapq.heappush(self._heap, (priority, seq, student_id, job))
+
+    # ---------- صف کردن و لغو ----------
+    def enqueue_period(self, report_period_id: int,
+                       on_progress: Callable[[int, int, int], None] = None) -> int:
+        """
+        همه‌ی کارنامه‌های یک دوره‌ی تأییدشده را در صف می‌گذارد.
+        on_progress(done, total, failed) در هر ربع کار و در پایان (از thread صف) صدا زده می‌شود.
+        خروجی: تعداد دانش‌آموزان صف‌شده
+        """
+        state = get_period_state(report_period_id)
+        if not state or not state[1]:
+            return 0
+        students = get_period_students(report_period_id)
+        if not students:
+            return 0
+        job = _PeriodJob(report_period_id, state, students, on_progress)
+        with self._cond:
+            self._cancel(report_period_id)
+            self._jobs[report_period_id] = job
+            for student_id, _ in students:
+                self._push(job, student_id, PRIORITY_ONLINE if self._is_online(student_id) else PRIORITY_NORMAL)
+            self._cond.notify()
+        self._ensure_started()
+        return len(students)
+
+    def cancel_period(self, report_period_id: int):
+        with self._cond:
+            self._cancel(report_period_id)
+
+    def _cancel(self, report_period_id: int):
+        job = self._jobs.pop(report_period_id, None)
+        if job:
+            job.cancelled = True
+            for student_id in job.names:
+                self._queued.pop((report_period_id, student_id), None)
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                "queued": len(self._queued),
+                "periods": {pid: {"done": job.done, "total": job.total, "failed": job.failed}
+                            for pid, job in self._jobs.items()},
+            }
+
+    # ---------- اجرا ----------
+    def _ensure_started(self):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="render-queue", daemon=True)
+                self._thread.start()
+
+    def _next(self):
+        with self._cond:
+            while True:
+                while not self._heap:
+                    self._cond.wait()
+                _, seq, student_id, job = heapq.heappop(self._heap)
+                key = (job.report_period_id, student_id)
+                if not job.cancelled and self._queued.get(key) == seq:
+                    del self._queued[key]
+                    return student_id, job
+
+    def _run(self):
+        while True:
+            student_id, job = self._next()
+            try:
+                self._dispatch(student_id, job)
+            except Exception as e:
+                logger.error(f"❌ خطا در صف ساخت کارنامه (student={student_id}, "
+                             f"period={job.report_period_id}): {e}")
+                self._advance(job, failed=True)
+
+    def _dispatch(self, student_id: int, job: _PeriodJob):
+        state = get_period_state(job.report_period_id)
+        if state != job.state:
+            if not state or not state[1]:
+                # تأیید دوره لغو شده: کارنامه‌های باقی‌مانده دیگر لازم نیستند
+                with self._cond:
+                    if self._jobs.get(job.report_period_id) is job:
+                        self._cancel(job.report_period_id)
+                logger.warning(f"⚠️ تأیید دوره {job.report_period_id} در حین ساخت کارنامه‌ها لغو شد؛ ادامه‌ی کار متوقف شد.")
+                return
+            # نمره‌ای ثبت شده (یا تاریخچه‌ی مدرسه تغییر کرده): بقیه‌ی دانش‌آموزان با نسخه‌ی جدید ساخته می‌شوند؛
+            # snapshot های ساخته‌شده‌ی قبلی هنگام درخواست دانش‌آموز نامعتبر تشخیص داده و دوباره ساخته می‌شوند
+            job.state = state
+            logger.info(f"🔄 داده‌های دوره {job.report_period_id} در حین ساخت کارنامه‌ها تغییر کرد؛ "
+                        f"ادامه‌ی کار با نسخه‌ی جدید.")
+
+        data_version, _, period_name = job.state
+        if load_snapshot(student_id, job.report_period_id, data_version):
+            self._advance(job)
+            return
+        snapshot = prepare_student_snapshot(student_id, job.report_period_id, job.names[student_id],
+                                            period_name, data_version)
+        if not snapshot:
+            self._advance(job)
+            return
+
+        self._slots.acquire()
+        try:
+            future = self.renderer.submit(student_report_charts, snapshot["report_data"],
+                                          snapshot["history_data"], snapshot["name"], period_name)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._finish(job, snapshot, f))
+
+    def _finish(self, job: _PeriodJob, snapshot: Dict, future):
+        self._slots.release()
+        try:
+            snapshot["charts"] = future.result()
+            if not job.cancelled:
+                save_snapshot(snapshot)
+            self._advance(job, built=True)
+        except Exception as e:
+            logger.error(f"❌ خطا در رسم نمودارهای کارنامه (student={snapshot['student_id']}, "
+                         f"period={job.report_period_id}): {e}")
+            self._advance(job, failed=True)
+
+    def _advance(self, job: _PeriodJob, built: bool = False, failed: bool = False):
+        with self._cond:
+            job.done += 1
+            job.built += built
+            job.failed += failed
+            report = job.done * PROGRESS_STEPS >= job.total * job._next_report
+            if report:
+                job._next_report = job.done * PROGRESS_STEPS // job.total + 1
+            if job.done == job.total and self._jobs.get(job.report_period_id) is job:
+                del self._jobs[job.report_period_id]
+                logger.info(f"🗂️ {job.built} کارنامه‌ی دوره {job.report_period_id} آماده شد ({job.failed} خطا).")
+        if report and not job.cancelled:
+            self._report(job)
+
+    @staticmethod
+    def _report(job: _PeriodJob):
+        if job.on_progress:
+            try:
+                job.on_progress(job.done, job.total, job.failed)
+            except Exception as e:
+                logger.error(f"❌ خطا در گزارش پیشرفت ساخت کارنامه‌ها: {e}")
+
+
+# ---------- صف سراسری ----------
+render_queue = RenderQueue()
@@ -0,0 +1,193 @@
+# services/report_cache.py
+
+import functools
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+# ======= کش کارنامه‌ها با ابطال مبتنی بر رویداد =======
+# کلید هر ورودی: (school_id, report_period_id, student_id, kind)
+#   kind: "report" (کارنامه‌ی یک دوره)، "history" (تاریخچه؛ report_period_id = None)
+#         یا "leaderboard:N" (نفرات برتر کل دوره؛ student_id = None)
+# هر مدرسه LRU و بودجه‌ی حافظه‌ی جداگانه دارد تا یک مدرسه‌ی پرترافیک کش بقیه را خالی نکند.
+# ثبت نمره و تأیید دوره بلافاصله پس از commit ورودی‌های مربوط را باطل می‌کنند (report_service)؛
+# همگام‌سازی فهرست مدرسه (roster_sync) همه‌ی ورودی‌های آن مدرسه را.
+
+# بودجه‌ی حافظه‌ی هر مدرسه (بایت، بر اساس اندازه‌ی pickle شده‌ی مقدار)
+SCHOOL_BUDGET_BYTES = int(os.environ.get("SCHOOLBOT_REPORT_CACHE_BYTES", 4 * 1024 * 1024))
+
+# سقف عمر هر ورودی؛ فقط برای تغییراتی که رویداد ابطال ندارند (مثل ویرایش دستی دیتابیس)
+SAFETY_TTL_SECONDS = 3600
+
+# حداکثر دانش‌آموزانی که مدرسه‌شان برای ساخت کلید کش به خاطر سپرده می‌شود
+STUDENT_SCHOOL_MEMO_SIZE = 50000
+
+_MISSING = object()
+
+
+class ReportCache:
+    def __init__(self, school_budget_bytes: int = SCHOOL_BUDGET_BYTES, ttl: float = SAFETY_TTL_SECONDS):
+        self.school_budget_bytes = school_budget_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._schools: Dict[int, OrderedDict] = {}   # school_id → {key: (value, size, expires_at)}
+        self._school_bytes: Dict[int, int] = {}
+        # با هر ابطال زیاد می‌شود؛ نتیجه‌ای که پیش از ابطال محاسبه شده دیگر در کش قرار نمی‌گیرد
+        self._generations: Dict[int, int] = {}
+        self._epoch = 0  # با clear زیاد می‌شود
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def generation(self, school_id):
+        with self._lock:
+            return self._epoch, self._generations.get(school_id, 0)
+
+    def get(self, key):
+        school_id = key[0]
+        with self._lock:
+            entries = self._schools.get(school_id)
+            item = entries.get(key) if entries else None
+            if item is None:
+                self.misses += 1
+                return _MISSING
+            if item[2] < time.monotonic():
+                self._remove(school_id, key)
+                self.misses += 1
+                return _MISSING
+            entries.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value, generation=None):
+        school_id = key[0]
+        size = len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        if size > self.school_budget_bytes:
+            return
+        with self._lock:
+            if generation is not None and generation != (self._epoch, self._generations.get(school_id, 0)):
+                return  # در حین محاسبه، داده‌های این مدرسه تغییر کرده است
+            entries = self._schools.setdefault(school_id, OrderedDict())
+            if key in entries:
+                self._remove(school_id, key)
+            entries[key] = (value, size, time.monotonic() + self.ttl)
+            self._school_bytes[school_id] = self._school_bytes.get(school_id, 0) + size
+            while self._school_bytes[school_id] > self.school_budget_bytes:
+                self._remove(school_id, next(iter(entries)))
+                self.evictions += 1
+
+    def _remove(self, school_id, key):
+        _, size, _ = self._schools[school_id].pop(key)
+        self._school_bytes[school_id] -= size
+
+    def invalidate(self, school_id, report_period_id=_MISSING, kind: str = None) -> int:
+        """
+        ورودی‌های یک مدرسه را باطل می‌کند؛ با report_period_id و/یا kind محدودتر می‌شود.
+        خروجی: تعداد ورودی‌های حذف‌شده
+        """
+        with self._lock:
+            self._generations[school_id] = self._generations.get(school_id, 0) + 1
+            entries = self._schools.get(school_id)
+            if not entries:
+                return 0
+            doomed = [key for key in entries
+                      if (report_period_id is _MISSING or key[1] == report_period_id)
+                      and (kind is None or key[3] == kind)]
+            for key in doomed:
+                self._remove(school_id, key)
+            self.invalidations += len(doomed)
+            return len(doomed)
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._schools.clear()
+            self._school_bytes.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions, "invalidations": self.invalidations,
+                "schools": {sid: {"entries": len(entries), "bytes": self._school_bytes[sid]}
+                            for sid, entries in self._schools.items()},
+            }
+
+
+# ---------- کش سراسری ----------
+report_cache = ReportCache()
+
+
+def invalidate_period(school_id: Optional[int], report_period_id: int):
+    """
+    پس از ثبت نمره یا تغییر وضعیت تأیید یک دوره: کارنامه‌های آن دوره و تاریخچه‌های همان مدرسه
+    (که میانگین‌ها و معدل دوره‌های تأییدشده را در بر دارند) باطل می‌شوند. بقیه‌ی مدارس دست‌نخورده می‌مانند.
+    """
+    if school_id is None:
+        report_cache.clear()
+        return
+    report_cache.invalidate(school_id, report_period_id)
+    report_cache.invalidate(school_id, kind="history")
+
+
+def get_or_compute(key, compute: Callable[[], object]):
+    """مقدار کش‌شده‌ی key یا محاسبه و ذخیره‌ی آن (با محافظت در برابر ابطال هم‌زمان)."""
+    value = report_cache.get(key)
+    if value is not _MISSING:
+        return value
+    generation = report_cache.generation(key[0])
+    value = compute()
+    report_cache.put(key, value, generation)
+    return value
+
+
+def invalidate_school(school_id: int):
+    """پس از تغییر فهرست مدرسه (ضریب درس‌ها، کلاس یا نام دانش‌آموزان): همه‌ی ورودی‌های آن مدرسه باطل می‌شوند."""
+    report_cache.invalidate(school_id)
+
+
+def _memoize_school(school_of: Callable[[int], Optional[int]]) -> Callable[[int], Optional[int]]:
+    # مدرسه‌ی دانش‌آموز عوض نمی‌شود؛ فقط بار اول از دیتابیس خوانده می‌شود (None به خاطر سپرده نمی‌شود)
+    schools: "OrderedDict[int, int]" = OrderedDict()
+    lock = threading.Lock()
+
+    def lookup(student_id):
+        with lock:
+            school_id = schools.get(student_id)
+            if school_id is not None:
+                schools.move_to_end(student_id)
+                return school_id
+        school_id = school_of(student_id)
+        if school_id is not None:
+            with lock:
+                schools[student_id] = school_id
+                if len(schools) > STUDENT_SCHOOL_MEMO_SIZE:
+                    schools.popitem(last=False)
+        return school_id
+
+    return lookup
+
+
+def cached_report(kind: str, school_of: Callable[[int], Optional[int]]):
+    """
+    دکوراتور برای توابع (student_id) یا (student_id, report_period_id).
+    school_of: تابعی که مدرسه‌ی دانش‌آموز را برمی‌گرداند (برای ساخت کلید و بودجه‌ی مدرسه)؛
+    نتیجه‌ی آن برای هر دانش‌آموز به خاطر سپرده می‌شود تا برخورد با کش به دیتابیس نرود.
+    فراخوان می‌تواند school_id را (اگر از قبل دارد) مستقیم بدهد.
+    """
+    school_of = _memoize_school(school_of)
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(student_id, report_period_id=None, school_id=None):
+            key = (school_id or school_of(student_id), report_period_id, student_id, kind)
+            if report_period_id is None:
+                return get_or_compute(key, lambda: func(student_id))
+            return get_or_compute(key, lambda: func(student_id, report_period_id))
+
+        return wrapper
+
+    return decorator
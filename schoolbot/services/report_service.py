@@ -1,36 +1,41 @@
 from datetime import datetime
-from schoolbot.database.data_loader import get_connection,db_lock
+from schoolbot.database.connection_pool import db_connection
+from schoolbot.database.db_writer import serialized_write
+from schoolbot.services.ranking_service import clear_period_rankings, rebuild_period_rankings, \
+    refresh_student_rankings
+from schoolbot.services.report_cache import invalidate_period
+from schoolbot.services.stats_service import refresh_class_subject_stats
 
 
 # ======= دوره‌ها =======
+@serialized_write
 def create_report_period(name: str, school_id: int):
-    with db_lock:
-        with get_connection() as conn:
-            cursor = conn.cursor()
-            start_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            cursor.execute(
-                "INSERT INTO report_periods (name, start_date, school_id) VALUES (?, ?, ?)",
-                (name, start_date, school_id)
-            )
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        start_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        cursor.execute(
+            "INSERT INTO report_periods (name, start_date, school_id) VALUES (?, ?, ?)",
+            (name, start_date, school_id)
+        )
 
 
 
 def get_report_periods():
-    with get_connection() as conn:
+    with db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT id, name FROM report_periods")
         return cursor.fetchall()
 
 
 def get_report_period_by_name(name):
-    with get_connection() as conn:
+    with db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT id, name FROM report_periods WHERE name = ?", (name,))
         return cursor.fetchone()
 
 
 def get_all_report_periods(user_id):
-    with get_connection() as conn:
+    with db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute(
             "SELECT id, name, approved FROM report_periods WHERE school_id=? ORDER BY start_date DESC",
@@ -40,30 +45,49 @@ def get_all_report_periods(user_id):
         return [{"id": r[0], "name": r[1], "approved": bool(r[2])} for r in rows]
 
 
+def _period_school_id(cursor, report_period_id):
+    cursor.execute("SELECT school_id FROM report_periods WHERE id=?", (report_period_id,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def _bump_data_version(cursor, report_period_id):
+    # هر تغییری در نمرات یا وضعیت دوره، snapshot های ذخیره‌شده‌ی کارنامه‌های آن دوره را نامعتبر می‌کند
+    cursor.execute("UPDATE report_periods SET data_version = data_version + 1 WHERE id=?", (report_period_id,))
+
+
+@serialized_write
 def toggle_report_period_approval(period_id):
-    with db_lock:
-        with get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT approved FROM report_periods WHERE id=?", (period_id,))
-            row = cursor.fetchone()
-            if row:
-                new_status = 0 if row[0] else 1
-                cursor.execute("UPDATE report_periods SET approved=? WHERE id=?", (new_status, period_id))
-                conn.commit()
-                return bool(new_status)
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT approved, school_id FROM report_periods WHERE id=?", (period_id,))
+        row = cursor.fetchone()
+        if row:
+            new_status = 0 if row[0] else 1
+            cursor.execute("UPDATE report_periods SET approved=? WHERE id=?", (new_status, period_id))
+            _bump_data_version(cursor, period_id)
+            # رتبه‌های دوره در همین تراکنش و یک بار برای کل مدرسه ساخته (یا پاک) می‌شوند
+            if new_status:
+                rebuild_period_rankings(cursor, period_id)
+            else:
+                clear_period_rankings(cursor, period_id)
+            conn.commit()
+            # کش کارنامه‌ها فقط پس از commit باطل می‌شود تا داده‌ی قدیمی دوباره در آن ننشیند
+            invalidate_period(row[1], period_id)
+            return bool(new_status)
     return None
 
 
 # ======= کلاس‌ها =======
 def get_all_classes():
-    with get_connection() as conn:
+    with db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT id, name FROM classes")
         return cursor.fetchall()
 
 
 def get_class_by_id(class_id):
-    with get_connection() as conn:
+    with db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT id, name FROM classes WHERE id = ?", (class_id,))
         return cursor.fetchone()
@@ -71,21 +95,21 @@ def get_class_by_id(class_id):
 
 # ======= درس‌ها =======
 def get_all_subjects():
-    with get_connection() as conn:
+    with db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT id, name, class_id, teacher_id FROM subjects")
         return cursor.fetchall()
 
 
 def get_subject_by_name(name):
-    with get_connection() as conn:
+    with db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT id, name, class_id, teacher_id FROM subjects WHERE name = ?", (name,))
         return cursor.fetchone()
 
 
 def get_subjects_by_teacher(teacher_id):
-    with get_connection() as conn:
+    with db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT id, name, class_id FROM subjects WHERE teacher_id = ? ORDER BY name", (teacher_id,))
         return cursor.fetchall()
@@ -93,37 +117,61 @@ def get_subjects_by_teacher(teacher_id):
 
 # ======= دانش‌آموزان =======
 def get_students_by_class(class_id):
-    with get_connection() as conn:
+    with db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT id, name FROM students WHERE class_id = ? ORDER BY id", (class_id,))
         return cursor.fetchall()
 
 
 # ======= ثبت نمرات =======
+# به لطف کلید یکتای (student_id, subject_id, report_period_id)، درج یا به‌روزرسانی در یک دستور انجام می‌شود
+_UPSERT_SCORE_SQL = """
+    INSERT INTO scores (student_id, subject_id, report_period_id, score, description)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(student_id, subject_id, report_period_id)
+    DO UPDATE SET score = excluded.score, description = excluded.description
+"""
+
+
+@serialized_write
 def save_student_score(student_id, subject_id, report_period_id, score, description=None):
-    with db_lock:
-        with get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT id FROM scores WHERE student_id=? AND subject_id=? AND report_period_id=?",
-                (student_id, subject_id, report_period_id)
-            )
-            row = cursor.fetchone()
-            if row:
-                cursor.execute(
-                    "UPDATE scores SET score=?, description=? WHERE id=?",
-                    (score, description, row[0])
-                )
-            else:
-                cursor.execute(
-                    "INSERT INTO scores (student_id, subject_id, report_period_id, score, description) VALUES (?, ?, ?, ?, ?)",
-                    (student_id, subject_id, report_period_id, score, description)
-                )
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(_UPSERT_SCORE_SQL, (student_id, subject_id, report_period_id, score, description))
+        # آمار کلاس در این درس، و اگر دوره تأیید شده باشد رتبه‌های همین دانش‌آموز، در همین تراکنش به‌روز می‌شوند
+        refresh_class_subject_stats(cursor, report_period_id, [subject_id])
+        refresh_student_rankings(cursor, report_period_id, [student_id])
+        _bump_data_version(cursor, report_period_id)
+        school_id = _period_school_id(cursor, report_period_id)
+    invalidate_period(school_id, report_period_id)
 
 
+@serialized_write
+def save_student_scores_bulk(subject_id, report_period_id, scores):
+    """
+    ثبت یکجای نمرات چند دانش‌آموز در یک درس و یک دوره، در یک تراکنش.
+
+    ورودی scores:
+    [(student_id, score, description), ...]
+    خروجی: تعداد رکوردهای ثبت‌شده
+    """
+    rows = [(student_id, subject_id, report_period_id, score, description)
+            for student_id, score, description in scores]
+    if not rows:
+        return 0
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany(_UPSERT_SCORE_SQL, rows)
+        refresh_class_subject_stats(cursor, report_period_id, [subject_id])
+        refresh_student_rankings(cursor, report_period_id, [row[0] for row in rows])
+        _bump_data_version(cursor, report_period_id)
+        school_id = _period_school_id(cursor, report_period_id)
+    invalidate_period(school_id, report_period_id)
+    return len(rows)
+
 
 def get_student_score(student_id, subject_id, report_period_id):
-    with get_connection() as conn:
+    with db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute(
             "SELECT score, description FROM scores WHERE student_id=? AND subject_id=? AND report_period_id=?",
@@ -147,7 +195,7 @@ def get_students_scores_by_class(class_id, subject_id, report_period_id):
         ...
     ]
     """
-    with get_connection() as conn:
+    with db_connection() as conn:
         cursor = conn.cursor()
 
         query = """
@@ -176,7 +224,7 @@ def get_students_scores_by_class(class_id, subject_id, report_period_id):
 
 
 def get_all_user_messages():
-    with get_connection() as conn:
+    with db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT id, role, id_bale, user_id FROM user_message")
         rows = cursor.fetchall()
@@ -184,7 +232,7 @@ def get_all_user_messages():
 
 
 def get_all_user_messages_user_id_role(user_id, role):
-    with get_connection() as conn:
+    with db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("""
                SELECT id_bale 
@@ -201,7 +249,7 @@ def get_scores_completion_status(report_period_id: int, school_id: int):
     شامل نام معلم، میانگین نمرات و مرتب‌سازی بر اساس نام معلم.
     """
 
-    with get_connection() as conn:
+    with db_connection() as conn:
         cursor = conn.cursor()
 
         query = """
@@ -0,0 +1,194 @@
+# services/report_snapshot.py
+
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+from schoolbot.chart.chart_cache import has_image, put_image
+from schoolbot.chart.render_service import render_service, student_report_charts
+from schoolbot.chart.chart_student.chart_student import (
+    render_multi_subject_charts,
+    render_combined_chart,
+    render_radar_chart,
+    render_average_trend_chart
+)
+from schoolbot.database.connection_pool import CACHE_DIR, db_connection
+from schoolbot.present.student_presenter.student_presenter import (
+    build_report_card_message,
+    build_score_history_message,
+    prepare_data_for_radar_chart
+)
+from schoolbot.services.score_service import get_student_comprehensive_report, get_student_performance_history
+
+logger = logging.getLogger(__name__)
+
+# ======= snapshot کارنامه‌های دوره‌های تأییدشده =======
+# با تأیید یک دوره، متن کارنامه، داده‌ها و تصاویر نمودارهای هر دانش‌آموز یک بار ساخته
+# و در فایل {SNAPSHOT_DIR}/{report_period_id}/{student_id}.pkl ذخیره می‌شود؛
+# درخواست دانش‌آموز پس از آن فقط یک خواندن فایل و ارسال است. تصاویر نمودارها در chart_cache
+# (بر اساس محتوا) ذخیره می‌شوند و snapshot فقط digest آن‌ها را نگه می‌دارد.
+# ساخت دسته‌ای پس از تأیید دوره در services/render_queue انجام می‌شود.
+# اعتبار هر snapshot با نسخه‌ی داده‌ها سنجیده می‌شود: data_version خود دوره به‌علاوه‌ی (id, data_version)
+# همه‌ی دوره‌های تأییدشده‌ی مدرسه، چون متن و نمودارهای تاریخچه همه‌ی آن دوره‌ها را در بر دارند.
+# ثبت نمره یا تغییر تأیید (report_service) data_version را زیاد می‌کند و snapshot قدیمی خودبه‌خود کنار گذاشته و دوباره ساخته می‌شود.
+
+SNAPSHOT_DIR = os.environ.get("SCHOOLBOT_SNAPSHOT_DIR", os.path.join(CACHE_DIR, "report_snapshots"))
+
+# با تغییر قالب متن یا نمودارها زیاد شود تا snapshot های قدیمی دوباره ساخته شوند
+SNAPSHOT_FORMAT = 3
+
+
+def _snapshot_path(student_id: int, report_period_id: int) -> str:
+    return os.path.join(SNAPSHOT_DIR, str(report_period_id), f"{student_id}.pkl")
+
+
+def get_period_state(report_period_id: int) -> Optional[Tuple[tuple, bool, str]]:
+    """(version, approved, name) دوره یا None؛ version = (data_version دوره، نسخه‌ی تاریخچه‌ی مدرسه)"""
+    with db_connection() as conn:
+        row = conn.execute("SELECT data_version, approved, name, school_id FROM report_periods WHERE id = ?",
+                           (report_period_id,)).fetchone()
+        if not row:
+            return None
+        history = conn.execute("""
+            SELECT id, data_version FROM report_periods WHERE school_id = ? AND approved = 1 ORDER BY id
+        """, (row[3],)).fetchall()
+    return (row[0], tuple(history)), bool(row[1]), row[2]
+
+
+# ---------- ساخت ----------
+def render_student_charts(report_data: Dict, history_data: Dict, name: str,
+                          period_name: str) -> List[Tuple[str, bytes]]:
+    """
+    همه‌ی نمودارهای کارنامه به ترتیب ارسال: [(caption, digest), ...]
+    فقط از داده‌های ورودی استفاده می‌کند (بدون دیتابیس) تا در پردازه‌ی جداگانه هم قابل اجرا باشد.
+    """
+    charts = []
+
+    combined = render_combined_chart(report_data.get("scores", []), name, period_name)
+    if combined:
+        charts.append((f"📊 نمودار نمرات {name} و میانگین کلاس", put_image(combined)))
+
+    all_scores = history_data.get("all_scores")
+    if not all_scores:
+        return charts
+
+    trend = render_average_trend_chart(history_data.get("student_period_averages", {}), name,
+                                       history_data.get("class_period_averages", {}))
+    if trend:
+        charts.append((f"📊 نمودار پیشرفت تحصیلی {name}", put_image(trend)))
+
+    radar = render_radar_chart(prepare_data_for_radar_chart(all_scores), name)
+    if radar:
+        charts.append((f"📊 نمودار راداری عملکرد ساحت های شش گانه {name}", put_image(radar)))
+
+    for image in render_multi_subject_charts(all_scores, name):
+        charts.append(("نمودار روند نمرات دروس در دوره‌های مختلف", put_image(image)))
+    return charts
+
+
+def prepare_student_snapshot(student_id: int, report_period_id: int, name: str, period_name: str,
+                             data_version: tuple = None) -> Optional[Dict]:
+    """
+    بخش داده‌ای و متنی کارنامه (بدون نمودار؛ charts خالی است)؛ اگر نمره‌ای ثبت نشده باشد None.
+    نمودارها جداگانه با render_student_charts از روی report_data و history_data ساخته می‌شوند.
+    """
+    report_data = get_student_comprehensive_report(student_id, report_period_id)
+    if not report_data or not report_data.get("scores"):
+        return None
+    history_data = get_student_performance_history(student_id)
+    all_scores = history_data.get("all_scores")
+    return {
+        "format": SNAPSHOT_FORMAT,
+        "data_version": data_version,
+        "created_at": time.time(),
+        "student_id": student_id,
+        "report_period_id": report_period_id,
+        "report_data": report_data,
+        "history_data": history_data,
+        "report_text": build_report_card_message(report_data, name, period_name),
+        "history_text": build_score_history_message(all_scores, name) if all_scores else None,
+        "name": name,
+        "period_name": period_name,
+        "charts": [],
+    }
+
+
+def build_student_snapshot(student_id: int, report_period_id: int, name: str, period_name: str,
+                           data_version: tuple = None) -> Optional[Dict]:
+    """کارنامه‌ی کامل یک دانش‌آموز (متن، داده و نمودارها)؛ نمودارها در استخر رسم ساخته می‌شوند"""
+    snapshot = prepare_student_snapshot(student_id, report_period_id, name, period_name, data_version)
+    if snapshot:
+        snapshot["charts"] = render_service.render(student_report_charts, snapshot["report_data"],
+                                                   snapshot["history_data"], name, period_name)
+    return snapshot
+
+
+# ---------- ذخیره و بازیابی ----------
+def save_snapshot(snapshot: Dict):
+    """نوشتن اتمیک (فایل موقت + os.replace) تا خواننده‌ی هم‌زمان هیچ‌وقت فایل نیمه‌کاره نبیند"""
+    path = _snapshot_path(snapshot["student_id"], snapshot["report_period_id"])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def load_snapshot(student_id: int, report_period_id: int, data_version: tuple) -> Optional[Dict]:
+    """snapshot معتبر (هم‌نسخه با داده‌های فعلی دوره و تاریخچه‌ی مدرسه) یا None"""
+    try:
+        with open(_snapshot_path(student_id, report_period_id), "rb") as f:
+            snapshot = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.error(f"❌ snapshot خراب (student={student_id}, period={report_period_id}): {e}")
+        return None
+    if snapshot.get("format") != SNAPSHOT_FORMAT or snapshot.get("data_version") != data_version:
+        return None
+    if not all(has_image(digest) for _, digest in snapshot["charts"]):
+        return None  # تصویری از انبار نمودارها پاک شده است
+    return snapshot
+
+
+def get_report_snapshot(student_id: int, report_period_id: int, name: str) -> Optional[Dict]:
+    """
+    کارنامه‌ی آماده‌ی دانش‌آموز برای ارسال. اگر snapshot معتبری نباشد (هنوز ساخته نشده یا
+    نمرات پس از ساخت تغییر کرده) همین‌جا ساخته می‌شود و برای دوره‌ی تأییدشده ذخیره می‌گردد.
+    """
+    state = get_period_state(report_period_id)
+    if not state:
+        return None
+    data_version, approved, period_name = state
+    if approved:
+        snapshot = load_snapshot(student_id, report_period_id, data_version)
+        if snapshot:
+            return snapshot
+    snapshot = build_student_snapshot(student_id, report_period_id, name, period_name, data_version)
+    if snapshot and approved:
+        save_snapshot(snapshot)
+    return snapshot
+
+
+def drop_period_snapshots(report_period_id: int):
+    """حذف همه‌ی snapshot های یک دوره (مثلاً پس از لغو تأیید)"""
+    shutil.rmtree(os.path.join(SNAPSHOT_DIR, str(report_period_id)), ignore_errors=True)
+
+
+def get_period_students(report_period_id: int) -> List[Tuple[int, str]]:
+    """دانش‌آموزانی که در این دوره نمره دارند: [(student_id, name), ...]"""
+    with db_connection() as conn:
+        return conn.execute("""
+            SELECT st.id, st.name
+            FROM students st
+            WHERE st.id IN (SELECT DISTINCT student_id FROM scores WHERE report_period_id = ?)
+            ORDER BY st.class_id, st.id
+        """, (report_period_id,)).fetchall()
@@ -0,0 +1,47 @@
+# services/repository.py
+
+from schoolbot.chart import chart_cache
+from schoolbot.database.async_db import awaitable, awaitable_write
+from schoolbot.present.teacher_presenter.teacher_presenter import _safe_prev_score_lookup
+from schoolbot.services import broadcast, report_service, report_snapshot, score_service, score_service_teacher, \
+    stats_service
+from schoolbot.services.render_queue import render_queue
+
+# ======= لایه‌ی داده‌ی async برای هندلرها =======
+# نسخه‌ی await شدنی توابع سرویس‌ها با همان نام و آرگومان‌ها:
+#   خواندن‌ها در استخر thread اختصاصی دیتابیس (db_executor) و نوشتن‌ها در نویسنده‌ی واحد اجرا می‌شوند
+#   و event loop در طول پرس‌وجو آزاد می‌ماند. هندلرها به جای فراخوانی مستقیم سرویس‌ها از این‌ها استفاده می‌کنند:
+#       from schoolbot.services import repository as repo
+#       school_id = await repo.get_school_id_by_student(user_id)
+
+# ---------- دانش‌آموز ----------
+get_school_id_by_student = awaitable(score_service.get_school_id_by_student)
+get_report_periods = awaitable(score_service.get_report_periods)
+# snapshot آماده از دیسک؛ اگر نباشد همین‌جا ساخته می‌شود (نمودارها در استخر پردازه‌ی رسم)
+get_report_snapshot = awaitable(report_snapshot.get_report_snapshot)
+# خواندن تصویر نمودار از انبار روی دیسک
+get_image = awaitable(chart_cache.get_image)
+
+# ---------- معلم ----------
+get_teacher_school_id = awaitable(score_service_teacher.get_teacher_school_id)
+get_report_periods_teachers = awaitable(score_service_teacher.get_report_periods_teachers)
+get_subjects_by_teacher = awaitable(report_service.get_subjects_by_teacher)
+get_class_by_id = awaitable(report_service.get_class_by_id)
+get_students_by_class = awaitable(report_service.get_students_by_class)
+get_students_scores_by_class = awaitable(report_service.get_students_scores_by_class)
+get_class_summary_inputs = awaitable(stats_service.get_class_summary_inputs)
+prev_score_lookup = awaitable(_safe_prev_score_lookup)
+save_student_score = awaitable_write(report_service.save_student_score)
+save_student_scores_bulk = awaitable_write(report_service.save_student_scores_bulk)
+
+# ---------- مدیر ----------
+get_all_report_periods = awaitable(report_service.get_all_report_periods)
+get_scores_completion_status = awaitable(report_service.get_scores_completion_status)
+create_report_period = awaitable_write(report_service.create_report_period)
+toggle_report_period_approval = awaitable_write(report_service.toggle_report_period_approval)
+# صف کردن دوره وضعیت دوره و فهرست دانش‌آموزانش را از دیتابیس می‌خواند
+enqueue_period_snapshots = awaitable(render_queue.enqueue_period)
+drop_period_snapshots = awaitable(report_snapshot.drop_period_snapshots)
+get_bale_ids = awaitable(broadcast.get_bale_ids)
+create_broadcast = awaitable_write(broadcast.create_broadcast)
+get_latest_broadcast = awaitable(broadcast.get_latest_broadcast)
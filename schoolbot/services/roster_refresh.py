@@ -0,0 +1,32 @@
+# services/roster_refresh.py
+
+from typing import Iterable
+
+from schoolbot.database import roster_sync
+from schoolbot.services.ranking_service import rebuild_period_rankings
+from schoolbot.services.report_cache import invalidate_school
+from schoolbot.services.stats_service import refresh_class_subject_stats
+
+# ======= به‌روزرسانی داده‌های وابسته پس از همگام‌سازی فهرست مدرسه =======
+# roster_sync (لایه‌ی دیتابیس) فقط دوره‌های متأثر را پیدا می‌کند و این توابع را از طریق نقاط اتصالش صدا می‌زند.
+# ثبت با import همین ماژول انجام می‌شود؛ اسکریپت‌های همگام‌سازی (roster_sync، data_loader --sync) آن را import می‌کنند.
+
+
+def refresh_period(cursor, report_period_id: int, approved: bool, stats_subject_ids: Iterable[int]):
+    """در همان تراکنش همگام‌سازی: آمار درس‌های متأثر و (برای دوره‌ی تأییدشده) رتبه‌های کل دوره."""
+    stats_subject_ids = list(stats_subject_ids)
+    if stats_subject_ids:
+        refresh_class_subject_stats(cursor, report_period_id, stats_subject_ids)
+    if approved:
+        rebuild_period_rankings(cursor, report_period_id)
+
+
+def register():
+    if refresh_period not in roster_sync.period_refresh_hooks:
+        roster_sync.period_refresh_hooks.append(refresh_period)
+    if invalidate_school not in roster_sync.roster_commit_hooks:
+        # پس از commit: کارنامه‌ها و تاریخچه‌های کش‌شده‌ی مدرسه (نام، کلاس، ضرایب) دیگر معتبر نیستند
+        roster_sync.roster_commit_hooks.append(invalidate_school)
+
+
+register()
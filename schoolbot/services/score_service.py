@@ -11,14 +11,13 @@ import pandas as pd
 from adjustText import adjust_text
 from bidi.algorithm import get_display
 from matplotlib import rcParams
-from cachetools import cached, TTLCache
 
-from schoolbot.database.data_loader import get_connection
+from schoolbot.database.connection_pool import db_connection
+from schoolbot.services.ranking_service import get_period_leaderboards, get_student_ranking
+from schoolbot.services.report_cache import cached_report
 
 rcParams["font.family"] = "Tahoma"
 
-cache = TTLCache(maxsize=200, ttl=300)
-
 # توابع کمکی که بدون تغییر باقی می‌مانند
 def get_school_id_by_student(student_id: int) -> Optional[int]:
     """
@@ -33,7 +32,7 @@ def get_school_id_by_student(student_id: int) -> Optional[int]:
             JOIN grades g ON c.grade_id = g.id
             WHERE s.id = ?
         """
-    with get_connection() as conn:
+    with db_connection() as conn:
         cur = conn.cursor()
         row = cur.execute(query, (student_id,)).fetchone()
     return row[0] if row else None
@@ -51,14 +50,14 @@ def get_report_periods(school_id: int) -> List[Tuple[int, str]]:
         WHERE approved = 1 AND school_id = ?
         ORDER BY id DESC
     """
-    with get_connection() as conn:
+    with db_connection() as conn:
         cur = conn.cursor()
         periods = cur.execute(query, (school_id,)).fetchall()
     return periods
 
 
 # ✨ بهینه‌سازی: تابع جامع برای دریافت تمام اطلاعات یک کارنامه در یک دوره خاص
-@cached(cache)
+@cached_report("report", school_of=get_school_id_by_student)
 def get_student_comprehensive_report(student_id: int, report_period_id: int) -> Dict:
     """
     یک تابع جامع و بهینه که تمام اطلاعات مورد نیاز برای کارنامه یک دانش‌آموز
@@ -75,95 +74,58 @@ def get_student_comprehensive_report(student_id: int, report_period_id: int) ->
     report_data = {}
 
     # --- کوئری ۱: دریافت لیست نمرات دانش‌آموز به همراه میانگین کلاس برای هر درس ---
-    # این کوئری با استفاده از یک ساب‌کوئری، میانگین کلاس را برای هر درس محاسبه و به نمره دانش‌آموز الصاق می‌کند.
+    # میانگین کلاس از جدول آماده‌ی class_subject_stats خوانده می‌شود (که با هر ثبت نمره به‌روز است).
     scores_query = """
         SELECT
             s.name AS subject_name,
             sc.score,
             sc.description,
             s.coefficient,
-            (
-                SELECT AVG(sc_avg.score)
-                FROM scores sc_avg
-                JOIN students st_avg ON sc_avg.student_id = st_avg.id
-                WHERE st_avg.class_id = (SELECT class_id FROM students WHERE id = ?)
-                  AND sc_avg.subject_id = sc.subject_id
-                  AND sc_avg.report_period_id = ?
-            ) AS class_average
+            css.mean AS class_average
         FROM scores sc
         JOIN subjects s ON sc.subject_id = s.id
+        JOIN students st ON st.id = sc.student_id
+        LEFT JOIN class_subject_stats css
+               ON css.report_period_id = sc.report_period_id
+              AND css.subject_id = sc.subject_id
+              AND css.class_id = st.class_id
         WHERE sc.student_id = ? AND sc.report_period_id = ?
         ORDER BY s.name;
     """
-    with get_connection() as conn:
+    with db_connection() as conn:
         cur = conn.cursor()
-        scores_result = cur.execute(scores_query, (student_id, report_period_id, student_id, report_period_id)).fetchall()
+        scores_result = cur.execute(scores_query, (student_id, report_period_id)).fetchall()
         report_data["scores"] = [
             {"subject_name": r[0], "score": r[1], "description": r[2], "coefficient": r[3], "class_average": r[4]}
             for r in scores_result
         ]
 
-    # --- کوئری ۲: محاسبه معدل، رتبه‌ها و تعداد کل دانش‌آموزان با یک کوئری ---
-    # این کوئری قدرتمند با استفاده از CTE و Window Functions تمام محاسبات را در دیتابیس انجام می‌دهد.
-    ranks_query = """
-        WITH StudentAverages AS (
-            -- ابتدا معدل وزنی همه دانش‌آموزان مدرسه در این دوره را محاسبه می‌کنیم
-            SELECT
-                st.id AS student_id,
-                st.class_id,
-                c.grade_id,
-                SUM(sc.score * s.coefficient) / SUM(s.coefficient) AS weighted_average
-            FROM scores sc
-            JOIN subjects s ON sc.subject_id = s.id
-            JOIN students st ON sc.student_id = st.id
-            JOIN classes c ON st.class_id = c.id
-            WHERE sc.report_period_id = ? AND sc.score IS NOT NULL
-            GROUP BY st.id, st.class_id, c.grade_id
-        ),
-        RankContext AS (
-            -- سپس با استفاده از توابع پنجره‌ای، رتبه و تعداد را در هر سطح محاسبه می‌کنیم
-            SELECT
-                student_id,
-                weighted_average,
-                RANK() OVER (PARTITION BY class_id ORDER BY weighted_average DESC) AS rank_class,
-                COUNT(student_id) OVER (PARTITION BY class_id) AS count_class,
-                RANK() OVER (PARTITION BY grade_id ORDER BY weighted_average DESC) AS rank_grade,
-                COUNT(student_id) OVER (PARTITION BY grade_id) AS count_grade,
-                RANK() OVER (ORDER BY weighted_average DESC) AS rank_school,
-                COUNT(student_id) OVER () AS count_school
-            FROM StudentAverages
-        )
-        -- در نهایت، فقط اطلاعات دانش‌آموز مورد نظر را انتخاب می‌کنیم
-        SELECT * FROM RankContext WHERE student_id = ?;
-    """
-    with get_connection() as conn:
-        cur = conn.cursor()
-        rank_result = cur.execute(ranks_query, (report_period_id, student_id)).fetchone()
-        if rank_result:
-            report_data["weighted_average"] = round(rank_result[1], 2)
-            report_data["ranks"] = {
-                "class_rank": rank_result[2], "class_count": rank_result[3],
-                "grade_rank": rank_result[4], "grade_count": rank_result[5],
-                "school_rank": rank_result[6], "school_count": rank_result[7],
-            }
-        else:
-            report_data["weighted_average"] = None
-            report_data["ranks"] = {}
+    # --- کوئری ۲: معدل، رتبه‌ها و تعداد کل دانش‌آموزان ---
+    # رتبه‌ها هنگام تأیید دوره یک بار برای کل مدرسه در جدول period_rankings ساخته شده‌اند؛
+    # اینجا فقط ردیف همین دانش‌آموز (با ایندکس) خوانده می‌شود.
+    ranking = get_student_ranking(student_id, report_period_id)
+    if ranking:
+        report_data["weighted_average"] = round(ranking.pop("weighted_average"), 2)
+        report_data["ranks"] = ranking
+    else:
+        report_data["weighted_average"] = None
+        report_data["ranks"] = {}
 
 
     # --- کوئری ۳: دریافت نفرات برتر ---
-    # تابع get_top_students از قبل بهینه است، فقط باید فراخوانی شود.
-    with get_connection() as conn:
+    # نفرات برتر کلاس، پایه و مدرسه‌ی این دوره یک بار (برای کل مدرسه) ساخته و به اشتراک گذاشته می‌شوند.
+    with db_connection() as conn:
         cur = conn.cursor()
         cur.execute("SELECT c.id, c.grade_id FROM students s JOIN classes c ON s.class_id = c.id WHERE s.id = ?", (student_id,))
         ids = cur.fetchone()
         class_id, grade_id = (ids[0], ids[1]) if ids else (None, None)
 
     if class_id and grade_id:
+        boards = get_period_leaderboards(report_period_id)
         report_data["top_students"] = {
-            "class": get_top_students(report_period_id, "class", class_id, 3),
-            "grade": get_top_students(report_period_id, "grade", grade_id, 3),
-            "school": get_top_students(report_period_id, "school", None, 3),
+            "class": boards["class"].get(class_id, []),
+            "grade": boards["grade"].get(grade_id, []),
+            "school": boards["school"],
         }
     else:
         report_data["top_students"] = {}
@@ -177,46 +139,17 @@ def get_top_students(report_period_id: int, scope: str, scope_id: Optional[int]
         دریافت نفرات برتر بر اساس محدوده:
         scope = "class"  → بر اساس کلاس (نیاز به class_id)
         scope = "grade"  → بر اساس پایه (نیاز به grade_id)
-        scope = "school" → کل مدرسه (نیازی به scope_id ندارد)
+        scope = "school" → کل مدرسه‌ی همان دوره (نیازی به scope_id ندارد)
         خروجی: [ {id, name, class, avg}, ... ]
         """
-    with get_connection() as conn:
-        cur = conn.cursor()
-
-        base_query = """
-                SELECT st.id, st.name, c.name,
-                       ROUND(SUM(sc.score * s.coefficient) / SUM(s.coefficient), 2) AS avg_score
-                FROM scores sc
-                JOIN subjects s ON sc.subject_id = s.id
-                JOIN students st ON st.id = sc.student_id
-                JOIN classes c ON st.class_id = c.id
-                WHERE sc.report_period_id = ?
-            """
-
-        params = [report_period_id]
-
-        if scope == "class" and scope_id:
-            base_query += " AND st.class_id = ?"
-            params.append(scope_id)
-        elif scope == "grade" and scope_id:
-            base_query += " AND st.class_id IN (SELECT id FROM classes WHERE grade_id = ?)"
-            params.append(scope_id)
-
-        base_query += """
-                GROUP BY st.id
-                ORDER BY avg_score DESC
-                LIMIT ?
-            """
-        params.append(top_n)
-
-        cur.execute(base_query, tuple(params))
-        rows = cur.fetchall()
-
-    return [{"id": r[0], "name": r[1], "class": r[2], "avg": r[3]} for r in rows]
+    boards = get_period_leaderboards(report_period_id, top_n)
+    if scope == "school":
+        return boards["school"]
+    return boards.get(scope, {}).get(scope_id, [])
 
 
 # ✨ بهینه‌سازی: تابع جامع برای دریافت تمام تاریخچه عملکرد دانش‌آموز
-@cached(cache)
+@cached_report("history", school_of=get_school_id_by_student)
 def get_student_performance_history(student_id: int) -> Dict:
     """
     یک تابع جامع و بهینه که تمام تاریخچه نمرات و معدل‌های دانش‌آموز و کلاس
@@ -224,7 +157,7 @@ def get_student_performance_history(student_id: int) -> Dict:
     """
     history_data = {}
     class_id_query = "SELECT class_id FROM students WHERE id = ?"
-    with get_connection() as conn:
+    with db_connection() as conn:
         class_id = conn.execute(class_id_query, (student_id,)).fetchone()
         if not class_id: return {}
         class_id = class_id[0]
@@ -232,17 +165,20 @@ def get_student_performance_history(student_id: int) -> Dict:
     # کوئری ۱: دریافت تاریخچه همه نمرات به همراه نام معلم و میانگین کلاس برای هر درس
     all_scores_query = """
         SELECT s.name, rp.name, sc.score, sc.description, s.coefficient,
-               (SELECT AVG(sc_avg.score) FROM scores sc_avg JOIN students st_avg ON sc_avg.student_id = st_avg.id
-                WHERE st_avg.class_id = ? AND sc_avg.subject_id = sc.subject_id AND sc_avg.report_period_id = sc.report_period_id) as class_subject_avg,
+               css.mean as class_subject_avg,
                t.name
         FROM scores sc
         JOIN subjects s ON sc.subject_id = s.id
         JOIN report_periods rp ON sc.report_period_id = rp.id
         LEFT JOIN teachers t ON s.teacher_id = t.id
+        LEFT JOIN class_subject_stats css
+               ON css.report_period_id = sc.report_period_id
+              AND css.subject_id = sc.subject_id
+              AND css.class_id = ?
         WHERE sc.student_id = ? AND rp.approved = 1
         ORDER BY s.name, rp.id;
     """
-    with get_connection() as conn:
+    with db_connection() as conn:
         scores_result = conn.execute(all_scores_query, (class_id, student_id)).fetchall()
         # ✨ بهینه‌سازی: تبدیل مستقیم به فرمت مورد نیاز generate_multi_subject_charts
         history_data["all_scores"] = scores_result
@@ -256,7 +192,7 @@ def get_student_performance_history(student_id: int) -> Dict:
         WHERE sc.student_id = ? AND rp.approved = 1 AND sc.score IS NOT NULL
         GROUP BY rp.id, rp.name ORDER BY rp.id;
     """
-    with get_connection() as conn:
+    with db_connection() as conn:
         student_avg_result = conn.execute(student_avg_query, (student_id,)).fetchall()
         history_data["student_period_averages"] = {name: round(avg, 2) for name, avg in student_avg_result}
 
@@ -270,7 +206,7 @@ def get_student_performance_history(student_id: int) -> Dict:
         WHERE st.class_id = ? AND rp.approved = 1 AND sc.score IS NOT NULL
         GROUP BY rp.id, rp.name ORDER BY rp.id;
     """
-    with get_connection() as conn:
+    with db_connection() as conn:
         class_avg_result = conn.execute(class_avg_query, (class_id,)).fetchall()
         history_data["class_period_averages"] = {name: round(avg, 2) for name, avg in class_avg_result}
 
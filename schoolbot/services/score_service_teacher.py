@@ -11,7 +11,7 @@ from bidi.algorithm import get_display
 import matplotlib.pyplot as plt
 from matplotlib import rcParams
 
-from schoolbot.database.data_loader import get_connection
+from schoolbot.database.connection_pool import db_connection
 
 
 def get_teacher_school_id(teacher_id: int) -> Optional[int]:
@@ -20,7 +20,7 @@ def get_teacher_school_id(teacher_id: int) -> Optional[int]:
     بازگرداندن None اگر معلم پیدا نشود
     """
     query = "SELECT school_id FROM teachers WHERE id = ?"
-    with get_connection() as conn:
+    with db_connection() as conn:
         cur = conn.cursor()
         row = cur.execute(query, (teacher_id,)).fetchone()
     return row[0] if row else None
@@ -32,7 +32,7 @@ def get_report_periods_teachers(school_id: int) -> List[Tuple[int, str]]:
     خروجی: [(id, name), ...]
     """
     query = "SELECT id, name FROM report_periods where school_id=? ORDER BY id DESC"
-    with get_connection() as conn:
+    with db_connection() as conn:
         cur = conn.cursor()
         periods = cur.execute(query, (school_id,)).fetchall()
     return periods
@@ -0,0 +1,405 @@
+# services/session_store.py
+
+import asyncio
+import hashlib
+import logging
+import os
+import pickle
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from schoolbot.database.async_db import run_db
+from schoolbot.database.connection_pool import db_connection
+from schoolbot.database.db_writer import serialized_write, writer
+
+logger = logging.getLogger(__name__)
+
+# ======= نگه‌داری وضعیت گفتگوی کاربران =======
+# جایگزین دیکشنری‌های سراسری user_sessions / teacher_states / student_states / manager_states با همان رابط
+# (get، [] ، pop، in). هر namespace یک فروشگاه جدا دارد:
+#   "memory" → فقط حافظه؛ LRU با سقف SESSION_MAX_ENTRIES و حذف وضعیت‌هایی که SESSION_TTL_SECONDS بی‌استفاده مانده‌اند
+#   "sqlite" → همان حافظه‌ی محدود به عنوان کش، به‌علاوه‌ی جدول sessions با نوشتن تأخیری (write-behind):
+#              وضعیت‌های تغییرکرده هر SESSION_FLUSH_SECONDS یک‌جا و از طریق نویسنده‌ی واحد ذخیره می‌شوند و
+#              با راه‌اندازی دوباره‌ی ربات یا خارج شدن از کش، از دیتابیس بازیابی می‌شوند (پیش‌فرض)
+# هندلرها dict برگشتی را در جا تغییر می‌دهند؛ به همین دلیل هر وضعیتی که اخیراً خوانده یا نوشته شده هنگام
+# flush دوباره serialize و فقط در صورت تغییر واقعی (hash متفاوت) نوشته می‌شود. serialize و hash در thread
+# نویسنده انجام می‌شوند، نه روی event loop (وضعیت‌ها فقط از انواع داخلی پایتون ساخته شده‌اند و pickle آن‌ها
+# یک‌جا و بدون رها کردن GIL انجام می‌شود). hash نوشته‌شده فقط پس از موفقیت نوشتن ثبت می‌شود و وضعیتی
+# که نوشتنش شکست خورده در flush بعدی دوباره فرستاده می‌شود.
+# on_discard: تابع اختیاری (key, state) برای وضعیت‌هایی که بدون ذخیره کنار گذاشته می‌شوند
+# (انقضا، سقف حافظه در backend حافظه و خاموش شدن ربات)؛ مثلاً نمرات بافرشده‌ی معلم با آن ذخیره می‌شوند.
+# این تابع نباید مسدود شود (کار نوشتن را فقط در صف نویسنده قرار دهد).
+
+SESSION_BACKEND = os.environ.get("SCHOOLBOT_SESSION_BACKEND", "sqlite").lower()
+SESSION_MAX_ENTRIES = int(os.environ.get("SCHOOLBOT_SESSION_MAX_ENTRIES", 5000))
+SESSION_TTL_SECONDS = int(os.environ.get("SCHOOLBOT_SESSION_TTL", 7 * 24 * 3600))
+SESSION_FLUSH_SECONDS = float(os.environ.get("SCHOOLBOT_SESSION_FLUSH_SECONDS", 2))
+
+# وضعیتی که در این بازه استفاده شده «فعال» است و در هر flush بررسی می‌شود (تغییرات درجا پس از آخرین دسترسی)
+SESSION_ACTIVE_SECONDS = 120
+
+# حذف ردیف‌های منقضی از دیتابیس در هر این تعداد flush
+_PURGE_EVERY = 1800
+
+# ---------- serialize فشرده ----------
+# pickle با بالاترین پروتکل؛ وضعیت‌های بزرگ (مثل فهرست دانش‌آموزان کلاس) با zlib فشرده می‌شوند
+_COMPRESS_THRESHOLD = 512
+_RAW, _ZLIB = b"p", b"z"
+
+
+def dumps_state(state) -> bytes:
+    data = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+    if len(data) > _COMPRESS_THRESHOLD:
+        return _ZLIB + zlib.compress(data)
+    return _RAW + data
+
+
+def loads_state(blob: bytes):
+    data = blob[1:]
+    if blob[:1] == _ZLIB:
+        data = zlib.decompress(data)
+    return pickle.loads(data)
+
+
+def _digest(blob: bytes) -> bytes:
+    return hashlib.blake2b(blob, digest_size=16).digest()
+
+
+_MISSING = object()
+
+
+class _Entry:
+    __slots__ = ("state", "last_access", "written")
+
+    def __init__(self, state, last_access: float, written: Optional[bytes] = None):
+        self.state = state
+        self.last_access = last_access
+        self.written = written  # hash آخرین نسخه‌ی ذخیره‌شده در دیتابیس
+
+
+# ---------- فروشگاه حافظه (LRU + TTL) ----------
+class SessionStore:
+    def __init__(self, namespace: str, max_entries: int = SESSION_MAX_ENTRIES, ttl: float = SESSION_TTL_SECONDS):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[object, _Entry]" = OrderedDict()
+        self.on_discard = None
+
+    def _expired(self, entry: _Entry, now: float) -> bool:
+        return now - entry.last_access > self.ttl
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._load(key)
+            if entry is None:
+                return default
+        now = time.time()
+        if self._expired(entry, now):
+            self._discarded(key, entry.state)
+            self.pop(key)
+            return default
+        entry.last_access = now
+        self._entries.move_to_end(key)
+        self._touched(key)
+        return entry.state
+
+    def __getitem__(self, key):
+        state = self.get(key, _MISSING)
+        if state is _MISSING:
+            raise KeyError(key)
+        return state
+
+    def __setitem__(self, key, state):
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is None:
+            self._entries[key] = _Entry(state, now)
+            self._trim(now)
+        else:
+            entry.state = state
+            entry.last_access = now
+            self._entries.move_to_end(key)
+        self._touched(key)
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def pop(self, key, default=None):
+        entry = self._entries.pop(key, None)
+        self._delete(key)
+        return entry.state if entry is not None else default
+
+    async def prefetch(self, key):
+        """بارگذاری وضعیت پیش از پردازش پیام، بیرون از event loop (در فروشگاه حافظه کاری انجام نمی‌دهد)"""
+
+    def _trim(self, now: float):
+        # قدیمی‌ترین‌ها در ابتدای OrderedDict اند: وضعیت‌های منقضی و مازاد بر سقف خارج می‌شوند
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_entries and not self._expired(entry, now):
+                break
+            del self._entries[key]
+            if self._expired(entry, now):
+                self._discarded(key, entry.state)
+            else:
+                self._evicted(key, entry)
+
+    def _discarded(self, key, state):
+        if self.on_discard is None:
+            return
+        try:
+            self.on_discard(key, state)
+        except Exception as e:
+            logger.error(f"❌ خطا در on_discard برای {self.namespace}:{key}: {e}")
+
+    # ---------- نقاط اتصال فروشگاه ماندگار ----------
+    def _load(self, key) -> Optional[_Entry]:
+        return None
+
+    def _touched(self, key):
+        pass
+
+    def _evicted(self, key, entry: _Entry):
+        self._discarded(key, entry.state)
+
+    def _delete(self, key):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """هنگام خاموش شدن ربات: وضعیت‌های حافظه از بین می‌روند، پس همه به on_discard داده می‌شوند"""
+        while self._entries:
+            key, entry = self._entries.popitem(last=False)
+            self._discarded(key, entry.state)
+
+
+# ---------- دسترسی به جدول sessions ----------
+def _read_session(namespace: str, key: str):
+    with db_connection() as conn:
+        return conn.execute("SELECT state, updated_at FROM sessions WHERE namespace = ? AND key = ?",
+                            (namespace, key)).fetchone()
+
+
+@serialized_write
+def _store_sessions(rows: List[tuple]):
+    with db_connection() as conn:
+        conn.executemany("""
+            INSERT INTO sessions (namespace, key, state, updated_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(namespace, key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at
+        """, rows)
+
+
+@serialized_write
+def _delete_session(namespace: str, key: str):
+    with db_connection() as conn:
+        conn.execute("DELETE FROM sessions WHERE namespace = ? AND key = ?", (namespace, key))
+
+
+@serialized_write
+def _purge_sessions(namespace: str, before: float) -> List[tuple]:
+    """حذف وضعیت‌های منقضی؛ خروجی: ردیف‌های (key, state) حذف‌شده برای on_discard"""
+    with db_connection() as conn:
+        rows = conn.execute("SELECT key, state FROM sessions WHERE namespace = ? AND updated_at < ?",
+                            (namespace, before)).fetchall()
+        conn.execute("DELETE FROM sessions WHERE namespace = ? AND updated_at < ?", (namespace, before))
+    return rows
+
+
+# ---------- فروشگاه ماندگار (SQLite + write-behind) ----------
+class SqliteSessionStore(SessionStore):
+    def __init__(self, namespace: str, max_entries: int = SESSION_MAX_ENTRIES, ttl: float = SESSION_TTL_SECONDS):
+        super().__init__(namespace, max_entries, ttl)
+        self._dirty = set()
+        self._absent = set()  # کلیدهایی که prefetch در دیتابیس پیدا نکرد (تا get دوباره سراغ دیتابیس نرود)
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flushes = 0
+        # وضعیت‌هایی که نوشتنشان شکست خورد (در thread نویسنده پر می‌شود)؛ key → _Entry
+        self._retry: Dict[object, _Entry] = {}
+        self._retry_lock = threading.Lock()
+
+    def _install(self, key, row) -> Optional[_Entry]:
+        if row is None:
+            return None
+        blob, updated_at = row
+        try:
+            entry = _Entry(loads_state(blob), updated_at, _digest(blob))
+        except Exception as e:
+            logger.error(f"❌ وضعیت ذخیره‌شده‌ی {self.namespace}:{key} قابل خواندن نبود: {e}")
+            return None
+        if self._expired(entry, time.time()):
+            self._discarded(key, entry.state)
+            self._delete(key)
+            return None
+        self._entries[key] = entry
+        self._trim(time.time())
+        return entry
+
+    def _load(self, key) -> Optional[_Entry]:
+        # مسیر هم‌گام؛ هندلرها پیش از آن prefetch را await می‌کنند تا این‌جا فقط از کش خوانده شود
+        if key in self._absent:
+            return None
+        try:
+            return self._install(key, _read_session(self.namespace, str(key)))
+        except Exception as e:
+            logger.error(f"❌ خطا در خواندن وضعیت {self.namespace}:{key}: {e}")
+            return None
+
+    async def prefetch(self, key):
+        if key in self._entries or key in self._absent:
+            return
+        try:
+            row = await run_db(_read_session, self.namespace, str(key))
+        except Exception as e:
+            logger.error(f"❌ خطا در خواندن وضعیت {self.namespace}:{key}: {e}")
+            return
+        if key not in self._entries:  # در حین انتظار ساخته نشده باشد
+            if self._install(key, row) is None:
+                if len(self._absent) >= self.max_entries:
+                    self._absent.clear()
+                self._absent.add(key)
+
+    def _touched(self, key):
+        self._absent.discard(key)
+        self._dirty.add(key)
+        if self._flush_task is None:
+            try:
+                self._flush_task = asyncio.get_running_loop().create_task(self._flush_loop())
+            except RuntimeError:
+                pass  # بیرون از event loop (مثلاً اسکریپت‌ها) ذخیره فقط با flush انجام می‌شود
+
+    def _evicted(self, key, entry: _Entry):
+        self._dirty.discard(key)
+        self._submit_states([(key, entry, entry.state, entry.last_access)])
+
+    def _delete(self, key):
+        self._dirty.discard(key)
+        self._absent.add(key)
+        with self._retry_lock:
+            self._retry.pop(key, None)
+        writer.submit(_delete_session, self.namespace, str(key)).add_done_callback(self._deleted)
+
+    def _deleted(self, future):
+        if future.exception() is not None:
+            logger.error(f"❌ خطا در حذف وضعیت {self.namespace}: {future.exception()}")
+
+    # ---------- نوشتن تأخیری ----------
+    def _write_states(self, items: List[tuple]) -> List[tuple]:
+        """
+        در thread نویسنده: serialize هر وضعیت، مقایسه‌ی hash آن با آخرین نسخه‌ی ذخیره‌شده و نوشتن تغییرکرده‌ها
+        خروجی: [(entry, digest), ...] برای وضعیت‌های نوشته‌شده
+        """
+        rows, written = [], []
+        for key, entry, state, last_access in items:
+            try:
+                blob = dumps_state(state)
+            except Exception as e:
+                logger.error(f"❌ وضعیت {self.namespace}:{key} قابل ذخیره نیست: {e}")
+                continue
+            digest = _digest(blob)
+            if digest == entry.written:
+                continue
+            rows.append((self.namespace, str(key), blob, last_access))
+            written.append((entry, digest))
+        if rows:
+            _store_sessions(rows)
+        return written
+
+    def _submit_states(self, items: List[tuple]):
+        future = writer.submit(self._write_states, items)
+        future.add_done_callback(lambda done: self._written(done, items))
+        return future
+
+    def _written(self, future, items: List[tuple]):
+        # در thread نویسنده و پیش از کار بعدی صف اجرا می‌شود
+        if future.exception() is None:
+            for entry, digest in future.result():
+                entry.written = digest
+            return
+        logger.error(f"❌ خطا در ذخیره‌ی وضعیت‌های {self.namespace} (در flush بعدی تکرار می‌شود): "
+                     f"{future.exception()}")
+        with self._retry_lock:
+            for key, entry, _, _ in items:
+                self._retry.setdefault(key, entry)
+
+    def flush(self):
+        """ذخیره‌ی وضعیت‌های تغییرکرده؛ خروجی Future نوشتن (یا None اگر وضعیتی برای بررسی نباشد)"""
+        now = time.time()
+        with self._retry_lock:
+            retry, self._retry = self._retry, {}
+        items, active = [], set()
+        for key in self._dirty:
+            entry = self._entries.get(key)
+            if entry is None:
+                continue
+            retry.pop(key, None)
+            items.append((key, entry, entry.state, entry.last_access))
+            if now - entry.last_access < SESSION_ACTIVE_SECONDS:
+                active.add(key)
+        for key, entry in retry.items():
+            # نسخه‌ی فعلی اگر هنوز در حافظه است، وگرنه همان نسخه‌ی خارج‌شده از کش
+            entry = self._entries.get(key, entry)
+            items.append((key, entry, entry.state, entry.last_access))
+        self._dirty = active
+        self._flushes += 1
+        if self._flushes % _PURGE_EVERY == 0:
+            writer.submit(_purge_sessions, self.namespace, now - self.ttl).add_done_callback(self._purged)
+        return self._submit_states(items) if items else None
+
+    def _purged(self, future):
+        # در thread نویسنده اجرا می‌شود؛ وضعیت‌های منقضی‌ای که دیگر در حافظه نبودند به on_discard داده می‌شوند
+        if future.exception() is not None:
+            logger.error(f"❌ خطا در حذف وضعیت‌های منقضی {self.namespace}: {future.exception()}")
+            return
+        if self.on_discard is None:
+            return
+        for key, blob in future.result():
+            try:
+                state = loads_state(blob)
+            except Exception:
+                continue
+            self._discarded(key, state)
+
+    def close(self):
+        """وضعیت‌ها در دیتابیس می‌مانند؛ فقط تغییرات باقی‌مانده ذخیره می‌شوند"""
+        return self.flush()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(SESSION_FLUSH_SECONDS)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"❌ خطا در ذخیره‌ی وضعیت‌های {self.namespace}: {e}")
+
+
+# ---------- ساخت فروشگاه‌ها ----------
+_stores: Dict[str, SessionStore] = {}
+
+
+def session_store(namespace: str) -> SessionStore:
+    """فروشگاه وضعیت یک بخش ربات (مثلاً "teacher") با backend تعیین‌شده در SCHOOLBOT_SESSION_BACKEND"""
+    store = _stores.get(namespace)
+    if store is None:
+        store_class = SqliteSessionStore if SESSION_BACKEND == "sqlite" else SessionStore
+        store = _stores[namespace] = store_class(namespace)
+    return store
+
+
+def flush_sessions():
+    """ذخیره‌ی همه‌ی وضعیت‌های تغییرکرده و انتظار برای نوشتن (هنگام خاموش شدن ربات)"""
+    futures = [store.close() for store in _stores.values()]
+    # نویسنده به ترتیب صف اجرا می‌کند؛ پایان این کار یعنی نوشتن‌های on_discard هم انجام شده‌اند
+    writer.submit(lambda: None).result()
+    for future in futures:
+        if future is not None and future.exception() is not None:
+            logger.error(f"❌ خطا در ذخیره‌ی وضعیت‌ها هنگام خاموش شدن: {future.exception()}")
@@ -0,0 +1,120 @@
+# services/stats_service.py
+
+import statistics
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from schoolbot.database.connection_pool import db_connection
+
+# ======= آمار از پیش محاسبه‌شده‌ی هر (کلاس، درس، دوره) =======
+# جدول class_subject_stats در هر بار ثبت نمره (در همان تراکنش) برای همان درس به‌روز می‌شود،
+# تا کارنامه، تاریخچه و خلاصه‌ی کلاس به جای زیرکوئری‌های وابسته فقط عدد آماده بخوانند.
+# توابعی که cursor می‌گیرند باید داخل تراکنش نوشتن (serialized_write) صدا زده شوند.
+
+STATS_COLUMNS = ("count", "sum", "mean", "stddev", "min", "q1", "median", "q3", "max",
+                 "mode", "mode_freq", "below_10", "above_15")
+
+_UPSERT_STATS_SQL = f"""
+    INSERT INTO class_subject_stats (report_period_id, subject_id, class_id, {", ".join(STATS_COLUMNS)})
+    VALUES (?, ?, ?, {", ".join("?" * len(STATS_COLUMNS))})
+"""
+
+
+def compute_stats(scores: List[float]) -> Dict:
+    """
+    آمار یک گروه نمره؛ تعریف‌ها مثل نسخه‌ی NumPy در summarize_class است:
+    انحراف معیار جمعیتی و چارک‌ها با درون‌یابی خطی (معادل np.percentile).
+    """
+    scores = sorted(float(s) for s in scores)
+    n = len(scores)
+    if n == 1:
+        q1 = median = q3 = scores[0]
+    else:
+        q1, median, q3 = statistics.quantiles(scores, n=4, method="inclusive")
+    modes = statistics.multimode(scores)
+    mode = min(modes)
+    return {
+        "count": n,
+        "sum": sum(scores),
+        "mean": statistics.fmean(scores),
+        "stddev": statistics.pstdev(scores),
+        "min": scores[0], "q1": q1, "median": median, "q3": q3, "max": scores[-1],
+        "mode": mode, "mode_freq": scores.count(mode),
+        "below_10": sum(1 for s in scores if s < 10),
+        "above_15": sum(1 for s in scores if s >= 15),
+    }
+
+
+def _store_groups(cursor, report_period_id: int, subject_id: int, groups: Dict[int, List[float]]):
+    cursor.executemany(_UPSERT_STATS_SQL, [
+        (report_period_id, subject_id, class_id) + tuple(compute_stats(scores)[c] for c in STATS_COLUMNS)
+        for class_id, scores in groups.items()
+    ])
+
+
+def refresh_class_subject_stats(cursor, report_period_id: int, subject_ids: Iterable[int]):
+    """آمار همه‌ی کلاس‌های یک یا چند درس در یک دوره را از روی نمرات فعلی دوباره می‌سازد."""
+    for subject_id in set(subject_ids):
+        cursor.execute("DELETE FROM class_subject_stats WHERE report_period_id = ? AND subject_id = ?",
+                       (report_period_id, subject_id))
+        cursor.execute("""
+            SELECT st.class_id, sc.score
+            FROM scores sc
+            JOIN students st ON st.id = sc.student_id
+            WHERE sc.report_period_id = ? AND sc.subject_id = ? AND sc.score IS NOT NULL
+        """, (report_period_id, subject_id))
+        groups = {}
+        for class_id, score in cursor.fetchall():
+            groups.setdefault(class_id, []).append(score)
+        _store_groups(cursor, report_period_id, subject_id, groups)
+
+
+def rebuild_class_subject_stats(cursor):
+    """ساخت کامل جدول در یک گذر روی نمرات (برای مهاجرت)."""
+    cursor.execute("DELETE FROM class_subject_stats")
+    cursor.execute("""
+        SELECT sc.report_period_id, sc.subject_id, st.class_id, sc.score
+        FROM scores sc
+        JOIN students st ON st.id = sc.student_id
+        WHERE sc.score IS NOT NULL
+        ORDER BY sc.report_period_id, sc.subject_id
+    """)
+    current, groups = None, {}
+    for period_id, subject_id, class_id, score in cursor.fetchall():
+        if (period_id, subject_id) != current:
+            if current:
+                _store_groups(cursor, *current, groups)
+            current, groups = (period_id, subject_id), {}
+        groups.setdefault(class_id, []).append(score)
+    if current:
+        _store_groups(cursor, *current, groups)
+
+
+def get_class_subject_stats(class_id: int, subject_id: int, report_period_id: int) -> Optional[Dict]:
+    """آمار آماده‌ی یک کلاس در یک درس و دوره؛ اگر نمره‌ای ثبت نشده باشد None."""
+    with db_connection() as conn:
+        row = conn.execute(f"""
+            SELECT {", ".join(STATS_COLUMNS)} FROM class_subject_stats
+            WHERE report_period_id = ? AND subject_id = ? AND class_id = ?
+        """, (report_period_id, subject_id, class_id)).fetchone()
+    return dict(zip(STATS_COLUMNS, row)) if row else None
+
+
+def get_class_summary_inputs(class_id: int, subject_id: int,
+                             report_period_id: int) -> Tuple[Optional[Dict], int, List[float]]:
+    """
+    ورودی‌های خلاصه‌ی کلاس بدون خواندن ردیف‌های دانش‌آموزان (نام، توضیح و ...):
+    (آمار آماده یا None، تعداد دانش‌آموزان کلاس، نمرات ثبت‌شده برای نمودار)
+    """
+    stats = get_class_subject_stats(class_id, subject_id, report_period_id)
+    with db_connection() as conn:
+        class_size = conn.execute("SELECT COUNT(*) FROM students WHERE class_id = ?", (class_id,)).fetchone()[0]
+        if not stats:
+            return None, class_size, []
+        scores = [row[0] for row in conn.execute("""
+            SELECT sc.score
+            FROM scores sc
+            JOIN students st ON st.id = sc.student_id
+            WHERE sc.report_period_id = ? AND sc.subject_id = ? AND st.class_id = ? AND sc.score IS NOT NULL
+            ORDER BY st.id
+        """, (report_period_id, subject_id, class_id))]
+    return stats, class_size, scores
@@ -1,21 +1,23 @@
+import io
 import logging
 import jdatetime
 import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import numpy as np
-import tempfile
 import arabic_reshaper
 from bidi.algorithm import get_display
 
+from schoolbot.chart.chart_cache import cached_chart_images, chart_key, png_to_temp_file, remember_chart
+
 # A logger for this specific module
 log = logging.getLogger(__name__)
 
 
-def format_school_multi_period_analysis(analysis: dict, name: str):
+def build_school_multi_period_analysis(analysis: dict, name: str):
     """
     نسخه بهینه‌شده: تولید متن تحلیلی چند دوره‌ای + نمودارها برای مدیر.
-    عملکرد خروجی کاملاً مشابه نسخه اصلی است.
+    خروجی: (متن، تصویر PNG به صورت bytes یا None)
     """
 
     # ----------------- توابع کمکی -----------------
@@ -127,7 +129,14 @@ def format_school_multi_period_analysis(analysis: dict, name: str):
         return txt.strip(), None
 
     # ----------------- 3. تولید نمودارها -----------------
-    chart_path = None
+    # نمودار فقط به داده‌های تحلیل، نام و تاریخ امروز (در عنوان) بستگی دارد
+    chart_cache_key = chart_key("school_multi_period",
+                                [analysis, name, jdatetime.date.today().strftime("%Y/%m/%d")])
+    cached_images = cached_chart_images(chart_cache_key)
+    if cached_images:
+        return txt.strip(), cached_images[0]
+
+    chart_png = None
     try:
         fig, axes = plt.subplots(2, 2, figsize=(16, 12))
         axes = axes.flatten()
@@ -265,14 +274,20 @@ def format_school_multi_period_analysis(analysis: dict, name: str):
             log.error(f"panel[3] error: {e}", exc_info=True)
 
         plt.tight_layout(rect=[0, 0.03, 1, 0.96])
-        tmp_file = tempfile.NamedTemporaryFile(suffix=".png", delete=False)
-        plt.savefig(tmp_file.name, bbox_inches="tight", dpi=150)
-        chart_path = tmp_file.name
+        buffer = io.BytesIO()
+        plt.savefig(buffer, format="png", bbox_inches="tight", dpi=150)
+        chart_png = buffer.getvalue()
+        remember_chart(chart_cache_key, [chart_png])
 
     except Exception as e:
         log.error(f"figure build error: {e}", exc_info=True)
-        chart_path = None
     finally:
         plt.close('all')  # بستن تمام نمودارها برای اطمینان
 
-    return txt.strip(), chart_path
\ No newline at end of file
+    return txt.strip(), chart_png
+
+
+def format_school_multi_period_analysis(analysis: dict, name: str):
+    """سازگاری: مثل build_school_multi_period_analysis ولی نمودار در فایل موقت (فراخوان حذفش می‌کند)"""
+    txt, chart_png = build_school_multi_period_analysis(analysis, name)
+    return txt, png_to_temp_file(chart_png)
\ No newline at end of file
@@ -0,0 +1,56 @@
+# tests/conftest.py
+
+import pytest
+
+import schoolbot.database.connection_pool as connection_pool
+from schoolbot.database.data_loader import create_tables
+from schoolbot.services.report_cache import report_cache
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """دیتابیس موقت با طرح کامل (create_tables و همه‌ی مهاجرت‌ها) به جای school.db"""
+    pool = connection_pool.ConnectionPool(str(tmp_path / "school.db"))
+    monkeypatch.setattr(connection_pool, "pool", pool)
+    create_tables()
+    report_cache.clear()
+    yield pool
+    report_cache.clear()
+    pool.close_all()
+
+
+@pytest.fixture
+def school(db):
+    """
+    یک مدرسه با یک پایه و دو کلاس (سه و دو دانش‌آموز)، دو درس در هر کلاس (ریاضی با ضریب ۲ و ادبیات)
+    و یک دوره‌ی تأییدنشده.
+    """
+    with db.connection() as conn:
+        cur = conn.cursor()
+        cur.execute("INSERT INTO schools (name, manager_name, username, password) VALUES ('S', 'M', 'm', 'x')")
+        school_id = cur.lastrowid
+        cur.execute("INSERT INTO grades (name, school_id) VALUES ('10', ?)", (school_id,))
+        grade_id = cur.lastrowid
+        cur.execute("INSERT INTO teachers (name, username, password, school_id) VALUES ('T', 't', 'x', ?)",
+                    (school_id,))
+        teacher_id = cur.lastrowid
+        classes, subjects, students = {}, {}, {}
+        for class_name, size in (("A", 3), ("B", 2)):
+            cur.execute("INSERT INTO classes (name, grade_id) VALUES (?, ?)", (class_name, grade_id))
+            class_id = classes[class_name] = cur.lastrowid
+            for subject_name, coefficient in (("math", 2), ("lit", 1)):
+                cur.execute("INSERT INTO subjects (name, class_id, teacher_id, coefficient) VALUES (?, ?, ?, ?)",
+                            (subject_name, class_id, teacher_id, coefficient))
+                subjects[(class_name, subject_name)] = cur.lastrowid
+            for i in range(size):
+                username = f"{class_name}{i}"
+                cur.execute("INSERT INTO students (name, username, password, class_id) VALUES (?, ?, 'x', ?)",
+                            (username, username, class_id))
+                students[username] = (cur.lastrowid, class_name)
+        cur.execute("""
+            INSERT INTO report_periods (school_id, name, start_date, end_date, approved)
+            VALUES (?, 'P1', '2025-01-01', '2025-02-01', 0)
+        """, (school_id,))
+        period_id = cur.lastrowid
+    return {"school_id": school_id, "grade_id": grade_id, "teacher_id": teacher_id, "classes": classes,
+            "subjects": subjects, "students": students, "period_id": period_id}
@@ -0,0 +1,77 @@
+# tests/test_chart_cache.py
+
+import os
+
+import pytest
+
+from schoolbot.chart import chart_cache
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    path = tmp_path / "chart_cache"
+    monkeypatch.setattr(chart_cache, "CHART_CACHE_DIR", str(path))
+    monkeypatch.setattr(chart_cache, "_total_bytes", None)
+    return path
+
+
+def _png(i: int, size: int = 100) -> bytes:
+    return bytes([i]) * size
+
+
+def _age(digest: str, seconds_ago: float):
+    path = chart_cache._image_path(digest)
+    mtime = os.path.getmtime(path) - seconds_ago
+    os.utime(path, (mtime, mtime))
+
+
+def test_default_directory_is_outside_the_package():
+    import schoolbot
+
+    assert not chart_cache.CHART_CACHE_DIR.startswith(schoolbot.__path__[0])
+
+
+def test_identical_images_are_stored_once(cache_dir):
+    first = chart_cache.put_image(_png(1))
+    assert chart_cache.put_image(_png(1)) == first
+    assert chart_cache.get_image(first) == _png(1)
+    assert len(list(chart_cache._image_files())) == 1
+
+
+def test_eviction_removes_least_recently_used_images(cache_dir, monkeypatch):
+    monkeypatch.setattr(chart_cache, "CHART_CACHE_MAX_BYTES", 1000)
+    digests = [chart_cache.put_image(_png(i)) for i in range(8)]
+    for i, digest in enumerate(digests):
+        _age(digest, 100 - i)  # اولی قدیمی‌ترین
+    chart_cache.get_image(digests[0])  # استفاده‌ی دوباره آن را تازه می‌کند
+
+    new = [chart_cache.put_image(_png(i)) for i in range(8, 12)]  # ۱۲۰۰ بایت > سقف
+
+    remaining = {image.name[:-4] for image in chart_cache._image_files()}
+    assert sum(os.path.getsize(chart_cache._image_path(d)) for d in remaining) <= 1000
+    assert digests[0] in remaining
+    assert digests[1] not in remaining
+    assert set(new) <= remaining
+
+
+def test_evicted_image_invalidates_its_key(cache_dir, monkeypatch):
+    monkeypatch.setattr(chart_cache, "CHART_CACHE_MAX_BYTES", 250)
+    key = chart_cache.chart_key("combined", {"scores": [18.5, 12]})
+    old = chart_cache.store_chart(key, [_png(1)])
+    assert chart_cache.lookup_chart(key) == old
+    _age(old[0], 60)
+    os.utime(chart_cache._key_path(key), (os.path.getmtime(chart_cache._key_path(key)) - 60,) * 2)
+
+    chart_cache.put_image(_png(2))
+    chart_cache.put_image(_png(3))  # ۳۰۰ بایت > سقف؛ قدیمی‌ترین تصویر و کلیدش حذف می‌شوند
+
+    assert not chart_cache.has_image(old[0])
+    assert chart_cache.lookup_chart(key) is None
+    assert not os.path.exists(chart_cache._key_path(key))
+
+
+def test_chart_key_is_stable_for_equivalent_inputs():
+    import numpy as np
+
+    assert chart_cache.chart_key("radar", {"a": [1.0, 2.0]}) == chart_cache.chart_key("radar", {"a": np.array([1, 2.0])})
+    assert chart_cache.chart_key("radar", {"a": [1.0]}) != chart_cache.chart_key("radar", {"a": [1.0]}, version=2)
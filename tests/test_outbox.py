@@ -0,0 +1,83 @@
+# tests/test_outbox.py
+
+import asyncio
+import time
+
+import httpx
+import pytest
+from balethon.errors import ForbiddenError, InternalError, TooManyRequestsError
+
+from schoolbot.services import outbox
+from schoolbot.services.outbox import Outbox
+
+
+class FakeClient:
+    """client ساختگی: خطاهای failures را به ترتیب پرتاب می‌کند و ارسال‌های موفق را ثبت می‌کند"""
+
+    def __init__(self, failures=()):
+        self.failures = list(failures)
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        if self.failures:
+            raise self.failures.pop(0)
+        self.sent.append((time.monotonic(), chat_id, text))
+        return "ok"
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(outbox, "_BACKOFF_BASE", 0.01)
+
+
+def _send(client, *messages, **outbox_kwargs):
+    """ارسال (chat_id, text)ها و انتظار برای آخرین پیام؛ خروجی: نتیجه یا خطای آخرین پیام و آمار"""
+    async def run():
+        box = Outbox(client, **outbox_kwargs)
+        for chat_id, text in messages[:-1]:
+            await box.send_message(chat_id, text)
+        try:
+            result = await box.send_message(*messages[-1], wait=True)
+        except Exception as e:
+            result = e
+        return result, box.stats()
+    return asyncio.run(run())
+
+
+def test_consecutive_texts_are_coalesced():
+    client = FakeClient()
+    result, stats = _send(client, (1, "back"), (1, "menu"), (2, "other"), (1, "x"))
+    assert result == "ok"
+    assert sorted(text for _, _, text in client.sent) == ["back\n\nmenu\n\nx", "other"]
+    assert stats["coalesced"] == 2
+    assert stats["sent"] == 2
+
+
+def test_rate_limit_pauses_and_retries():
+    client = FakeClient([TooManyRequestsError(429, "slow", None, {"retry_after": 0.2})])
+    started = time.monotonic()
+    result, stats = _send(client, (1, "hi"))
+    assert result == "ok"
+    assert client.sent[0][0] - started >= 0.2
+    assert stats["rate_limited"] == 1
+    assert stats["retried"] == 1
+
+
+@pytest.mark.parametrize("error", [InternalError(500, "boom"), httpx.ConnectError("connection refused"),
+                                   ValueError("bad json")])
+def test_transient_errors_are_retried(error):
+    client = FakeClient([error])
+    result, stats = _send(client, (1, "hi"))
+    assert result == "ok"
+    assert [text for _, _, text in client.sent] == ["hi"]
+    assert stats["retried"] == 1
+    assert stats["failed"] == 0
+
+
+def test_client_errors_fail_without_retry():
+    client = FakeClient([ForbiddenError(403, "blocked")])
+    result, stats = _send(client, (1, "hi"))
+    assert isinstance(result, ForbiddenError)
+    assert client.sent == []
+    assert stats["retried"] == 0
+    assert stats["failed"] == 1
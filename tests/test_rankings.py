@@ -0,0 +1,128 @@
+# tests/test_rankings.py
+
+from schoolbot.database import roster_sync
+from schoolbot.database.connection_pool import db_connection
+from schoolbot.services import report_service
+from schoolbot.services.ranking_service import get_student_ranking, refresh_student_rankings
+
+
+def _enter_scores(school, scores):
+    """scores: {username: (math, lit)} — همان مسیر ثبت کلاسی معلم (یک دسته برای هر درس)"""
+    for subject_name, position in (("math", 0), ("lit", 1)):
+        by_subject = {}
+        for username, values in scores.items():
+            student_id, class_name = school["students"][username]
+            subject_id = school["subjects"][(class_name, subject_name)]
+            by_subject.setdefault(subject_id, []).append((student_id, values[position], None))
+        for subject_id, rows in by_subject.items():
+            report_service.save_student_scores_bulk(subject_id, school["period_id"], rows)
+
+
+def _expected_rankings(scores):
+    """رتبه‌ها با همان تعریف RANK() (تعداد معدل‌های بزرگ‌تر + ۱)، محاسبه‌شده در پایتون"""
+    averages = {u: (2 * m + l) / 3 for u, (m, l) in scores.items()}
+
+    def rank(username, group):
+        return 1 + sum(1 for other in group if averages[other] > averages[username])
+
+    expected = {}
+    for username in scores:
+        same_class = [u for u in scores if u[0] == username[0]]
+        expected[username] = (rank(username, same_class), len(same_class), rank(username, scores), len(scores))
+    return averages, expected
+
+
+def _assert_rankings(school, scores):
+    averages, expected = _expected_rankings(scores)
+    for username, (class_rank, class_count, school_rank, school_count) in expected.items():
+        ranking = get_student_ranking(school["students"][username][0], school["period_id"])
+        assert ranking is not None, username
+        assert abs(ranking["weighted_average"] - averages[username]) < 1e-9
+        assert (ranking["class_rank"], ranking["class_count"]) == (class_rank, class_count), username
+        assert (ranking["school_rank"], ranking["school_count"]) == (school_rank, school_count), username
+        # یک پایه در مدرسه؛ رتبه‌ی پایه همان رتبه‌ی مدرسه است
+        assert (ranking["grade_rank"], ranking["grade_count"]) == (school_rank, school_count), username
+
+
+SCORES = {"A0": (18, 12), "A1": (15, 20), "A2": (10, 10), "B0": (19, 19), "B1": (15, 20)}
+
+
+def test_rankings_are_built_on_approval(school):
+    _enter_scores(school, SCORES)
+    assert get_student_ranking(school["students"]["A0"][0], school["period_id"]) is None
+
+    assert report_service.toggle_report_period_approval(school["period_id"]) is True
+    _assert_rankings(school, SCORES)
+
+
+def test_unapproving_clears_rankings(school):
+    _enter_scores(school, SCORES)
+    report_service.toggle_report_period_approval(school["period_id"])
+    assert report_service.toggle_report_period_approval(school["period_id"]) is False
+    assert get_student_ranking(school["students"]["A0"][0], school["period_id"]) is None
+
+
+def test_score_write_after_approval_reranks(school):
+    _enter_scores(school, SCORES)
+    report_service.toggle_report_period_approval(school["period_id"])
+
+    student_id, _ = school["students"]["A2"]
+    report_service.save_student_score(student_id, school["subjects"][("A", "math")], school["period_id"], 20)
+    report_service.save_student_score(student_id, school["subjects"][("A", "lit")], school["period_id"], 20)
+
+    _assert_rankings(school, dict(SCORES, A2=(20, 20)))
+    assert get_student_ranking(student_id, school["period_id"])["school_rank"] == 1
+
+
+def test_bulk_write_after_approval_reranks(school):
+    _enter_scores(school, SCORES)
+    report_service.toggle_report_period_approval(school["period_id"])
+
+    changed = {"A0": (5, 12), "B1": (20, 20)}
+    _enter_scores(school, changed)
+    _assert_rankings(school, dict(SCORES, **changed))
+
+
+def test_unchanged_average_skips_rerank(school):
+    _enter_scores(school, SCORES)
+    report_service.toggle_report_period_approval(school["period_id"])
+    student_id, _ = school["students"]["A0"]
+
+    # فقط توضیح نمره عوض می‌شود؛ معدل ثابت است و رتبه‌بندی دوباره لازم نیست
+    report_service.save_student_score(student_id, school["subjects"][("A", "math")], school["period_id"], 18, "خوب")
+    with db_connection() as conn:
+        assert refresh_student_rankings(conn.cursor(), school["period_id"], [student_id]) is False
+        conn.execute("UPDATE scores SET score = 11 WHERE student_id = ? AND subject_id = ?",
+                     (student_id, school["subjects"][("A", "math")]))
+        assert refresh_student_rankings(conn.cursor(), school["period_id"], [student_id]) is True
+    _assert_rankings(school, dict(SCORES, A0=(11, 12)))
+
+
+def test_roster_refresh_registers_service_hooks():
+    import schoolbot.services.roster_refresh as roster_refresh
+
+    assert roster_refresh.refresh_period in roster_sync.period_refresh_hooks
+    roster_refresh.register()  # ثبت دوباره تکراری نمی‌شود
+    assert roster_sync.period_refresh_hooks.count(roster_refresh.refresh_period) == 1
+
+
+def test_roster_move_refreshes_rankings_through_hooks(school):
+    import schoolbot.services.roster_refresh  # noqa: F401
+
+    _enter_scores(school, SCORES)
+    report_service.toggle_report_period_approval(school["period_id"])
+    student_id, _ = school["students"]["A2"]
+
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("UPDATE students SET class_id = ? WHERE id = ?", (school["classes"]["B"], student_id))
+        cursor.execute("UPDATE scores SET subject_id = ? WHERE student_id = ? AND subject_id = ?",
+                       (school["subjects"][("B", "math")], student_id, school["subjects"][("A", "math")]))
+        cursor.execute("UPDATE scores SET subject_id = ? WHERE student_id = ? AND subject_id = ?",
+                       (school["subjects"][("B", "lit")], student_id, school["subjects"][("A", "lit")]))
+        report = roster_sync._new_report(school["school_id"])
+        roster_sync._refresh_periods(cursor, school["school_id"], [], [student_id], report, dry_run=False)
+
+    assert report["periods_refreshed"] == 1
+    ranking = get_student_ranking(student_id, school["period_id"])
+    assert (ranking["class_rank"], ranking["class_count"]) == (3, 3)
@@ -0,0 +1,105 @@
+# tests/test_report_cache.py
+
+from schoolbot.services import report_service
+from schoolbot.services.ranking_service import get_period_leaderboards
+from schoolbot.services.report_cache import (ReportCache, cached_report, get_or_compute, invalidate_period,
+                                             invalidate_school, report_cache)
+from schoolbot.services.score_service import get_student_comprehensive_report
+
+
+# ---------- خود کش ----------
+def test_invalidate_is_scoped_to_school_period_and_kind():
+    cache = ReportCache()
+    cache.put((1, 10, 100, "report"), "r1")
+    cache.put((1, 11, 100, "report"), "r2")
+    cache.put((1, None, 100, "history"), "h")
+    cache.put((2, 20, 200, "report"), "other school")
+
+    assert cache.invalidate(1, 10) == 1
+    assert cache.get((1, 10, 100, "report")) != "r1"
+    assert cache.get((1, 11, 100, "report")) == "r2"
+    assert cache.invalidate(1, kind="history") == 1
+    assert cache.get((1, 11, 100, "report")) == "r2"
+    assert cache.get((2, 20, 200, "report")) == "other school"
+
+    assert cache.invalidate(1) == 1
+    assert cache.stats()["schools"][1]["entries"] == 0
+
+
+def test_result_computed_before_invalidation_is_not_stored():
+    cache = ReportCache()
+    generation = cache.generation(1)
+    cache.invalidate(1, 10)  # در حین محاسبه نمره‌ای ثبت شد
+    cache.put((1, 10, 100, "report"), "stale", generation)
+    assert cache.stats()["schools"] == {}
+
+    cache.put((1, 10, 100, "report"), "fresh", cache.generation(1))
+    assert cache.get((1, 10, 100, "report")) == "fresh"
+
+
+def test_school_budget_evicts_least_recently_used():
+    cache = ReportCache(school_budget_bytes=200)
+    for i in range(10):
+        cache.put((1, i, 100, "report"), "x" * 50)
+    assert cache.evictions > 0
+    assert cache.stats()["schools"][1]["bytes"] <= 200
+    assert cache.get((1, 9, 100, "report")) == "x" * 50
+
+
+def test_student_school_lookup_is_memoized():
+    lookups = []
+
+    def school_of(student_id):
+        lookups.append(student_id)
+        return 7
+
+    @cached_report("report", school_of=school_of)
+    def build(student_id, report_period_id):
+        return (student_id, report_period_id)
+
+    try:
+        assert build(1, 10) == (1, 10)
+        assert build(1, 11) == (1, 11)
+        invalidate_school(7)
+        assert build(1, 10) == (1, 10)
+        assert lookups == [1]
+    finally:
+        invalidate_school(7)
+
+
+# ---------- ابطال با نوشتن‌ها ----------
+def test_score_write_invalidates_cached_report(school):
+    student_id, _ = school["students"]["A0"]
+    math = school["subjects"][("A", "math")]
+    report_service.save_student_score(student_id, math, school["period_id"], 12)
+
+    first = get_student_comprehensive_report(student_id, school["period_id"])
+    assert get_student_comprehensive_report(student_id, school["period_id"]) is first
+
+    report_service.save_student_score(student_id, math, school["period_id"], 17)
+    second = get_student_comprehensive_report(student_id, school["period_id"])
+    assert second is not first
+    assert [s["score"] for s in second["scores"] if s["subject_name"] == "math"] == [17]
+
+
+def test_score_write_invalidates_shared_leaderboard(school):
+    math = school["subjects"][("A", "math")]
+    for username, score in (("A0", 12), ("A1", 18)):
+        report_service.save_student_score(school["students"][username][0], math, school["period_id"], score)
+    report_service.toggle_report_period_approval(school["period_id"])
+    assert [row["name"] for row in get_period_leaderboards(school["period_id"])["school"]] == ["A1", "A0"]
+
+    report_service.save_student_score(school["students"]["A0"][0], math, school["period_id"], 20)
+    assert [row["name"] for row in get_period_leaderboards(school["period_id"])["school"]] == ["A0", "A1"]
+
+
+def test_invalidate_period_leaves_other_periods():
+    key_other = (3, 31, 1, "report")
+    get_or_compute((3, 30, 1, "report"), lambda: "p30")
+    get_or_compute(key_other, lambda: "p31")
+    get_or_compute((3, None, 1, "history"), lambda: "history")
+
+    invalidate_period(3, 30)
+    assert report_cache.get(key_other) == "p31"
+    assert get_or_compute((3, None, 1, "history"), lambda: "rebuilt") == "rebuilt"
+    invalidate_school(3)
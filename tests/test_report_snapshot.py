@@ -0,0 +1,81 @@
+# tests/test_report_snapshot.py
+
+import pytest
+
+pytest.importorskip("schoolbot.present.student_presenter.student_presenter")
+
+from schoolbot.database.connection_pool import db_connection  # noqa: E402
+from schoolbot.services import report_service, report_snapshot  # noqa: E402
+
+
+@pytest.fixture
+def snapshot_dir(tmp_path, monkeypatch):
+    path = tmp_path / "report_snapshots"
+    monkeypatch.setattr(report_snapshot, "SNAPSHOT_DIR", str(path))
+    return path
+
+
+def _snapshot(student_id, period_id, version):
+    return {"format": report_snapshot.SNAPSHOT_FORMAT, "data_version": version, "student_id": student_id,
+            "report_period_id": period_id, "charts": []}
+
+
+def _second_period(school):
+    with db_connection() as conn:
+        cursor = conn.execute("""
+            INSERT INTO report_periods (school_id, name, start_date, end_date, approved)
+            VALUES (?, 'P2', '2025-03-01', '2025-04-01', 0)
+        """, (school["school_id"],))
+        return cursor.lastrowid
+
+
+def test_default_directory_is_outside_the_package():
+    import schoolbot
+
+    package_dir = schoolbot.__path__[0]
+    assert not report_snapshot.SNAPSHOT_DIR.startswith(package_dir)
+
+
+def test_score_write_bumps_period_version(school):
+    version, approved, name = report_snapshot.get_period_state(school["period_id"])
+    assert (approved, name) == (False, "P1")
+
+    student_id, _ = school["students"]["A0"]
+    report_service.save_student_score(student_id, school["subjects"][("A", "math")], school["period_id"], 14)
+    assert report_snapshot.get_period_state(school["period_id"])[0] != version
+
+
+def test_other_period_approval_changes_history_version(school):
+    report_service.toggle_report_period_approval(school["period_id"])
+    version = report_snapshot.get_period_state(school["period_id"])[0]
+
+    # کارنامه‌ی P1 تاریخچه‌ی همه‌ی دوره‌های تأییدشده‌ی مدرسه را در بر دارد
+    other = _second_period(school)
+    assert report_snapshot.get_period_state(school["period_id"])[0] == version
+    report_service.toggle_report_period_approval(other)
+    changed = report_snapshot.get_period_state(school["period_id"])[0]
+    assert changed != version
+
+    student_id, _ = school["students"]["B0"]
+    report_service.save_student_score(student_id, school["subjects"][("B", "math")], other, 9)
+    assert report_snapshot.get_period_state(school["period_id"])[0] != changed
+
+
+def test_stale_snapshot_is_not_loaded(school, snapshot_dir):
+    student_id, _ = school["students"]["A0"]
+    report_service.toggle_report_period_approval(school["period_id"])
+    version = report_snapshot.get_period_state(school["period_id"])[0]
+    report_snapshot.save_snapshot(_snapshot(student_id, school["period_id"], version))
+
+    assert report_snapshot.load_snapshot(student_id, school["period_id"], version) is not None
+    report_service.save_student_score(student_id, school["subjects"][("A", "math")], school["period_id"], 16)
+    new_version = report_snapshot.get_period_state(school["period_id"])[0]
+    assert report_snapshot.load_snapshot(student_id, school["period_id"], new_version) is None
+
+
+def test_drop_period_snapshots(school, snapshot_dir):
+    student_id, _ = school["students"]["A0"]
+    report_snapshot.save_snapshot(_snapshot(student_id, school["period_id"], (0, ())))
+    assert (snapshot_dir / str(school["period_id"])).is_dir()
+    report_snapshot.drop_period_snapshots(school["period_id"])
+    assert not (snapshot_dir / str(school["period_id"])).exists()
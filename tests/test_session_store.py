@@ -0,0 +1,98 @@
+# tests/test_session_store.py
+
+from schoolbot.database.db_writer import writer
+from schoolbot.services import session_store
+from schoolbot.services.session_store import SessionStore, SqliteSessionStore
+
+
+def _drain():
+    # callbackهای Future در thread نویسنده و پیش از کار بعدی صف اجرا می‌شوند
+    writer.submit(lambda: None).result()
+
+
+def _flush(store):
+    future = store.flush()
+    if future is not None:
+        future.exception()
+    _drain()
+
+
+def _stored(db, namespace):
+    with db.connection() as conn:
+        return dict(conn.execute("SELECT key, state FROM sessions WHERE namespace = ?", (namespace,)).fetchall())
+
+
+def test_states_survive_a_new_store(db):
+    store = SqliteSessionStore("t")
+    store[1] = {"step": "enter", "students": [(i, f"name {i}") for i in range(40)]}
+    store.get(1)["step"] = "changed-in-place"
+    _flush(store)
+
+    restored = SqliteSessionStore("t")
+    assert restored.get(1)["step"] == "changed-in-place"
+    assert len(restored.get(1)["students"]) == 40
+
+    restored.pop(1)
+    _drain()
+    assert _stored(db, "t") == {}
+
+
+def test_unchanged_state_is_not_rewritten(db, monkeypatch):
+    store = SqliteSessionStore("t")
+    store[1] = {"step": "a"}
+    _flush(store)
+
+    calls = []
+    monkeypatch.setattr(session_store, "_store_sessions", lambda rows: calls.append(rows))
+    store.get(1)
+    _flush(store)
+    assert calls == []
+
+    store.get(1)["step"] = "b"
+    _flush(store)
+    assert len(calls) == 1
+
+
+def test_failed_write_is_retried(db, monkeypatch):
+    store = SqliteSessionStore("t")
+    store[1] = {"step": "a"}
+    # خارج شدن از بازه‌ی فعال تا flush کلید را از مجموعه‌ی dirty کنار بگذارد
+    store._entries[1].last_access -= session_store.SESSION_ACTIVE_SECONDS + 1
+
+    store_sessions = session_store._store_sessions
+
+    def fail_once(rows):
+        monkeypatch.setattr(session_store, "_store_sessions", store_sessions)
+        raise OSError("disk full")
+
+    monkeypatch.setattr(session_store, "_store_sessions", fail_once)
+    _flush(store)
+    assert store._entries[1].written is None
+    assert _stored(db, "t") == {}
+
+    _flush(store)
+    assert store._entries[1].written is not None
+    assert "1" in _stored(db, "t")
+
+
+def test_expired_state_is_discarded(db):
+    discarded = []
+    store = SqliteSessionStore("t", ttl=60)
+    store.on_discard = lambda key, state: discarded.append((key, state))
+    store[1] = {"step": "a"}
+    _flush(store)
+    store._entries[1].last_access -= 120
+
+    assert store.get(1) is None
+    assert discarded == [(1, {"step": "a"})]
+
+
+def test_memory_store_close_discards_states():
+    discarded = []
+    store = SessionStore("t")
+    store.on_discard = lambda key, state: discarded.append(key)
+    store[1] = {}
+    store[2] = {}
+    store.close()
+    assert sorted(discarded) == [1, 2]
+    assert len(store) == 0